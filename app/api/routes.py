@@ -1,15 +1,51 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
 from app.config import settings
 import sqlite3
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional, Literal
-from app.graph.builder import invoke_graph
+from app.graph.builder import ainvoke_graph, astream_graph, warmup_graph
 from app.graph.memory import memory_saver
+from app.tools.llm_toolkit import get_pool_stats, is_ollama_available
+from app.graph.intent_rules import get_fast_path_stats
+from app.graph.answer_cache import answer_cache
+from app.tools.sql_toolkit import sql_template_cache, gse_search
+from app.db.connection import sqlite_pool
+from app.tools.vector_store import get_vector_store_stats, get_embedding_cache_stats
+from app.tools.bm25_index import get_bm25_stats
+from app.tools.context_packer import get_context_stats
+from app.tools.rag_toolkit import get_retrieval_stats
 import traceback
 import uuid
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 app = FastAPI()
 
+# 不压缩的路径
+GZIP_EXCLUDED_PATHS = ("/api/query/stream",)
+
+class _GZipMiddleware(GZipMiddleware):
+    """对较大的响应做gzip压缩，跳过SSE流（压缩缓冲会破坏逐事件推送）"""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in GZIP_EXCLUDED_PATHS:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+app.add_middleware(_GZipMiddleware, minimum_size=1024)
+
+@app.on_event("startup")
+def startup():
+    """启动时编译处理图并构建默认模型的查询链"""
+    warmup_graph()
+
 @app.get("/healthz")
 def healthz():
     print("OpenAI Key Prefix:", settings.openai_api_key[:4])
@@ -19,28 +55,152 @@ class GSERecord(BaseModel):
     id: int
     accession: str
     title: str
+    organism: Optional[str] = None
+    platform: Optional[str] = None
+    sample_count: Optional[int] = None
+    release_date: Optional[str] = None
+    updated_date: Optional[str] = None
+    description: Optional[str] = None
+
+# /api/gse允许返回和过滤的列
+GSE_COLUMNS = ("id", "accession", "title", "organism", "platform", "sample_count", "release_date", "updated_date", "description")
+
+# 分页参数
+GSE_DEFAULT_PAGE_SIZE = 100
+GSE_MAX_PAGE_SIZE = 1000
+
+# NDJSON流式输出时每次从游标读取的行数
+GSE_STREAM_BATCH = 500
+
+def _json_bytes(obj: Any) -> bytes:
+    """编码JSON，优先使用orjson"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _gse_available_columns() -> List[str]:
+    """数据库中gse表实际存在的列（按后备表结构创建的数据库只有id、accession、title）"""
+    with sqlite_pool.connection() as conn:
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(gse)")}
+    return [column for column in GSE_COLUMNS if column in existing]
+
+def _gse_query(
+    available: List[str],
+    fields: Optional[str],
+    after_id: Optional[int],
+    organism: Optional[str],
+    platform: Optional[str],
+    title: Optional[str],
+    limit: Optional[int]
+):
+    """
+    构造/api/gse的查询语句
+
+    只查询白名单中且表中存在的列；按id做键集分页（WHERE id > ? ORDER BY id），不使用OFFSET，翻到任意页的开销相同
+
+    Returns:
+        (SQL, 参数, 返回的列)
+    """
+    if fields:
+        columns = [column.strip() for column in fields.split(",") if column.strip()]
+        unknown = [column for column in columns if column not in available]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"未知的字段: {', '.join(unknown)}，可选字段: {', '.join(available)}")
+        # 分页游标依赖id，始终返回
+        if "id" not in columns:
+            columns.insert(0, "id")
+    else:
+        columns = list(available)
+
+    filters = {"organism": organism, "platform": platform, "title": title}
+    unsupported = [name for name, value in filters.items() if value and name not in available]
+    if unsupported:
+        raise HTTPException(status_code=400, detail=f"当前数据库不支持按以下字段过滤: {', '.join(unsupported)}")
+
+    conditions, parameters = [], []
+    if after_id is not None:
+        conditions.append("id > ?")
+        parameters.append(after_id)
+    if organism:
+        conditions.append("organism = ? COLLATE NOCASE")
+        parameters.append(organism)
+    if platform:
+        conditions.append("platform = ? COLLATE NOCASE")
+        parameters.append(platform)
+    if title:
+        conditions.append("title LIKE ? ESCAPE '\\'")
+        escaped = title.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        parameters.append(f"%{escaped}%")
+
+    sql = f"SELECT {', '.join(columns)} FROM gse"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY id"
+    if limit is not None:
+        sql += " LIMIT ?"
+        parameters.append(limit)
+    return sql, parameters, columns
+
+def _stream_gse_ndjson(sql: str, parameters: List[Any], columns: List[str]):
+    """逐批从游标读取行并编码为NDJSON，不把结果整体读入内存"""
+    with sqlite_pool.connection() as conn:
+        cursor = conn.execute(sql, parameters)
+        try:
+            while True:
+                rows = cursor.fetchmany(GSE_STREAM_BATCH)
+                if not rows:
+                    break
+                yield b"".join(_json_bytes(dict(zip(columns, row))) + b"\n" for row in rows)
+        finally:
+            cursor.close()
 
 @app.get("/api/gse", response_model=List[GSERecord])
-def get_gse_records():
-    """获取所有GSE记录"""
-    conn = sqlite3.connect(settings.database_url.split("///")[-1])
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM gse")
-    results = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return results
+def get_gse_records(
+    after_id: Optional[int] = Query(None, description="只返回id大于该值的记录，取上一页响应头X-Next-After-Id的值"),
+    limit: Optional[int] = Query(None, ge=1, description=f"每页记录数，默认{GSE_DEFAULT_PAGE_SIZE}，最大{GSE_MAX_PAGE_SIZE}；NDJSON格式默认不限制"),
+    organism: Optional[str] = Query(None, description="物种，精确匹配（不区分大小写）"),
+    platform: Optional[str] = Query(None, description="平台，精确匹配（不区分大小写）"),
+    title: Optional[str] = Query(None, description="标题包含的文本"),
+    fields: Optional[str] = Query(None, description="逗号分隔的返回字段，id始终返回"),
+    format: Literal["json", "ndjson"] = Query("json", description="json返回一页数组；ndjson逐行流式返回")
+):
+    """
+    分页获取GSE记录
+
+    json格式返回一页记录，还有下一页时在响应头X-Next-After-Id中给出下一页的after_id；
+    ndjson格式直接从数据库游标逐行流式输出，适合导出大量记录
+    """
+    if format == "ndjson":
+        sql, parameters, columns = _gse_query(_gse_available_columns(), fields, after_id, organism, platform, title, limit)
+        return StreamingResponse(
+            _stream_gse_ndjson(sql, parameters, columns),
+            media_type="application/x-ndjson"
+        )
+
+    page_size = min(limit or GSE_DEFAULT_PAGE_SIZE, GSE_MAX_PAGE_SIZE)
+    # 多取一行判断是否还有下一页
+    sql, parameters, columns = _gse_query(_gse_available_columns(), fields, after_id, organism, platform, title, page_size + 1)
+    with sqlite_pool.connection() as conn:
+        rows = conn.execute(sql, parameters).fetchall()
+
+    headers = {}
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        headers["X-Next-After-Id"] = str(rows[-1][0])
+    results = [dict(zip(columns, row)) for row in rows]
+    return Response(content=_json_bytes(results), media_type="application/json", headers=headers)
 
 @app.get("/api/gse/{accession}", response_model=GSERecord)
 def get_gse_by_accession(accession: str):
     """根据登录号获取GSE记录"""
-    conn = sqlite3.connect(settings.database_url.split("///")[-1])
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM gse WHERE accession = ?", (accession,))
-    result = dict(cursor.fetchone())
-    conn.close()
-    return result
+    with sqlite_pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        cursor.execute("SELECT * FROM gse WHERE accession = ?", (accession,))
+        row = cursor.fetchone()
+    if row is None:
+        raise HTTPException(status_code=404, detail=f"未找到GSE记录: {accession}")
+    return dict(row)
 
 class QueryRequest(BaseModel):
     query: str
@@ -58,8 +218,69 @@ class QueryResponse(BaseModel):
     thread_id: Optional[str] = None
     error: Optional[str] = None
 
+def _resolve_model_provider(model_provider: Optional[str]) -> Optional[str]:
+    """检查请求的模型提供商是否可用，不可用时切换到openai"""
+    # 如果请求了ollama但没有ollama，使用openai
+    if model_provider == "ollama":
+        try:
+            import langchain_ollama
+            print("Ollama模块可用，尝试使用Ollama")
+        except ImportError:
+            print("Ollama模块不可用，自动切换到OpenAI")
+            model_provider = "openai"
+    
+    # 如果请求了qwen但没有qwen配置，使用openai
+    elif model_provider == "qwen":
+        try:
+            from langchain_openai import ChatOpenAI
+            if not (settings.qwen_api_key and settings.qwen_base_url):
+                print("Qwen API密钥未配置，自动切换到OpenAI")
+                model_provider = "openai"
+            else:
+                print("Qwen模块可用，尝试使用Qwen")
+        except ImportError:
+            print("Qwen模块不可用，自动切换到OpenAI")
+            model_provider = "openai"
+    
+    return model_provider
+
+def _resolve_thread_id(thread_id: Optional[str]) -> str:
+    """获取或生成thread_id"""
+    if not thread_id:
+        thread_id = str(uuid.uuid4())
+        print(f"生成新的会话ID: {thread_id}")
+    else:
+        print(f"使用现有会话ID: {thread_id}")
+    return thread_id
+
+def _build_response(result: Dict[str, Any], thread_id: str) -> Dict[str, Any]:
+    """从图的执行结果中提取QueryResponse字段"""
+    return {
+        "answer": result.get("answer", "无法获取答案"),
+        "intent": result.get("intent", "unknown"),
+        "sql_result": result.get("sql_answer"),
+        "rag_result": result.get("rag_answer"),
+        "model_provider": result.get("model_provider"),
+        "model_name": result.get("model_name"),
+        "thread_id": result.get("thread_id", thread_id),
+        "error": None
+    }
+
+def _build_error_response(request: QueryRequest, e: Exception) -> Dict[str, Any]:
+    """构造查询出错时返回的QueryResponse字段"""
+    return {
+        "answer": f"处理查询时出错: {str(e)}",
+        "intent": "error",
+        "sql_result": None,
+        "rag_result": None,
+        "model_provider": request.model_provider or settings.model_provider,
+        "model_name": request.model_name or settings.model_name,
+        "thread_id": request.thread_id,
+        "error": str(e)
+    }
+
 @app.post("/api/query", response_model=QueryResponse)
-def query(request: QueryRequest):
+async def query(request: QueryRequest):
     """
     处理生物信息查询
     
@@ -72,87 +293,82 @@ def query(request: QueryRequest):
     
     try:
         # 检查请求的模型提供商是否可用
-        model_provider = request.model_provider
-        
-        # 如果请求了ollama但没有ollama，使用openai
-        if model_provider == "ollama":
-            try:
-                import langchain_community.llms.ollama
-                print("Ollama模块可用，尝试使用Ollama")
-            except ImportError:
-                print("Ollama模块不可用，自动切换到OpenAI")
-                model_provider = "openai"
-        
-        # 如果请求了qwen但没有qwen配置，使用openai
-        elif model_provider == "qwen":
-            try:
-                from langchain_openai import ChatOpenAI
-                if not (settings.qwen_api_key and settings.qwen_base_url):
-                    print("Qwen API密钥未配置，自动切换到OpenAI")
-                    model_provider = "openai"
-                else:
-                    print("Qwen模块可用，尝试使用Qwen")
-            except ImportError:
-                print("Qwen模块不可用，自动切换到OpenAI")
-                model_provider = "openai"
+        model_provider = _resolve_model_provider(request.model_provider)
         
         # 获取或生成thread_id
-        thread_id = request.thread_id
-        if not thread_id:
-            thread_id = str(uuid.uuid4())
-            print(f"生成新的会话ID: {thread_id}")
-        else:
-            print(f"使用现有会话ID: {thread_id}")
+        thread_id = _resolve_thread_id(request.thread_id)
         
         # 调用图处理查询，传递模型选择参数和thread_id
-        result = invoke_graph(
+        result = await ainvoke_graph(
             request.query, 
             model_provider=model_provider, 
             model_name=request.model_name,
-            thread_id=thread_id
+            thread_id=thread_id,
+            # 延续已有对话线程的查询可能依赖上下文，不使用答案缓存
+            use_cache=not request.thread_id
         )
         
         # 提取所有结果
-        response = {
-            "answer": result.get("answer", "无法获取答案"),
-            "intent": result.get("intent", "unknown"),
-            "sql_result": result.get("sql_answer"),
-            "rag_result": result.get("rag_answer"),
-            "model_provider": result.get("model_provider"),
-            "model_name": result.get("model_name"),
-            "thread_id": result.get("thread_id", thread_id),
-            "error": None
-        }
-        
-        return response
+        return _build_response(result, thread_id)
     except Exception as e:
         error_detail = f"处理查询时出错: {str(e)}\n{traceback.format_exc()}"
         print(error_detail)
         
         # 返回错误但不中断API
-        return {
-            "answer": f"处理查询时出错: {str(e)}",
-            "intent": "error",
-            "sql_result": None,
-            "rag_result": None,
-            "model_provider": request.model_provider or settings.model_provider,
-            "model_name": request.model_name or settings.model_name,
-            "thread_id": request.thread_id,
-            "error": str(e)
-        }
+        return _build_error_response(request, e)
+
+def _format_sse(event: str, data: Dict[str, Any]) -> str:
+    """按Server-Sent Events格式编码一个事件"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/api/query/stream")
+async def query_stream(request: QueryRequest):
+    """
+    以Server-Sent Events流式处理生物信息查询
+    
+    请求体与/api/query相同。依次推送以下事件：
+    intent（意图分类结果）、sql（SQL查询结果）、token（RAG或聊天回答的增量token）、
+    rag（RAG完整结果），最后以done事件结束，数据为QueryResponse的全部字段。
+    出错时推送error事件，数据同样为QueryResponse字段。
+    """
+    if not request.query:
+        raise HTTPException(status_code=400, detail="查询不能为空")
+    
+    model_provider = _resolve_model_provider(request.model_provider)
+    thread_id = _resolve_thread_id(request.thread_id)
+    
+    async def event_stream():
+        try:
+            async for event, data in astream_graph(
+                request.query,
+                model_provider=model_provider,
+                model_name=request.model_name,
+                thread_id=thread_id,
+                use_cache=not request.thread_id
+            ):
+                if event == "done":
+                    data = _build_response(data, thread_id)
+                yield _format_sse(event, data)
+        except Exception as e:
+            error_detail = f"处理查询时出错: {str(e)}\n{traceback.format_exc()}"
+            print(error_detail)
+            yield _format_sse("error", {**_build_error_response(request, e), "thread_id": thread_id})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.get("/api/threads")
-def list_threads():
+def list_threads(limit: int = Query(100, ge=1, le=10000)):
     """
-    列出所有活跃的对话线程
+    列出对话线程
     
-    返回当前系统中存在的所有对话线程ID列表
+    按最近活动时间从新到旧返回线程ID、创建时间、最近活动时间和保留的检查点数
     """
     try:
-        # 根据LangGraph文档，list方法需要提供config参数
-        config = {}
-        threads = memory_saver.list(config)
-        return {"threads": threads}
+        return {"threads": memory_saver.list_threads(limit)}
     except Exception as e:
         error_detail = f"获取线程列表出错: {str(e)}\n{traceback.format_exc()}"
         print(error_detail)
@@ -166,12 +382,10 @@ def delete_thread(thread_id: str):
     删除指定ID的对话线程及其所有历史记录
     """
     try:
-        # 使用delete_thread方法删除线程
-        try:
-            memory_saver.delete_thread(thread_id)
-            return {"message": "对话线程已删除", "thread_id": thread_id}
-        except KeyError:
+        if memory_saver.get_tuple({"configurable": {"thread_id": thread_id}}) is None:
             raise HTTPException(status_code=404, detail="对话线程不存在")
+        memory_saver.delete_thread(thread_id)
+        return {"message": "对话线程已删除", "thread_id": thread_id}
     except HTTPException:
         raise
     except Exception as e:
@@ -187,13 +401,8 @@ def clear_all_threads():
     删除系统中所有的对话线程及其历史记录
     """
     try:
-        # 获取所有线程ID
-        config = {}
-        threads = memory_saver.list(config)
-        # 逐个删除线程
-        for thread_id in threads:
-            memory_saver.delete_thread(thread_id)
-        return {"message": "所有对话线程已清空"}
+        count = memory_saver.clear()
+        return {"message": "所有对话线程已清空", "deleted": count}
     except Exception as e:
         error_detail = f"清空线程出错: {str(e)}\n{traceback.format_exc()}"
         print(error_detail)
@@ -205,14 +414,9 @@ def get_available_models():
     # 检查Ollama是否可用
     ollama_available = False
     try:
-        import langchain_community.llms.ollama
-        try:
-            # 尝试简单调用
-            from langchain_community.llms import Ollama
-            Ollama(base_url=settings.ollama_base_url).invoke("test")
-            ollama_available = True
-        except:
-            ollama_available = False
+        import langchain_ollama
+        # 只检查服务是否响应，不调用模型生成
+        ollama_available = is_ollama_available()
     except ImportError:
         ollama_available = False
     
@@ -245,4 +449,22 @@ def get_available_models():
         ],
         "default_provider": settings.model_provider,
         "default_model": settings.model_name
-    } 
\ No newline at end of file
+    }
+
+@app.get("/api/stats")
+def get_stats():
+    """获取运行时统计信息，包括LLM客户端注册表、HTTP连接池状态、意图快速分类命中率、答案缓存命中情况和SQLite连接池状态"""
+    return {
+        "llm_pool": get_pool_stats(),
+        "intent_fast_path": get_fast_path_stats(),
+        "answer_cache": answer_cache.get_stats(),
+        "sql_template_cache": sql_template_cache.get_stats(),
+        "sqlite_pool": sqlite_pool.get_stats(),
+        "gse_search": gse_search.get_stats(),
+        "vector_store": get_vector_store_stats(),
+        "embedding_cache": get_embedding_cache_stats(),
+        "bm25_index": get_bm25_stats(),
+        "checkpointer": memory_saver.get_stats(),
+        "rag_retrieval": get_retrieval_stats(),
+        "rag_context": get_context_stats()
+    }
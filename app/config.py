@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import Literal, Optional
+from typing import Dict, Literal, Optional
 
 class Settings(BaseSettings):
     openai_api_key: str
@@ -17,6 +17,91 @@ class Settings(BaseSettings):
     model_name: str = "gpt-4o"  # 默认使用OpenAI的gpt-4o
     ollama_base_url: Optional[str] = "http://localhost:11434"  # Ollama的默认URL（可选）
     
+    # LLM HTTP连接池配置
+    llm_max_connections: int = 100  # 连接池最大连接数
+    llm_max_keepalive_connections: int = 20  # 保持长连接的最大数量
+    llm_keepalive_expiry: float = 60.0  # 空闲长连接的过期时间（秒）
+    llm_request_timeout: float = 120.0  # 单次LLM请求超时（秒）
+    
+    # 图执行配置
+    intent_fast_path_enabled: bool = True  # 是否在LLM之前使用规则快速分类意图
+    intent_fast_path_threshold: float = 0.85  # 规则分类置信度不低于该值时跳过LLM分类
+    intent_sql_single_call: bool = False  # 是否在一次LLM调用中同时完成意图分类和SQL生成，解析失败时回退到两次调用
+    branch_timeout: Optional[float] = 60.0  # SQL/RAG分支的超时时间（秒），超时后聚合器只返回已完成的结果；None表示不限制
+    
+    # SQLite连接池配置
+    sqlite_pool_size: int = 8  # 池中保留的空闲只读连接数
+    sqlite_mmap_size: int = 268435456  # 每个连接的内存映射大小（字节）
+    sqlite_cache_size_kb: int = 16384  # 每个连接的页缓存大小（KB）
+    sqlite_statement_cache: int = 256  # 每个连接缓存的预编译语句数
+    sqlite_in_memory: bool = False  # 是否把bioinfo.db复制到内存中读取，文件变化时自动重新加载
+    sqlite_refresh_interval: float = 2.0  # 内存模式下检查文件变化的最小间隔（秒）
+    
+    # 生成SQL的执行限制
+    sql_max_rows: int = 200  # 最多返回的行数
+    sql_max_result_bytes: int = 65536  # 结果文本的最大字节数
+    sql_timeout: float = 5.0  # 单条查询的执行时间上限（秒）
+    sql_large_table_rows: int = 100000  # 行数超过该值的表视为大表，拒绝没有可用索引的大表全表扫描
+    
+    # 全文检索配置
+    fts_search_limit: int = 10  # 关键词式数据集检索返回的结果数
+    
+    # SQL模板缓存配置
+    sql_template_cache_path: str = "./data/sql_templates.json"  # 参数化SQL模板的持久化文件
+    sql_template_cache_save_interval: float = 5.0  # 两次写入SQL模板缓存文件的最小间隔（秒），进程退出时保存剩余的修改
+    
+    # 答案缓存配置
+    answer_cache_enabled: bool = True  # 是否缓存查询答案
+    answer_cache_max_entries: int = 1024  # 最大缓存条目数，超出后按LRU淘汰
+    answer_cache_ttl: float = 3600.0  # 缓存条目存活时间（秒）
+    answer_cache_similarity_threshold: Optional[float] = None  # 近似重复问题的嵌入相似度阈值，如0.95；None表示只做精确匹配
+    
+    # 会话存储配置
+    checkpoint_db_path: str = "./data/checkpoints.db"  # 会话检查点的SQLite文件，多个工作进程共享
+    checkpoint_keep_last: int = 5  # 每个会话线程保留的检查点数
+    checkpoint_thread_ttl: Optional[float] = 604800.0  # 会话线程没有活动多少秒后被删除；None表示不按时间删除
+    checkpoint_max_threads: Optional[int] = 10000  # 最多保留的会话线程数，超出时删除最久未活动的线程
+    checkpoint_compact_interval: Optional[float] = 300.0  # 后台压缩会话存储的间隔（秒）；None表示不压缩
+    chat_history_max_messages: Optional[int] = 40  # 每个会话线程保存的聊天消息数上限，超出时丢弃最早的消息；None表示不限制
+    
+    # GEO元数据导入配置
+    geo_data_dir: str = "./data/geo"  # GEO SOFT/MINiML family文件所在目录
+    
+    # 嵌入模型配置
+    embedding_model: str = "bge-m3"  # Ollama嵌入模型名称
+    embedding_cache_enabled: bool = True  # 是否按(模型, 文本哈希)缓存嵌入，导入和查询共用
+    embedding_cache_path: str = "./data/embedding_cache.db"  # 嵌入缓存的SQLite文件
+    embedding_cache_memory_entries: int = 4096  # 内存LRU中保留的嵌入数
+    
+    # 向量库配置
+    vector_backend: Literal["chroma", "numpy"] = "chroma"  # RAG检索使用的向量库后端
+    vector_collection: str = "bio-rag"  # Chroma集合名称
+    vector_hnsw_space: Literal["cosine", "l2", "ip"] = "cosine"  # HNSW距离度量，只在创建集合时生效
+    vector_hnsw_m: int = 16  # HNSW每个节点的邻居数，只在创建集合时生效
+    vector_hnsw_construction_ef: int = 100  # 建索引时的候选集大小，只在创建集合时生效
+    vector_hnsw_search_ef: int = 64  # 检索时的候选集大小，越大召回率越高；打开已有集合时自动更新，不需要重新导入
+    vector_index_path: str = "./data/vector_index"  # NumPy向量索引目录（vector_backend为numpy时使用）
+    vector_index_dtype: Literal["float32", "float16"] = "float32"  # NumPy向量索引的数据类型，float16占用一半内存
+    vector_retry_interval: float = 30.0  # 向量库加载失败后重试的间隔（秒）
+    rag_top_k: int = 4  # 每次检索最多装入上下文的文本块数
+    rag_candidate_k: int = 8  # 向量检索和BM25检索各自返回的候选数，经MMR重排后装入上下文
+    rag_mmr_lambda: float = 0.7  # MMR中相关性的权重，越小越强调多样性
+    rag_duplicate_threshold: float = 0.95  # 与已选文本块的嵌入相似度不低于该值时视为近似重复并丢弃
+    rag_context_tokens: int = 2000  # 上下文的token预算
+    rag_context_tokens_by_model: Dict[str, int] = {}  # 按模型名称覆盖token预算，如{"gpt-4o": 6000}
+    bm25_enabled: bool = True  # 是否把BM25词法检索结果与向量检索结果融合
+    bm25_index_path: str = "./data/bm25_index"  # BM25索引目录，导入文档时与向量库一起构建
+    rag_metadata_filters: bool = True  # 是否从查询中提取数据集编号、物种和主题，作为预过滤条件下推到检索
+    
+    # 文档导入配置
+    corpus_dir: str = "./data/corpus"  # RAG语料目录（txt/md/JSONL），不存在或为空时使用示例文档
+    chunk_size: int = 800  # 文本块的最大字符数
+    chunk_overlap: int = 100  # 相邻文本块重叠的字符数
+    loader_workers: Optional[int] = None  # 切分文本的进程数，None表示CPU核数
+    ingest_manifest_path: str = "./data/ingest_manifest.json"  # 已导入文本块的清单，用于增量导入和断点续传
+    ingest_batch_size: int = 64  # 每批嵌入并写入向量库的文本块数
+    ingest_manifest_save_interval: float = 5.0  # 导入过程中保存清单的最小间隔（秒）
+    
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
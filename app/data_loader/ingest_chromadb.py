@@ -1,58 +1,274 @@
+"""
+增量导入文档到向量库
+
+每个文本块的ID由来源和内容的哈希得到，同一文本块在多次导入中ID不变：
+- 只有新增或内容变化的文本块会被嵌入并upsert
+- 来源中已不存在的文本块、整个消失的来源对应的文本块会被删除
+- 已导入的文本块记录在导入清单（JSON）中，导入过程中定期保存，中断后重新运行从断点继续
+
+Chroma后端直接upsert/删除；NumPy索引是只读的整体文件，有变化时重新构建
+（未变化文本块的嵌入来自嵌入缓存，不会重新计算）。
+启用BM25时，每次导入用全部文本块重新构建BM25索引（不需要嵌入，开销很小）。
+"""
 from langchain_community.vectorstores import Chroma
-from langchain_ollama import OllamaEmbeddings
 from app.data_loader.load_docs import load_documents
 from app.config import settings
+from app.tools.vector_store import get_embeddings, get_embedding_cache_stats, hnsw_metadata, resolve_vector_db_path, resolve_vector_index_path
+from app.tools.vector_index import NumpyVectorIndex
+from app.tools.bm25_index import BM25Builder, resolve_bm25_index_path
+from app.tools.metadata_filters import enrich_metadata
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set
+import hashlib
+import json
 import os
-from tqdm import tqdm
+import time
+
+# 文本块元数据的格式版本，变化后清单失效，已导入的文本块按新格式重新写入（嵌入来自缓存）
+MANIFEST_VERSION = 2
 
-def ingest_docs():
+def chunk_id(source: str, content: str) -> str:
+    """由来源和内容得到稳定的文本块ID"""
+    source_hash = hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+    content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()[:24]
+    return f"{source_hash}-{content_hash}"
+
+class IngestManifest:
     """
-    加载文档，创建嵌入，并保存到Chroma向量数据库
+    导入清单：记录每个来源已导入的文本块ID
+
+    Args:
+        path: 清单文件路径
+        target: 导入目标的标识（后端、路径、集合和嵌入模型），与清单中记录的不同时视为空清单
     """
-    print("加载文档...")
-    docs = load_documents()
-    
-    print(f"加载了 {len(docs)} 个文档")
-    
-    print("创建嵌入...")
-    # 使用本地Ollama模型创建嵌入
-    try:
-        embeddings = OllamaEmbeddings(model="bge-m3")
-        print("成功初始化Ollama嵌入模型")
-    except Exception as e:
-        print(f"初始化Ollama嵌入模型失败: {str(e)}")
-        print("使用备用嵌入方法...")
-        
-        # 使用备用嵌入方法（简单的零向量）
-        class DummyEmbeddings:
-            def embed_documents(self, texts):
-                """返回固定维度的零向量"""
-                return [[0.0] * 384 for _ in texts]
-                
-            def embed_query(self, text):
-                """返回固定维度的零向量"""
-                return [0.0] * 384
-        
-        embeddings = DummyEmbeddings()
-        print("使用备用嵌入方法（仅用于测试）")
-    
-    # 确保向量数据库目录存在
-    vector_db_path = os.path.join(os.getcwd(), "data", "chroma")
+
+    def __init__(self, path: str, target: str):
+        self.path = path
+        self.target = target
+        self.sources: Dict[str, Set[str]] = {}
+        self.complete = False
+        self._last_save = 0.0
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("target") == target:
+                    self.sources = {source: set(ids) for source, ids in data.get("sources", {}).items()}
+                    self.complete = data.get("complete", False)
+                else:
+                    print(f"导入目标已变化（{data.get('target')} -> {target}），忽略原有清单")
+            except Exception as e:
+                print(f"读取导入清单失败，视为首次导入: {e}")
+
+    def __contains__(self, item) -> bool:
+        source, chunk = item
+        return chunk in self.sources.get(source, ())
+
+    def chunk_count(self) -> int:
+        return sum(len(ids) for ids in self.sources.values())
+
+    def save(self, force: bool = True) -> None:
+        """原子地写入清单；force为False时距离上次保存不足ingest_manifest_save_interval秒则跳过"""
+        now = time.monotonic()
+        if not force and now - self._last_save < settings.ingest_manifest_save_interval:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "target": self.target,
+                "complete": self.complete,
+                "updated": time.time(),
+                "sources": {source: sorted(ids) for source, ids in self.sources.items()}
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self._last_save = now
+
+def _with_ids(docs: Iterable[Any]) -> Iterator[Any]:
+    """为文档补上source、chunk_id和可用于过滤的元数据"""
+    for doc in docs:
+        source = str(doc.metadata.get("source") or "unknown")
+        doc.metadata["source"] = source
+        doc.metadata["chunk_id"] = chunk_id(source, doc.page_content)
+        enrich_metadata(doc.metadata, doc.page_content)
+        yield doc
+
+def _batched(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _ingest_chroma(docs: Iterable[Any], embeddings: Any, stats: Dict[str, int], bm25: Optional[BM25Builder] = None) -> Any:
+    """增量导入到Chroma集合"""
+    vector_db_path = resolve_vector_db_path()
     os.makedirs(vector_db_path, exist_ok=True)
-    
-    print(f"创建向量数据库并保存到 {vector_db_path}...")
-    db = Chroma.from_documents(
-        documents=docs,
-        collection_name="bio-rag",
-        embedding=embeddings,
-        persist_directory=vector_db_path
+    manifest = IngestManifest(
+        settings.ingest_manifest_path,
+        f"v{MANIFEST_VERSION}:chroma:{vector_db_path}:{settings.vector_collection}:{settings.embedding_model}"
+    )
+
+    vectordb = Chroma(
+        collection_name=settings.vector_collection,
+        embedding_function=embeddings,
+        persist_directory=vector_db_path,
+        collection_metadata=hnsw_metadata()
+    )
+    existing = vectordb._collection.count()
+    if existing and not manifest.sources:
+        # 没有清单时无法判断已有向量的来源（如旧版本用随机ID导入的数据），清空后重新导入
+        print(f"集合中有 {existing} 条向量但没有导入清单，清空集合后重新导入")
+        vectordb.delete_collection()
+        vectordb = Chroma(
+            collection_name=settings.vector_collection,
+            embedding_function=embeddings,
+            persist_directory=vector_db_path,
+            collection_metadata=hnsw_metadata()
+        )
+    elif not existing and manifest.sources:
+        print("集合为空但导入清单中有记录，忽略清单重新导入")
+        manifest.sources = {}
+
+    print(f"增量导入到Chroma集合 {settings.vector_collection}（清单中已有 {manifest.chunk_count()} 个文本块）...")
+    manifest.complete = False
+    seen: Dict[str, Set[str]] = {}
+
+    def pending_chunks():
+        for doc in _with_ids(docs):
+            source, chunk = doc.metadata["source"], doc.metadata["chunk_id"]
+            stats["chunks"] += 1
+            ids = seen.setdefault(source, set())
+            if chunk in ids:
+                stats["duplicates"] += 1
+                continue
+            ids.add(chunk)
+            if bm25 is not None:
+                bm25.add(doc)
+            if (source, chunk) in manifest:
+                stats["unchanged"] += 1
+                continue
+            yield doc
+
+    for batch in _batched(pending_chunks(), settings.ingest_batch_size):
+        vectordb.add_texts(
+            [doc.page_content for doc in batch],
+            metadatas=[doc.metadata for doc in batch],
+            ids=[doc.metadata["chunk_id"] for doc in batch]
+        )
+        for doc in batch:
+            manifest.sources.setdefault(doc.metadata["source"], set()).add(doc.metadata["chunk_id"])
+        stats["upserted"] += len(batch)
+        manifest.save(force=False)
+
+    # 删除内容已变化的旧文本块和已消失的来源
+    stale = []
+    for source in list(manifest.sources):
+        removed = manifest.sources[source] - seen.get(source, set())
+        if removed:
+            stale.extend(removed)
+            manifest.sources[source] -= removed
+        if not manifest.sources[source]:
+            del manifest.sources[source]
+            stats["removed_sources"] += 1
+    for batch in _batched(stale, 1000):
+        vectordb.delete(ids=batch)
+    stats["deleted"] += len(stale)
+
+    manifest.complete = True
+    manifest.save()
+    return vectordb
+
+def _ingest_numpy(load: Callable[[], Iterable[Any]], embeddings: Any, stats: Dict[str, int], bm25: Optional[BM25Builder] = None) -> str:
+    """导入到NumPy索引：文本块集合与清单一致时跳过，否则重新构建"""
+    index_path = resolve_vector_index_path()
+    manifest = IngestManifest(settings.ingest_manifest_path, f"v{MANIFEST_VERSION}:numpy:{index_path}:{settings.embedding_model}")
+
+    # 第一遍只计算文本块ID（同时构建BM25索引），判断是否有变化
+    current: Dict[str, Set[str]] = {}
+    for doc in _with_ids(load()):
+        ids = current.setdefault(doc.metadata["source"], set())
+        if bm25 is not None and doc.metadata["chunk_id"] not in ids:
+            bm25.add(doc)
+        ids.add(doc.metadata["chunk_id"])
+    previous = manifest.sources
+    if manifest.complete and current == previous and os.path.exists(index_path):
+        stats["unchanged"] = sum(len(ids) for ids in current.values())
+        print("文档没有变化，跳过重新构建向量索引")
+        return index_path
+
+    stats["upserted"] = sum(len(ids - previous.get(source, set())) for source, ids in current.items())
+    stats["deleted"] = sum(len(ids - current.get(source, set())) for source, ids in previous.items())
+    stats["removed_sources"] = len(set(previous) - set(current))
+
+    def unique_chunks():
+        emitted = set()
+        for doc in _with_ids(load()):
+            stats["chunks"] += 1
+            if doc.metadata["chunk_id"] in emitted:
+                stats["duplicates"] += 1
+                continue
+            emitted.add(doc.metadata["chunk_id"])
+            yield doc
+
+    print(f"重新构建NumPy向量索引 {index_path}（新增或变化 {stats['upserted']} 个文本块，删除 {stats['deleted']} 个）...")
+    manifest.complete = False
+    manifest.save()
+    NumpyVectorIndex.build(
+        index_path,
+        unique_chunks(),
+        embeddings,
+        dtype=settings.vector_index_dtype,
+        batch_size=settings.ingest_batch_size,
+        model=settings.embedding_model
+    )
+    manifest.sources = current
+    manifest.complete = True
+    manifest.save()
+    return index_path
+
+def ingest_docs(load: Callable[[], Iterable[Any]] = load_documents):
+    """
+    加载文档并增量导入到VECTOR_BACKEND对应的向量库
+
+    Args:
+        load: 返回文档可迭代对象的函数
+    """
+    start = time.perf_counter()
+    # 嵌入模型不可用时直接失败：用占位向量导入会被记录到清单中，之后不会再被重新嵌入
+    embeddings = get_embeddings()
+    print(f"使用嵌入模型: {settings.embedding_model}")
+
+    stats = {"chunks": 0, "duplicates": 0, "unchanged": 0, "upserted": 0, "deleted": 0, "removed_sources": 0}
+    bm25 = BM25Builder(resolve_bm25_index_path()) if settings.bm25_enabled else None
+    try:
+        if settings.vector_backend == "numpy":
+            result = _ingest_numpy(load, embeddings, stats, bm25)
+        else:
+            result = _ingest_chroma(load(), embeddings, stats, bm25)
+    except BaseException:
+        if bm25 is not None:
+            bm25.abort()
+        raise
+    if bm25 is not None:
+        if len(bm25):
+            bm25.save()
+        else:
+            bm25.abort()
+
+    print(
+        f"导入完成: 文本块 {stats['chunks']} 个，未变化 {stats['unchanged']}，新增或更新 {stats['upserted']}，"
+        f"删除 {stats['deleted']}（{stats['removed_sources']} 个来源已消失），重复 {stats['duplicates']}，"
+        f"耗时 {time.perf_counter() - start:.1f}秒"
     )
-    
-    # 持久化存储
-    db.persist()
-    
-    print("向量数据库创建完成!")
-    return db
+    cache_stats = get_embedding_cache_stats()
+    if cache_stats:
+        print(f"嵌入缓存: 命中 {cache_stats['memory_hits'] + cache_stats['disk_hits']}，计算 {cache_stats['misses']}")
+    return result
 
 if __name__ == "__main__":
-    ingest_docs() 
\ No newline at end of file
+    ingest_docs()
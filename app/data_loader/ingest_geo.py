@@ -0,0 +1,545 @@
+"""
+把GEO元数据批量导入bioinfo.db
+
+从本地目录流式解析GEO的SOFT/MINiML family文件（系列、样本、平台），写入gse、gsm、gpl表：
+- 逐行（SOFT）或iterparse（MINiML）解析，跳过数据表部分，单个文件不会整体读入内存
+- 多进程并行解析，主进程用executemany批量upsert，多个文件合并在一个大事务中提交
+- 导入前删除二级索引和全文索引触发器，导入完成后重建索引、全文索引并ANALYZE
+- 已导入的文件记录在ingest_progress表中（路径、大小、修改时间），中断后重新运行会跳过已完成的文件
+
+用法:
+    python -m app.data_loader.ingest_geo [目录] [--workers N] [--restart]
+"""
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from xml.etree.ElementTree import iterparse
+from app.config import settings
+from app.tools.gse_search import drop_fts_triggers, ensure_fts_index
+from tqdm import tqdm
+import argparse
+import gzip
+import os
+import pathlib
+import sqlite3
+import tarfile
+import time
+
+# 各表写入的列，accession为唯一键
+TABLE_FIELDS = {
+    "gse": ("accession", "title", "organism", "platform", "sample_count", "release_date", "updated_date", "description"),
+    "gsm": ("accession", "title", "gse_accession", "organism", "source", "characteristics", "treatment"),
+    "gpl": ("accession", "title", "organism", "technology", "manufacturer"),
+}
+
+# 给旧数据库补列时使用的类型，未列出的列为TEXT
+COLUMN_TYPES = {"sample_count": "INTEGER"}
+
+SOFT_SUFFIXES = (".soft", ".soft.gz")
+MINIML_SUFFIXES = (".xml", ".xml.gz", ".xml.tgz", ".tgz", ".tar.gz")
+
+SCHEMA_PATH = pathlib.Path("app/db/schema.sql")
+
+PROGRESS_DDL = """
+CREATE TABLE IF NOT EXISTS ingest_progress (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    records INTEGER NOT NULL,
+    finished_at TEXT NOT NULL
+)
+"""
+
+def _strip_comments(statement: str) -> str:
+    """去掉语句开头的注释行"""
+    lines = [line for line in statement.strip().splitlines() if not line.strip().startswith("--")]
+    return "\n".join(lines).strip()
+
+def schema_statements(script: str) -> List[str]:
+    """把schema.sql拆分为完整的语句，触发器体内的分号不会拆开语句"""
+    statements, buffer = [], ""
+    for piece in script.split(";"):
+        buffer += piece + ";"
+        if sqlite3.complete_statement(buffer):
+            if _strip_comments(buffer).strip(";").strip():
+                statements.append(buffer.strip())
+            buffer = ""
+    return statements
+
+def _soft_date(value: Optional[str]) -> Optional[str]:
+    """SOFT中的日期（如Jan 15 2020）转换为ISO格式"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value.strip(), "%b %d %Y").strftime("%Y-%m-%d")
+    except ValueError:
+        return value.strip()
+
+def _join(values: List[str]) -> Optional[str]:
+    """去重后用分号连接多个值"""
+    unique = [value for value in dict.fromkeys(v.strip() for v in values) if value]
+    return "; ".join(unique) if unique else None
+
+class _FamilyRecords:
+    """
+    一个family文件中解析出的记录
+
+    样本和平台直接加入结果；系列在文件结束时补全物种、平台名称和样本数
+    """
+
+    def __init__(self):
+        self.records: Dict[str, List[Tuple]] = {"gse": [], "gsm": [], "gpl": []}
+        self.series: List[Dict[str, Any]] = []
+        self.platform_titles: Dict[str, str] = {}
+        self.sample_organisms: List[str] = []
+        self.sample_platforms: List[str] = []
+        self.sample_count = 0
+
+    def add_platform(self, record: Dict[str, Any]) -> None:
+        self.platform_titles[record["accession"]] = record["title"]
+        self._append("gpl", record)
+
+    def add_sample(self, record: Dict[str, Any], platform: Optional[str]) -> None:
+        self.sample_count += 1
+        if record.get("organism"):
+            self.sample_organisms.append(record["organism"])
+        if platform:
+            self.sample_platforms.append(platform)
+        self._append("gsm", record)
+
+    def add_series(self, record: Dict[str, Any]) -> None:
+        self.series.append(record)
+
+    def _append(self, table: str, record: Dict[str, Any]) -> None:
+        if record.get("accession") and record.get("title") is not None:
+            self.records[table].append(tuple(record.get(field) for field in TABLE_FIELDS[table]))
+
+    def finish(self) -> Dict[str, List[Tuple]]:
+        """补全系列记录并返回各表的行"""
+        for series in self.series:
+            platforms = series.pop("platform_ids", None) or self.sample_platforms
+            series["platform"] = _join([self.platform_titles.get(gpl, gpl) for gpl in platforms])
+            series["organism"] = series.get("organism") or _join(self.sample_organisms)
+            series["sample_count"] = series.get("sample_count") or self.sample_count or None
+            self._append("gse", series)
+        # 样本的所属系列缺失时，使用文件中的系列
+        if len(self.series) == 1:
+            gse = self.series[0]["accession"]
+            index = TABLE_FIELDS["gsm"].index("gse_accession")
+            self.records["gsm"] = [
+                row if row[index] else row[:index] + (gse,) + row[index + 1:]
+                for row in self.records["gsm"]
+            ]
+        return self.records
+
+def _open_text(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, "r", encoding="utf-8", errors="replace")
+
+def parse_soft(path: str) -> Dict[str, List[Tuple]]:
+    """
+    流式解析SOFT family文件
+
+    Args:
+        path: .soft或.soft.gz文件路径
+
+    Returns:
+        各表待写入的行
+    """
+    family = _FamilyRecords()
+    entity, accession, attributes = None, None, {}
+
+    def flush():
+        if entity is None:
+            return
+        first = lambda key: attributes.get(key, [None])[0]
+        if entity == "PLATFORM":
+            family.add_platform({
+                "accession": accession,
+                "title": first("Platform_title"),
+                "organism": _join(attributes.get("Platform_organism", [])),
+                "technology": first("Platform_technology"),
+                "manufacturer": first("Platform_manufacturer"),
+            })
+        elif entity == "SAMPLE":
+            series_ids = attributes.get("Sample_series_id", [])
+            family.add_sample({
+                "accession": accession,
+                "title": first("Sample_title"),
+                "gse_accession": series_ids[0] if series_ids else None,
+                "organism": _join(attributes.get("Sample_organism_ch1", [])),
+                "source": first("Sample_source_name_ch1"),
+                "characteristics": _join(attributes.get("Sample_characteristics_ch1", [])),
+                "treatment": _join(attributes.get("Sample_treatment_protocol_ch1", [])),
+            }, first("Sample_platform_id"))
+        elif entity == "SERIES":
+            status = first("Series_status")
+            family.add_series({
+                "accession": accession,
+                "title": first("Series_title"),
+                "organism": _join(attributes.get("Series_sample_organism", [])),
+                "platform_ids": attributes.get("Series_platform_id"),
+                "sample_count": len(attributes.get("Series_sample_id", [])),
+                "release_date": _soft_date(status.replace("Public on ", "")) if status else None,
+                "updated_date": _soft_date(first("Series_last_update_date")),
+                "description": _join(attributes.get("Series_summary", [])),
+            })
+
+    in_table = False
+    with _open_text(path) as f:
+        for line in f:
+            # 数据表占family文件的绝大部分，只判断首字符即可跳过
+            first_char = line[:1]
+            if in_table:
+                if first_char == "!" and line.rstrip().endswith("_table_end"):
+                    in_table = False
+                continue
+            if first_char == "^":
+                flush()
+                key, _, value = line[1:].partition("=")
+                entity, accession, attributes = key.strip().upper(), value.strip(), {}
+            elif first_char == "!":
+                key, _, value = line[1:].partition("=")
+                key = key.strip()
+                if key.endswith("_table_begin"):
+                    in_table = True
+                    continue
+                attributes.setdefault(key, []).append(value.strip())
+    flush()
+    return family.finish()
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+def _child_texts(element, name: str) -> List[str]:
+    return [(child.text or "").strip() for child in element.iter() if _local(child.tag) == name and child.text]
+
+def _iter_miniml_sources(path: str) -> Iterator[Any]:
+    """打开MINiML文件，tgz压缩包中逐个返回xml成员"""
+    if path.endswith((".tgz", ".tar.gz")):
+        with tarfile.open(path, "r|gz") as archive:
+            for member in archive:
+                if member.isfile() and member.name.endswith(".xml"):
+                    yield archive.extractfile(member)
+    elif path.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            yield f
+    else:
+        with open(path, "rb") as f:
+            yield f
+
+def parse_miniml(path: str) -> Dict[str, List[Tuple]]:
+    """
+    流式解析MINiML family文件
+
+    Args:
+        path: .xml、.xml.gz或.tgz文件路径
+
+    Returns:
+        各表待写入的行
+    """
+    family = _FamilyRecords()
+    for source in _iter_miniml_sources(path):
+        root = None
+        for event, element in iterparse(source, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = element
+                continue
+            name = _local(element.tag)
+            if name not in ("Platform", "Sample", "Series") or element.get("iid") is None:
+                continue
+
+            text = lambda child_name: next(iter(_child_texts(element, child_name)), None)
+            refs = lambda ref_name: [child.get("ref") for child in element if _local(child.tag) == ref_name]
+            if name == "Platform":
+                family.add_platform({
+                    "accession": element.get("iid"),
+                    "title": text("Title"),
+                    "organism": _join(_child_texts(element, "Organism")),
+                    "technology": text("Technology"),
+                    "manufacturer": text("Manufacturer"),
+                })
+            elif name == "Sample":
+                series_refs = refs("Series-Ref")
+                platform_refs = refs("Platform-Ref")
+                characteristics = [
+                    f"{child.get('tag')}: {(child.text or '').strip()}" if child.get("tag") else (child.text or "").strip()
+                    for child in element.iter() if _local(child.tag) == "Characteristics"
+                ]
+                family.add_sample({
+                    "accession": element.get("iid"),
+                    "title": text("Title"),
+                    "gse_accession": series_refs[0] if series_refs else None,
+                    "organism": _join(_child_texts(element, "Organism")),
+                    "source": text("Source"),
+                    "characteristics": _join(characteristics),
+                    "treatment": _join(_child_texts(element, "Treatment-Protocol")),
+                }, platform_refs[0] if platform_refs else None)
+            else:
+                family.add_series({
+                    "accession": element.get("iid"),
+                    "title": text("Title"),
+                    "organism": None,
+                    "platform_ids": refs("Platform-Ref") or None,
+                    "sample_count": len(refs("Sample-Ref")),
+                    "release_date": text("Release-Date"),
+                    "updated_date": text("Last-Update-Date"),
+                    "description": _join(_child_texts(element, "Summary")),
+                })
+            # 释放已处理的元素（包括其中的数据表）
+            element.clear()
+            if root is not None:
+                root.clear()
+    return family.finish()
+
+def parse_file(path: str) -> Tuple[str, Dict[str, List[Tuple]], Optional[str]]:
+    """
+    按扩展名解析一个family文件，供进程池调用
+
+    Returns:
+        (路径, 各表的行, 错误信息)
+    """
+    try:
+        if path.endswith(SOFT_SUFFIXES):
+            return path, parse_soft(path), None
+        return path, parse_miniml(path), None
+    except Exception as e:
+        return path, {}, f"{type(e).__name__}: {e}"
+
+def find_family_files(directory: str) -> List[str]:
+    """递归查找目录中的SOFT/MINiML文件"""
+    paths = []
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.endswith(SOFT_SUFFIXES + MINIML_SUFFIXES):
+                paths.append(os.path.join(dirpath, filename))
+    return sorted(paths)
+
+class GEOLoader:
+    """
+    把解析结果写入SQLite
+
+    Args:
+        db_path: 数据库文件路径
+        batch_size: 每次executemany的行数
+        commit_rows: 累计写入多少行后在文件边界提交事务
+    """
+
+    def __init__(self, db_path: str, batch_size: int = 5000, commit_rows: int = 200000):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.commit_rows = commit_rows
+        self.conn = sqlite3.connect(db_path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        # WAL模式下NORMAL不会在每次提交时fsync，且进程崩溃不会损坏数据库
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute("PRAGMA cache_size = -262144")
+        self.conn.execute("PRAGMA temp_store = MEMORY")
+        self.conn.execute("PRAGMA wal_autocheckpoint = 10000")
+        self._dropped_indexes: List[Tuple[str, str]] = []
+        self._pending_rows = 0
+        self.stats = {"files": 0, "failed": 0, "skipped": 0, "gse": 0, "gsm": 0, "gpl": 0}
+
+    def ensure_schema(self) -> None:
+        """创建缺少的表和索引，并给按后备表结构创建的旧表补齐列和accession唯一索引"""
+        for table, fields in TABLE_FIELDS.items():
+            existing = {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+            if not existing:
+                continue
+            for field in fields:
+                if field not in existing:
+                    self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {field} {COLUMN_TYPES.get(field, 'TEXT')}")
+                    print(f"表{table}补充列: {field}")
+            # upsert依赖accession上的唯一约束
+            if not self._has_unique_accession(table):
+                self.conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS uq_{table}_accession ON {table}(accession)")
+        if SCHEMA_PATH.exists():
+            # 只执行建表和建索引语句，不插入schema.sql中的示例数据；
+            # 全文索引在导入完成后由ensure_fts_index创建（SQLite不支持trigram时退回unicode61）
+            statements = [
+                statement for statement in schema_statements(SCHEMA_PATH.read_text())
+                if not _strip_comments(statement).upper().startswith("INSERT") and "gse_fts" not in statement
+            ]
+            if statements:
+                self.conn.executescript("\n".join(statements))
+        self.conn.execute(PROGRESS_DDL)
+
+    def _has_unique_accession(self, table: str) -> bool:
+        for index in self.conn.execute(f"PRAGMA index_list({table})").fetchall():
+            if index[2] and [row[2] for row in self.conn.execute(f'PRAGMA index_info("{index[1]}")')] == ["accession"]:
+                return True
+        return False
+
+    def completed_files(self) -> Dict[str, Tuple[int, int]]:
+        """已导入的文件及其(大小, 修改时间)"""
+        return {row[0]: (row[1], row[2]) for row in self.conn.execute("SELECT path, size, mtime_ns FROM ingest_progress")}
+
+    def drop_indexes(self) -> None:
+        """删除gse/gsm/gpl上的二级索引（保留upsert需要的唯一索引）和全文索引触发器，导入完成后重建"""
+        self._dropped_indexes = self.conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+            "AND sql NOT LIKE 'CREATE UNIQUE%' AND tbl_name IN ('gse', 'gsm', 'gpl')"
+        ).fetchall()
+        for name, _ in self._dropped_indexes:
+            self.conn.execute(f'DROP INDEX IF EXISTS "{name}"')
+        # 全文索引的同步触发器逐行更新gse_fts，导入后一次性重建更快
+        drop_fts_triggers(self.conn)
+
+    def rebuild_indexes(self) -> None:
+        start = time.perf_counter()
+        for _, sql in self._dropped_indexes:
+            self.conn.execute(sql)
+        ensure_fts_index(self.conn, rebuild=True)
+        self.conn.execute("ANALYZE")
+        print(f"重建了 {len(self._dropped_indexes)} 个索引并更新统计信息，耗时 {time.perf_counter() - start:.1f}秒")
+
+    def _upsert(self, table: str, rows: List[Tuple]) -> None:
+        fields = TABLE_FIELDS[table]
+        updates = ", ".join(f"{field} = excluded.{field}" for field in fields[1:])
+        sql = (
+            f"INSERT INTO {table} ({', '.join(fields)}) VALUES ({', '.join('?' * len(fields))}) "
+            f"ON CONFLICT(accession) DO UPDATE SET {updates}"
+        )
+        for start in range(0, len(rows), self.batch_size):
+            self.conn.executemany(sql, rows[start:start + self.batch_size])
+
+    def write_file(self, path: str, records: Dict[str, List[Tuple]]) -> None:
+        """写入一个文件的记录并记录进度；累计行数达到commit_rows时提交"""
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN")
+        count = 0
+        # 先写平台和系列，样本的外键引用的系列已存在
+        for table in ("gpl", "gse", "gsm"):
+            rows = records.get(table, [])
+            if rows:
+                self._upsert(table, rows)
+                self.stats[table] += len(rows)
+                count += len(rows)
+        stat = os.stat(path)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO ingest_progress (path, size, mtime_ns, records, finished_at) VALUES (?, ?, ?, ?, ?)",
+            (path, stat.st_size, stat.st_mtime_ns, count, datetime.now().isoformat(timespec="seconds"))
+        )
+        self.stats["files"] += 1
+        self._pending_rows += count + 1
+        if self._pending_rows >= self.commit_rows:
+            self.commit()
+
+    def commit(self) -> None:
+        if self.conn.in_transaction:
+            self.conn.execute("COMMIT")
+        self._pending_rows = 0
+
+    def close(self) -> None:
+        self.commit()
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.conn.execute("PRAGMA optimize")
+        self.conn.close()
+
+def ingest_geo(
+    directory: Optional[str] = None,
+    db_path: Optional[str] = None,
+    workers: Optional[int] = None,
+    batch_size: int = 5000,
+    commit_rows: int = 200000,
+    restart: bool = False
+) -> Dict[str, int]:
+    """
+    导入目录中的GEO family文件
+
+    Args:
+        directory: family文件所在目录，默认为settings.geo_data_dir
+        db_path: 数据库文件路径，默认为settings.database_url对应的文件
+        workers: 解析进程数，默认为CPU核数；1表示在当前进程中解析
+        batch_size: 每次executemany的行数
+        commit_rows: 累计写入多少行后提交事务
+        restart: 忽略已记录的进度，重新导入所有文件
+
+    Returns:
+        导入统计
+    """
+    directory = directory or settings.geo_data_dir
+    db_path = db_path or settings.database_url.split("///")[-1]
+    workers = workers or os.cpu_count() or 1
+
+    paths = find_family_files(directory)
+    print(f"在 {directory} 中找到 {len(paths)} 个GEO family文件")
+
+    loader = GEOLoader(db_path, batch_size=batch_size, commit_rows=commit_rows)
+    loader.ensure_schema()
+    if restart:
+        loader.conn.execute("DELETE FROM ingest_progress")
+    completed = loader.completed_files()
+    pending = []
+    for path in paths:
+        stat = os.stat(path)
+        if completed.get(path) == (stat.st_size, stat.st_mtime_ns):
+            loader.stats["skipped"] += 1
+        else:
+            pending.append(path)
+    print(f"跳过 {loader.stats['skipped']} 个已导入的文件，待导入 {len(pending)} 个")
+    if not pending:
+        # 没有新文件时只补建缺失的全文索引
+        ensure_fts_index(loader.conn)
+        loader.close()
+        return loader.stats
+
+    start = time.perf_counter()
+    loader.drop_indexes()
+    try:
+        with tqdm(total=len(pending), unit="file") as progress:
+            for path, records, error in _parse_all(pending, workers):
+                if error:
+                    loader.stats["failed"] += 1
+                    tqdm.write(f"解析失败，跳过 {path}: {error}")
+                else:
+                    loader.write_file(path, records)
+                progress.update(1)
+        loader.commit()
+    finally:
+        # 中断时也提交已完成的文件并重建索引，下次运行从断点继续
+        loader.commit()
+        loader.rebuild_indexes()
+        loader.close()
+
+    elapsed = time.perf_counter() - start
+    stats = loader.stats
+    print(
+        f"导入完成: {stats['files']} 个文件（失败 {stats['failed']}），"
+        f"GSE {stats['gse']} 条，GSM {stats['gsm']} 条，GPL {stats['gpl']} 条，"
+        f"耗时 {elapsed:.1f}秒（{stats['files'] / elapsed if elapsed else 0:.1f} 文件/秒）"
+    )
+    return stats
+
+def _parse_all(paths: List[str], workers: int) -> Iterator[Tuple[str, Dict[str, List[Tuple]], Optional[str]]]:
+    """按顺序返回解析结果，进程池中同时解析的文件数有上限，避免结果堆积在内存中"""
+    if workers <= 1:
+        for path in paths:
+            yield parse_file(path)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        window = deque()
+        remaining = iter(paths)
+        for path in remaining:
+            window.append(executor.submit(parse_file, path))
+            if len(window) >= workers * 4:
+                break
+        while window:
+            yield window.popleft().result()
+            path = next(remaining, None)
+            if path is not None:
+                window.append(executor.submit(parse_file, path))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="把GEO SOFT/MINiML family文件导入bioinfo.db")
+    parser.add_argument("directory", nargs="?", default=None, help="family文件所在目录，默认为GEO_DATA_DIR")
+    parser.add_argument("--db", default=None, help="数据库文件路径，默认为DATABASE_URL对应的文件")
+    parser.add_argument("--workers", type=int, default=None, help="解析进程数，默认为CPU核数")
+    parser.add_argument("--batch-size", type=int, default=5000, help="每次executemany的行数")
+    parser.add_argument("--commit-rows", type=int, default=200000, help="累计写入多少行后提交事务")
+    parser.add_argument("--restart", action="store_true", help="忽略已记录的进度，重新导入所有文件")
+    args = parser.parse_args()
+    ingest_geo(args.directory, args.db, args.workers, args.batch_size, args.commit_rows, args.restart)
@@ -1,51 +1,260 @@
-from langchain.schema import Document
+"""
+流式加载语料目录并切分为文本块
 
-def load_documents():
+遍历settings.corpus_dir中的txt/md/JSONL文件（文献摘要、GEO系列摘要等），逐个文件读取并按批交给进程池切分，
+按顺序逐个返回文本块：进程池中同时处理的批数有上限，语料再大内存占用也保持不变。
+语料目录不存在或为空时返回内置的示例文档。
+
+JSONL每行一条记录，正文取text/content/page_content/abstract/summary中的第一个非空字段，
+有title时拼接在正文前；其余标量字段作为元数据。
+"""
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from langchain_core.documents import Document
+from app.config import settings
+import json
+import os
+import time
+
+CORPUS_SUFFIXES = (".txt", ".md", ".markdown", ".jsonl")
+
+# 按优先级从高到低尝试的分隔符：段落、换行、中英文句末标点、分句标点、空格
+CHINESE_SEPARATORS = ["\n\n", "\n", "。", "！", "？", "；", ". ", "! ", "? ", "; ", "，", ", ", " ", ""]
+
+# JSONL记录中可作为正文的字段
+TEXT_FIELDS = ("text", "content", "page_content", "abstract", "summary")
+
+# 每批交给工作进程切分的记录数
+RECORDS_PER_BATCH = 64
+
+SAMPLE_DOCUMENTS = [
+    (
+        """
+        基因表达分析是生物信息学中的核心研究领域之一。RNA-seq（RNA测序）是一种常用的技术，
+        用于测量基因组中RNA分子的存在和数量。这种方法可以揭示特定细胞或组织在特定时间点的基因表达情况。
+        差异表达分析是RNA-seq数据分析的重要组成部分，它可以识别在不同条件下（如疾病vs健康）
+        表达水平发生显著变化的基因。常用的差异表达分析工具包括DESeq2、edgeR和limma。
+        """,
+        {"source": "基因表达分析简介", "topic": "RNA-seq"}
+    ),
+    (
+        """
+        GSE10000是一个关于小鼠肝脏表达谱的研究数据集。这项研究探索了不同饮食条件下肝脏基因表达的变化。
+        研究发现，高脂肪饮食会导致多种代谢相关基因的表达发生显著变化，特别是与脂质代谢和炎症反应相关的基因。
+        这些发现为理解肥胖和非酒精性脂肪肝疾病的分子机制提供了重要线索。
+        """,
+        {"source": "GSE10000研究摘要", "topic": "肝脏表达谱"}
+    ),
+    (
+        """
+        GSE20000是一项关于人脑单细胞测序的研究。该研究使用单细胞RNA测序技术分析了人脑不同区域的细胞类型组成。
+        研究鉴定了多种神经元和胶质细胞亚型，并描述了它们的基因表达特征。这些数据对于理解脑发育和神经精神疾病的
+        细胞机制具有重要价值。
+        """,
+        {"source": "GSE20000研究摘要", "topic": "脑单细胞测序"}
+    ),
+    (
+        """
+        蛋白质结构预测是计算生物学的重要任务。近年来，深度学习方法如AlphaFold2在这一领域取得了突破性进展。
+        这些方法能够根据氨基酸序列预测蛋白质的三维结构，准确度接近实验方法。蛋白质结构信息对于理解蛋白质功能、
+        药物设计和疾病机制研究至关重要。
+        """,
+        {"source": "蛋白质结构预测进展", "topic": "结构生物信息学"}
+    ),
+    (
+        """
+        CRISPR-Cas9是一种革命性的基因编辑技术，它允许科学家以前所未有的精度修改基因组。
+        这项技术基于细菌的免疫系统，使用RNA引导Cas9蛋白质切割特定DNA序列。CRISPR技术在基础研究、
+        医学治疗和农业应用中具有广泛前景。生物信息学工具在CRISPR实验设计、脱靶效应预测和数据分析中发挥重要作用。
+        """,
+        {"source": "CRISPR技术简介", "topic": "基因编辑"}
+    ),
+]
+
+Record = Tuple[str, Dict[str, Any]]
+
+def _clean(text: str) -> str:
+    """去掉每行首尾空白和多余的空行"""
+    lines = [line.strip() for line in text.strip().splitlines()]
+    cleaned, blank = [], False
+    for line in lines:
+        if line:
+            cleaned.append(line)
+            blank = False
+        elif not blank:
+            cleaned.append("")
+            blank = True
+    return "\n".join(cleaned)
+
+def find_corpus_files(directory: str) -> List[str]:
+    """递归查找目录中的语料文件，按路径排序"""
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.lower().endswith(CORPUS_SUFFIXES):
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+def _file_metadata(path: str, directory: str) -> Dict[str, Any]:
+    """来源为相对于语料目录的路径；文件在子目录中时以第一级子目录名作为主题"""
+    relative = os.path.relpath(path, directory).replace(os.sep, "/")
+    metadata: Dict[str, Any] = {"source": relative}
+    if "/" in relative:
+        metadata["topic"] = relative.split("/", 1)[0]
+    return metadata
+
+def _read_jsonl(path: str, metadata: Dict[str, Any]) -> Iterator[Record]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"跳过无法解析的JSONL行 {path}:{line_number}: {e}")
+                continue
+            if not isinstance(record, dict):
+                continue
+            text = next((record[field] for field in TEXT_FIELDS if isinstance(record.get(field), str) and record[field].strip()), None)
+            if text is None:
+                continue
+            title = record.get("title")
+            if isinstance(title, str) and title.strip() and title.strip() not in text:
+                text = f"{title.strip()}\n{text}"
+
+            record_metadata = dict(metadata)
+            for key, value in record.items():
+                if key not in TEXT_FIELDS and isinstance(value, (str, int, float, bool)):
+                    record_metadata[key] = value
+            # 没有显式来源时用accession或行号区分同一文件中的记录
+            if "source" not in record or not record["source"]:
+                record_metadata["source"] = record.get("accession") or f"{metadata['source']}#{line_number}"
+            yield text, record_metadata
+
+def iter_records(directory: str, paths: Optional[List[str]] = None) -> Iterator[Record]:
     """
-    返回几篇固定的生物信息学文本作为示例
+    逐条读取语料目录中的记录
+
+    Args:
+        directory: 语料目录
+        paths: 已查找到的语料文件，默认重新遍历目录
+
+    Returns:
+        (正文, 元数据)的迭代器；txt/md文件为一条记录，JSONL文件每行一条记录
     """
-    docs = [
-        Document(
-            page_content="""
-            基因表达分析是生物信息学中的核心研究领域之一。RNA-seq（RNA测序）是一种常用的技术，
-            用于测量基因组中RNA分子的存在和数量。这种方法可以揭示特定细胞或组织在特定时间点的基因表达情况。
-            差异表达分析是RNA-seq数据分析的重要组成部分，它可以识别在不同条件下（如疾病vs健康）
-            表达水平发生显著变化的基因。常用的差异表达分析工具包括DESeq2、edgeR和limma。
-            """,
-            metadata={"source": "基因表达分析简介", "topic": "RNA-seq"}
-        ),
-        Document(
-            page_content="""
-            GSE10000是一个关于小鼠肝脏表达谱的研究数据集。这项研究探索了不同饮食条件下肝脏基因表达的变化。
-            研究发现，高脂肪饮食会导致多种代谢相关基因的表达发生显著变化，特别是与脂质代谢和炎症反应相关的基因。
-            这些发现为理解肥胖和非酒精性脂肪肝疾病的分子机制提供了重要线索。
-            """,
-            metadata={"source": "GSE10000研究摘要", "topic": "肝脏表达谱"}
-        ),
-        Document(
-            page_content="""
-            GSE20000是一项关于人脑单细胞测序的研究。该研究使用单细胞RNA测序技术分析了人脑不同区域的细胞类型组成。
-            研究鉴定了多种神经元和胶质细胞亚型，并描述了它们的基因表达特征。这些数据对于理解脑发育和神经精神疾病的
-            细胞机制具有重要价值。
-            """,
-            metadata={"source": "GSE20000研究摘要", "topic": "脑单细胞测序"}
-        ),
-        Document(
-            page_content="""
-            蛋白质结构预测是计算生物学的重要任务。近年来，深度学习方法如AlphaFold2在这一领域取得了突破性进展。
-            这些方法能够根据氨基酸序列预测蛋白质的三维结构，准确度接近实验方法。蛋白质结构信息对于理解蛋白质功能、
-            药物设计和疾病机制研究至关重要。
-            """,
-            metadata={"source": "蛋白质结构预测进展", "topic": "结构生物信息学"}
-        ),
-        Document(
-            page_content="""
-            CRISPR-Cas9是一种革命性的基因编辑技术，它允许科学家以前所未有的精度修改基因组。
-            这项技术基于细菌的免疫系统，使用RNA引导Cas9蛋白质切割特定DNA序列。CRISPR技术在基础研究、
-            医学治疗和农业应用中具有广泛前景。生物信息学工具在CRISPR实验设计、脱靶效应预测和数据分析中发挥重要作用。
-            """,
-            metadata={"source": "CRISPR技术简介", "topic": "基因编辑"}
+    for path in paths if paths is not None else find_corpus_files(directory):
+        metadata = _file_metadata(path, directory)
+        try:
+            if path.lower().endswith(".jsonl"):
+                yield from _read_jsonl(path, metadata)
+            else:
+                with open(path, "r", encoding="utf-8") as f:
+                    yield f.read(), metadata
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"读取语料文件失败，跳过 {path}: {e}")
+
+_splitters: Dict[Tuple[int, int], Any] = {}
+
+def _get_splitter(chunk_size: int, chunk_overlap: int) -> Any:
+    """每个进程按参数缓存一个切分器"""
+    key = (chunk_size, chunk_overlap)
+    if key not in _splitters:
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        _splitters[key] = RecursiveCharacterTextSplitter(
+            separators=CHINESE_SEPARATORS,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            keep_separator="end"
         )
-    ]
-    
-    return docs 
\ No newline at end of file
+    return _splitters[key]
+
+def split_records(records: List[Record], chunk_size: int, chunk_overlap: int) -> List[Record]:
+    """
+    切分一批记录，在工作进程中执行
+
+    Returns:
+        (文本块, 元数据)列表，元数据中增加chunk_index
+    """
+    splitter = _get_splitter(chunk_size, chunk_overlap)
+    chunks = []
+    for text, metadata in records:
+        for index, chunk in enumerate(splitter.split_text(_clean(text))):
+            chunk = chunk.strip()
+            if chunk:
+                chunks.append((chunk, {**metadata, "chunk_index": index}))
+    return chunks
+
+def _batches(records: Iterator[Record], size: int) -> Iterator[List[Record]]:
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _split_all(batches: Iterator[List[Record]], chunk_size: int, chunk_overlap: int, workers: int) -> Iterator[Tuple[int, List[Record]]]:
+    """按顺序返回每批的记录数和切分结果，进程池中同时处理的批数有上限"""
+    if workers <= 1:
+        for batch in batches:
+            yield len(batch), split_records(batch, chunk_size, chunk_overlap)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        window = deque()
+        for batch in batches:
+            window.append((len(batch), executor.submit(split_records, batch, chunk_size, chunk_overlap)))
+            if len(window) >= workers * 4:
+                size, future = window.popleft()
+                yield size, future.result()
+        while window:
+            size, future = window.popleft()
+            yield size, future.result()
+
+def load_documents(
+    corpus_dir: Optional[str] = None,
+    chunk_size: Optional[int] = None,
+    chunk_overlap: Optional[int] = None,
+    workers: Optional[int] = None
+) -> Iterator[Document]:
+    """
+    流式加载语料目录并返回切分后的文本块
+
+    Args:
+        corpus_dir: 语料目录，默认为settings.corpus_dir
+        chunk_size: 文本块的最大字符数，默认为settings.chunk_size
+        chunk_overlap: 相邻文本块重叠的字符数，默认为settings.chunk_overlap
+        workers: 切分进程数，默认为settings.loader_workers或CPU核数；1表示在当前进程中切分
+
+    Returns:
+        Document的迭代器
+    """
+    corpus_dir = corpus_dir or settings.corpus_dir
+    chunk_size = chunk_size or settings.chunk_size
+    chunk_overlap = settings.chunk_overlap if chunk_overlap is None else chunk_overlap
+    workers = workers or settings.loader_workers or os.cpu_count() or 1
+
+    paths = find_corpus_files(corpus_dir) if os.path.isdir(corpus_dir) else []
+    if paths:
+        print(f"从 {corpus_dir} 流式加载 {len(paths)} 个语料文件（chunk_size={chunk_size}，chunk_overlap={chunk_overlap}，{workers} 个进程）")
+        records = iter_records(corpus_dir, paths)
+    else:
+        print(f"语料目录 {corpus_dir} 不存在或为空，使用示例文档")
+        records = iter(SAMPLE_DOCUMENTS)
+        workers = 1
+
+    start = time.perf_counter()
+    record_count, chunk_count = 0, 0
+    for size, chunks in _split_all(_batches(records, RECORDS_PER_BATCH), chunk_size, chunk_overlap, workers):
+        record_count += size
+        for text, metadata in chunks:
+            chunk_count += 1
+            yield Document(page_content=text, metadata=metadata)
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"语料加载完成: {record_count} 篇文档，{chunk_count} 个文本块，耗时 {elapsed:.1f}秒"
+        f"（{record_count / elapsed if elapsed else 0:.1f} 文档/秒）"
+    )
@@ -0,0 +1,217 @@
+"""
+共享的SQLite连接层
+
+API路由、SQL工具包的受控执行器和SQLDatabase都从这里获取连接：
+- 只读URI连接放入连接池复用，避免每个请求重新打开和关闭数据库
+- 每个连接设置mmap_size、cache_size等PRAGMA，并缓存预编译语句
+- 连接池只读，不修改数据库；WAL模式由schema.sql或GEO导入设置，读操作不会被写操作阻塞
+- 可选的内存模式：通过backup API把bioinfo.db复制到共享内存数据库，文件变化时自动重新加载
+"""
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+from app.config import settings
+import itertools
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+_pool_ids = itertools.count()
+
+class SQLitePool:
+    """
+    只读SQLite连接池
+
+    Args:
+        db_path: 数据库文件路径
+        size: 池中保留的空闲连接数上限
+        mmap_size: 每个连接的内存映射大小（字节）
+        cache_size_kb: 每个连接的页缓存大小（KB）
+        statement_cache: 每个连接缓存的预编译语句数
+        in_memory: 是否把数据库复制到内存中读取
+        refresh_interval: 内存模式下检查文件变化的最小间隔（秒）
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        size: int = 8,
+        mmap_size: int = 268435456,
+        cache_size_kb: int = 16384,
+        statement_cache: int = 256,
+        in_memory: bool = False,
+        refresh_interval: float = 2.0
+    ):
+        self.db_path = db_path
+        self.size = size
+        self.mmap_size = mmap_size
+        self.cache_size_kb = cache_size_kb
+        self.statement_cache = statement_cache
+        self.in_memory = in_memory
+        self.refresh_interval = refresh_interval
+
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._pool_id = next(_pool_ids)
+        self._generation = 0
+        self._conn_generation: Dict[int, int] = {}
+        self._anchor: Optional[sqlite3.Connection] = None
+        self._file_signature = None
+        self._last_check = 0.0
+        self.stats = {"created": 0, "reused": 0, "closed": 0, "reloads": 0}
+
+    def _uri(self) -> str:
+        if self.in_memory:
+            return f"file:bioinfo_snapshot_{self._pool_id}_{self._generation}?mode=memory&cache=shared"
+        return f"file:{self.db_path}?mode=ro"
+
+    def _signature(self):
+        """数据库文件及其WAL文件的修改签名"""
+        signature = []
+        for path in (self.db_path, f"{self.db_path}-wal"):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _load_snapshot(self) -> None:
+        """把数据库文件复制到新一代内存数据库，调用方需持有锁"""
+        start = time.perf_counter()
+        self._generation += 1
+        anchor = sqlite3.connect(self._uri(), uri=True, check_same_thread=False)
+        source = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        try:
+            source.backup(anchor)
+        finally:
+            source.close()
+
+        # 旧一代的空闲连接直接关闭；正在使用的连接在归还时关闭
+        old_anchor, self._anchor = self._anchor, anchor
+        self._drain_idle()
+        if old_anchor is not None:
+            old_anchor.close()
+        self._file_signature = self._signature()
+        self.stats["reloads"] += 1
+        print(f"已将数据库加载到内存: {self.db_path}（第{self._generation}代，{time.perf_counter() - start:.3f}秒）")
+
+    def _maybe_reload(self) -> None:
+        """内存模式下，数据库文件变化时重新加载"""
+        now = time.monotonic()
+        if self._anchor is not None and now - self._last_check < self.refresh_interval:
+            return
+        with self._lock:
+            if self._anchor is not None and now - self._last_check < self.refresh_interval:
+                return
+            self._last_check = now
+            if self._anchor is None or self._signature() != self._file_signature:
+                self._load_snapshot()
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        打开一个新的只读连接并设置PRAGMA，不经过连接池
+
+        Returns:
+            sqlite3连接
+        """
+        if self.in_memory:
+            self._maybe_reload()
+        # 打开连接和记录代数在同一次持锁内完成，重新加载不会夹在两者之间，
+        # 否则旧一代的连接会被记成新一代而留在连接池中
+        with self._lock:
+            conn = sqlite3.connect(
+                self._uri(),
+                uri=True,
+                check_same_thread=False,
+                cached_statements=self.statement_cache
+            )
+            self._conn_generation[id(conn)] = self._generation
+            self.stats["created"] += 1
+        if not self.in_memory:
+            conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size = -{int(self.cache_size_kb)}")
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute("PRAGMA busy_timeout = 5000")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """从池中取出一个连接，没有空闲连接时新建"""
+        if self.in_memory:
+            self._maybe_reload()
+        with self._lock:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                if self._conn_generation.get(id(conn)) == self._generation:
+                    self.stats["reused"] += 1
+                    return conn
+                self._close(conn)
+        return self.connect()
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        """归还连接；池已满或连接属于旧一代内存数据库时关闭"""
+        if conn.in_transaction:
+            conn.rollback()
+        # 检查代数和放回空闲队列需在同一次持锁内完成，避免重新加载清空空闲连接后又放回旧一代的连接
+        with self._lock:
+            if self._conn_generation.get(id(conn)) != self._generation or self._idle.qsize() >= self.size:
+                self._close(conn)
+                return
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """以上下文管理器的方式借用连接"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def _close(self, conn: sqlite3.Connection) -> None:
+        """关闭连接并清除其代数记录，调用方需持有锁"""
+        self._conn_generation.pop(id(conn), None)
+        conn.close()
+        self.stats["closed"] += 1
+
+    def _drain_idle(self) -> None:
+        """关闭所有空闲连接，调用方需持有锁"""
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+    def close(self) -> None:
+        """关闭所有空闲连接和内存数据库"""
+        with self._lock:
+            self._drain_idle()
+            if self._anchor is not None:
+                self._anchor.close()
+                self._anchor = None
+
+    def get_stats(self) -> Dict[str, object]:
+        """获取连接池统计信息"""
+        with self._lock:
+            return {
+                **self.stats,
+                "idle": self._idle.qsize(),
+                "size": self.size,
+                "in_memory": self.in_memory,
+                "generation": self._generation
+            }
+
+# 进程级连接池
+sqlite_pool = SQLitePool(
+    settings.database_url.split("///")[-1],
+    size=settings.sqlite_pool_size,
+    mmap_size=settings.sqlite_mmap_size,
+    cache_size_kb=settings.sqlite_cache_size_kb,
+    statement_cache=settings.sqlite_statement_cache,
+    in_memory=settings.sqlite_in_memory,
+    refresh_interval=settings.sqlite_refresh_interval
+)
@@ -1,3 +1,6 @@
+-- WAL模式持久化在数据库文件中，只需在建库时设置一次；读操作不会被数据加载阻塞
+PRAGMA journal_mode = WAL;
+
 -- 基因表达系列表
 CREATE TABLE IF NOT EXISTS gse (
     id INTEGER PRIMARY KEY,
@@ -24,6 +27,33 @@ CREATE TABLE IF NOT EXISTS gsm (
     FOREIGN KEY(gse_accession) REFERENCES gse(accession)
 );
 
+-- 平台表
+CREATE TABLE IF NOT EXISTS gpl (
+    id INTEGER PRIMARY KEY,
+    accession TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    organism TEXT,
+    technology TEXT,
+    manufacturer TEXT
+);
+
+-- GSE标题和摘要的全文索引（外部内容表，内容来自gse），由触发器与gse保持同步
+-- 应用只读打开数据库，不会创建索引；索引缺失时关键词检索回退到LLM生成SQL
+CREATE VIRTUAL TABLE IF NOT EXISTS gse_fts USING fts5(title, description, content='gse', content_rowid='id', tokenize='trigram');
+
+CREATE TRIGGER IF NOT EXISTS gse_fts_ai AFTER INSERT ON gse BEGIN
+    INSERT INTO gse_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+END;
+
+CREATE TRIGGER IF NOT EXISTS gse_fts_ad AFTER DELETE ON gse BEGIN
+    INSERT INTO gse_fts(gse_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+END;
+
+CREATE TRIGGER IF NOT EXISTS gse_fts_au AFTER UPDATE OF title, description ON gse BEGIN
+    INSERT INTO gse_fts(gse_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+    INSERT INTO gse_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+END;
+
 -- 插入示例GSE数据
 INSERT OR IGNORE INTO gse (accession, title, organism, platform, sample_count, release_date, description) 
 VALUES 
@@ -42,4 +72,11 @@ VALUES
 -- 创建索引以加速查询
 CREATE INDEX IF NOT EXISTS idx_gse_accession ON gse(accession);
 CREATE INDEX IF NOT EXISTS idx_gsm_accession ON gsm(accession);
-CREATE INDEX IF NOT EXISTS idx_gsm_gse_accession ON gsm(gse_accession); 
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_gsm_gse_accession ON gsm(gse_accession);
+CREATE INDEX IF NOT EXISTS idx_gsm_organism ON gsm(organism); 
+-- /api/gse按物种、平台过滤（不区分大小写），索引隐含rowid，可同时满足按id的键集分页
+CREATE INDEX IF NOT EXISTS idx_gse_organism ON gse(organism COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_gse_platform ON gse(platform COLLATE NOCASE);
+
+-- 已有数据的数据库新建全文索引后，从gse重建索引内容
+INSERT INTO gse_fts(gse_fts) VALUES ('rebuild');
@@ -0,0 +1,304 @@
+"""
+查询答案缓存
+
+位于invoke_graph之前，相同问题（归一化后）在同一模型下直接返回缓存的答案。
+缓存按LRU+TTL淘汰；bioinfo.db或向量库发生变化时整体失效。
+可选地通过查询嵌入的余弦相似度匹配近似重复的问题；只有登录号、数字和引号字符串完全相同的问题才能近似命中，
+避免"GSE10000有多少样本"命中"GSE20000有多少样本"的答案。
+"""
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from app.config import settings
+from app.graph.intent_rules import classify_by_rules
+from app.tools.sql_template_cache import extract_literals
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+# 缓存的结果字段
+CACHED_FIELDS = ("answer", "intent", "sql_answer", "rag_answer", "model_provider", "model_name")
+
+# 表示分支失败或超时的结果前缀，这类结果不缓存
+FAILURE_PREFIXES = (
+    "SQL查询超时", "SQL查询错误", "生成SQL查询失败",
+    "RAG查询超时", "RAG查询错误", "检索错误", "生成回答时出错",
+    "处理查询时出错"
+)
+
+def normalize_query(query: str) -> str:
+    """
+    归一化查询文本：全角转半角、小写、合并空白、去掉结尾标点
+
+    Args:
+        query: 原始查询
+
+    Returns:
+        归一化后的查询
+    """
+    text = unicodedata.normalize("NFKC", query).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip("?!.。！？~ ")
+
+def _path_signature(path: str) -> Tuple:
+    """文件或目录（只看第一层）的修改时间签名"""
+    try:
+        if os.path.isdir(path):
+            return tuple(sorted(
+                (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+                for entry in os.scandir(path)
+            ))
+        stat = os.stat(path)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return ()
+
+class DataVersionWatcher:
+    """
+    检测bioinfo.db和向量库是否发生变化
+
+    SQLite的PRAGMA data_version在其他连接提交写入后会变化，因此这里保持一个只读的长连接；
+    文件签名用于检测数据库文件被整体替换的情况
+    """
+
+    def __init__(self, db_path: str, vector_db_path: str):
+        self.db_path = db_path
+        self.vector_db_path = vector_db_path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _pragma_versions(self) -> Tuple:
+        if self._conn is None:
+            if not os.path.exists(self.db_path):
+                return ()
+            self._conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        schema_version = self._conn.execute("PRAGMA schema_version").fetchone()[0]
+        return (data_version, schema_version)
+
+    def current(self) -> Tuple:
+        """返回当前数据版本标识，任一数据源变化时该值随之变化"""
+        with self._lock:
+            try:
+                versions = self._pragma_versions()
+            except sqlite3.Error:
+                versions = ()
+        return (versions, _path_signature(self.db_path), _path_signature(self.vector_db_path))
+
+class AnswerCache:
+    """
+    LRU+TTL答案缓存
+
+    Args:
+        max_entries: 最大缓存条目数
+        ttl: 条目存活时间（秒）
+        version_fn: 返回当前数据版本的函数，版本变化时清空缓存
+        similarity_threshold: 近似重复匹配的余弦相似度阈值，None表示只做精确匹配
+        embed_fn: 计算查询嵌入的函数，启用近似匹配时需要
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: float,
+        version_fn: Callable[[], Any],
+        similarity_threshold: Optional[float] = None,
+        embed_fn: Optional[Callable[[str], List[float]]] = None
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version_fn = version_fn
+        self.similarity_threshold = similarity_threshold
+        self.embed_fn = embed_fn
+        self._entries: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self.stats = {
+            "hits": 0, "semantic_hits": 0, "misses": 0, "stores": 0,
+            "evictions": 0, "expirations": 0, "invalidations": 0, "bypasses": 0
+        }
+
+    def make_key(self, query: str, model_provider: str, model_name: str) -> Tuple[tuple, Optional[str]]:
+        """
+        构造缓存键
+
+        意图由规则分类得到，不需要调用LLM；规则无法判断时记为unknown
+
+        Returns:
+            (缓存键, 规则分类得到的意图)
+        """
+        intent, _ = classify_by_rules(query)
+        normalized = normalize_query(query)
+        return (normalized, model_provider, model_name, intent or "unknown"), intent
+
+    def _check_version(self) -> None:
+        """数据版本变化时清空缓存，调用方需持有锁"""
+        version = self.version_fn()
+        if version != self._version:
+            if self._entries:
+                self.stats["invalidations"] += 1
+                print("数据版本变化，答案缓存已清空")
+            self._entries.clear()
+            self._version = version
+
+    def _embed(self, text: str) -> Optional[List[float]]:
+        if self.similarity_threshold is None or self.embed_fn is None:
+            return None
+        try:
+            return self.embed_fn(text)
+        except Exception as e:
+            print(f"计算查询嵌入失败，跳过近似匹配: {e}")
+            return None
+
+    @staticmethod
+    def _literals(text: str) -> tuple:
+        """问题中的字面量（登录号、数字、引号字符串）的值，近似匹配时必须完全相同"""
+        _, literals = extract_literals(text)
+        return tuple(value for _, value in literals)
+
+    def get(self, key: tuple) -> Optional[Dict[str, Any]]:
+        """
+        查找缓存的答案
+
+        Args:
+            key: make_key返回的缓存键
+
+        Returns:
+            缓存的结果字段，未命中时返回None
+        """
+        # 嵌入计算可能较慢，在锁外完成
+        embedding = None
+        with self._lock:
+            self._check_version()
+            entry = self._lookup_exact(key)
+            if entry is not None:
+                self.stats["hits"] += 1
+                return dict(entry["result"])
+            semantic_enabled = self.similarity_threshold is not None and self.embed_fn is not None
+
+        if semantic_enabled:
+            embedding = self._embed(key[0])
+        literals = self._literals(key[0]) if embedding is not None else ()
+        with self._lock:
+            if embedding is not None:
+                entry = self._lookup_similar(key, embedding, literals)
+                if entry is not None:
+                    self.stats["semantic_hits"] += 1
+                    return dict(entry["result"])
+            self.stats["misses"] += 1
+        return None
+
+    def _lookup_exact(self, key: tuple) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry["created"] > self.ttl:
+            del self._entries[key]
+            self.stats["expirations"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _lookup_similar(self, key: tuple, embedding: List[float], literals: tuple) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        best_key, best_score = None, self.similarity_threshold
+        for other_key, entry in self._entries.items():
+            if other_key[1:] != key[1:] or entry["embedding"] is None:
+                continue
+            # 字面量不同的问题（如不同的数据集编号）嵌入相近但答案不同
+            if entry["literals"] != literals:
+                continue
+            if now - entry["created"] > self.ttl:
+                continue
+            score = _cosine(embedding, entry["embedding"])
+            if score >= best_score:
+                best_key, best_score = other_key, score
+        if best_key is None:
+            return None
+        self._entries.move_to_end(best_key)
+        print(f"答案缓存近似命中 (相似度 {best_score:.3f})")
+        return self._entries[best_key]
+
+    def put(self, key: tuple, result: Dict[str, Any]) -> None:
+        """
+        缓存查询结果；聊天意图、出错或超时的结果不缓存
+
+        Args:
+            key: make_key返回的缓存键
+            result: 图的执行结果
+        """
+        if not is_cacheable(result):
+            return
+        cached = {field: result.get(field) for field in CACHED_FIELDS}
+        embedding = self._embed(key[0])
+        with self._lock:
+            self._check_version()
+            self._entries[key] = {"result": cached, "created": time.monotonic(), "embedding": embedding, "literals": self._literals(key[0])}
+            self._entries.move_to_end(key)
+            self.stats["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["semantic_hits"] + self.stats["misses"]
+            hits = self.stats["hits"] + self.stats["semantic_hits"]
+            return {
+                **self.stats,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hit_rate": hits / lookups if lookups else 0.0
+            }
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+def is_cacheable(result: Dict[str, Any]) -> bool:
+    """判断结果是否可以缓存：需要有意图和答案，且不是聊天或失败的结果"""
+    intent = result.get("intent")
+    if not intent or intent in ("chat", "error") or not result.get("answer"):
+        return False
+    for field in ("answer", "sql_answer", "rag_answer"):
+        value = result.get(field)
+        if isinstance(value, str) and value.startswith(FAILURE_PREFIXES):
+            return False
+    sql_answer = result.get("sql_answer")
+    if isinstance(sql_answer, str) and "\n\n错误: " in sql_answer:
+        return False
+    return True
+
+def _default_embed_fn() -> Optional[Callable[[str], List[float]]]:
+    """启用近似匹配时使用Ollama嵌入模型计算查询嵌入"""
+    if settings.answer_cache_similarity_threshold is None:
+        return None
+    try:
+        # 与RAG检索共用嵌入模型和嵌入缓存
+        from app.tools.vector_store import get_embeddings
+        return get_embeddings().embed_query
+    except Exception as e:
+        print(f"初始化答案缓存嵌入模型失败，仅使用精确匹配: {e}")
+        return None
+
+# 进程级答案缓存
+answer_cache = AnswerCache(
+    max_entries=settings.answer_cache_max_entries,
+    ttl=settings.answer_cache_ttl,
+    version_fn=DataVersionWatcher(
+        settings.database_url.split("///")[-1],
+        settings.vector_index_path if settings.vector_backend == "numpy" else settings.vector_db_path
+    ).current,
+    similarity_threshold=settings.answer_cache_similarity_threshold,
+    embed_fn=_default_embed_fn()
+)
@@ -1,30 +1,47 @@
-from typing import Dict, Any, TypedDict, Optional, Annotated, Literal, List
+from typing import Dict, Any, TypedDict, Optional, Annotated, Literal, List, AsyncIterator, Tuple
 from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import InMemorySaver
-from app.graph.nodes import sql_node, rag_node, aggregator_node, intent_classifier_node, route_node, chat_node
+from langchain_core.runnables import RunnableLambda
+from app.graph.nodes import (
+    sql_node, rag_node, aggregator_node, intent_classifier_node, route_node, chat_node, warm_chains,
+    asql_node, arag_node, aintent_classifier_node, achat_node
+)
 from app.tools.llm_toolkit import get_llm
 from app.config import settings
 import os
 import uuid
+import asyncio
+import threading
 from app.graph.memory import memory_saver
+from app.graph.answer_cache import answer_cache
 
 # 定义消息类型
 class Message(TypedDict):
     role: str
     content: str
 
+def append_messages(history: Optional[List[Message]], new: Optional[List[Message]]) -> List[Message]:
+    """
+    消息通道的归约函数：节点只返回本轮新增的消息，追加到历史末尾
+    
+    历史超过chat_history_max_messages时丢弃最早的消息
+    """
+    messages = (history or []) + (new or [])
+    limit = settings.chat_history_max_messages
+    if limit and len(messages) > limit:
+        messages = messages[-limit:]
+    return messages
+
 # 定义状态类型
+# 状态中只保存需要跨轮次保留或在节点间传递的数据，每个通道都会写入检查点；
+# LLM实例、模型名称和thread_id等运行时对象通过运行配置（config["configurable"]）传给节点
 class AgentState(TypedDict):
     query: str
-    llm: Any
     intent: Optional[str]
+    sql_query: Optional[str]
     sql_answer: Optional[str]
     rag_answer: Optional[str]
     answer: Optional[str]
-    model_provider: Optional[str]
-    model_name: Optional[str]
-    thread_id: Optional[str]
-    messages: Optional[List[Message]]
+    messages: Annotated[List[Message], append_messages]
 
 def build_graph() -> StateGraph:
     """
@@ -37,10 +54,11 @@ def build_graph() -> StateGraph:
     workflow = StateGraph(AgentState)
     
     # 添加节点
-    workflow.add_node("intent_classifier", intent_classifier_node)
-    workflow.add_node("sql", sql_node)
-    workflow.add_node("rag", rag_node)
-    workflow.add_node("chat", chat_node)
+    # 涉及LLM调用的节点同时提供同步和异步实现：graph.invoke走同步版本，graph.ainvoke走异步版本
+    workflow.add_node("intent_classifier", RunnableLambda(intent_classifier_node, afunc=aintent_classifier_node))
+    workflow.add_node("sql", RunnableLambda(sql_node, afunc=asql_node))
+    workflow.add_node("rag", RunnableLambda(rag_node, afunc=arag_node))
+    workflow.add_node("chat", RunnableLambda(chat_node, afunc=achat_node))
     workflow.add_node("aggregator", aggregator_node)
     
     # 定义图的流程
@@ -50,31 +68,20 @@ def build_graph() -> StateGraph:
     # 定义节点间的连接
     
     # 根据意图分类结果路由到不同节点
+    # route_node对BOTH意图返回["sql", "rag"]，两个分支在同一步中并行执行
     workflow.add_conditional_edges(
         "intent_classifier",
         # 这个函数决定下一步去哪个节点
-        lambda state: state["intent"],
+        route_node,
         {
-            "sql": "sql",         # 如果意图是SQL，则去SQL节点
-            "rag": "rag",         # 如果意图是RAG，则去RAG节点
-            "both": "sql",        # 如果意图是BOTH，先去SQL节点
-            "unknown": "rag",     # 如果意图未知，默认去RAG节点
-            "chat": "chat"        # 如果意图是普通聊天，则去聊天节点
+            "sql": "sql",         # SQL节点
+            "rag": "rag",         # RAG节点
+            "chat": "chat"        # 聊天节点
         }
     )
     
-    # SQL节点后根据意图决定下一步
-    workflow.add_conditional_edges(
-        "sql",
-        # 这个函数决定SQL节点后去哪里
-        lambda state: "rag" if state["intent"] in ["both", "unknown"] else "aggregator",
-        {
-            "rag": "rag",              # 如果需要两者，则继续到RAG节点
-            "aggregator": "aggregator" # 如果只需要SQL，则直接去聚合器
-        }
-    )
-    
-    # RAG节点后永远去聚合器
+    # SQL和RAG节点后都去聚合器；并行执行时聚合器在两个分支都结束后运行一次
+    workflow.add_edge("sql", "aggregator")
     workflow.add_edge("rag", "aggregator")
     
     # 聊天节点后不需要其他处理，直接结束
@@ -86,62 +93,263 @@ def build_graph() -> StateGraph:
     # 编译图，使用内存存储提供短期记忆功能
     return workflow.compile(checkpointer=memory_saver)
 
-def invoke_graph(query: str, model_provider=None, model_name=None, thread_id=None) -> Dict[str, Any]:
+# 进程级的已编译图注册表
+# 图结构与请求无关，编译一次后在所有请求间复用
+_compiled_graph = None
+_compiled_graph_lock = threading.Lock()
+
+def get_graph():
     """
-    调用图处理查询
+    获取进程内共享的已编译图，首次调用时编译
+    
+    Returns:
+        编译后的图
+    """
+    global _compiled_graph
+    if _compiled_graph is None:
+        with _compiled_graph_lock:
+            if _compiled_graph is None:
+                _compiled_graph = build_graph()
+                print("LangGraph处理图已编译")
+    return _compiled_graph
+
+def warmup_graph(model_provider=None, model_name=None) -> None:
+    """
+    预热：编译图并为默认模型构建SQL和RAG链
     
     Args:
-        query: 用户查询
-        model_provider: 模型提供商，可选 'openai' 或 'ollama'
-        model_name: 模型名称
-        thread_id: 对话线程ID，用于保持对话上下文
-        
+        model_provider: 模型提供商，默认使用配置中的值
+        model_name: 模型名称，默认使用配置中的值
+    """
+    get_graph()
+    
+    model_provider = model_provider or settings.model_provider
+    model_name = model_name or settings.model_name
+    try:
+        llm = get_llm(model_provider, model_name)
+        warm_chains(llm, model_provider, model_name)
+    except Exception as e:
+        print(f"预热查询链失败: {e}")
+
+def _prepare_inputs(query: str, model_provider=None, model_name=None, thread_id=None) -> tuple:
+    """
+    准备图的初始输入和运行配置
+    
     Returns:
-        Dict: 包含处理结果的字典
+        (初始输入, 运行配置, thread_id)
     """
     # 如果未提供thread_id，生成一个新的
     if thread_id is None:
         thread_id = str(uuid.uuid4())
         print(f"生成新的对话线程ID: {thread_id}")
     
-    # 构建图
-    graph = build_graph()
-    
     # 获取LLM实例
     llm = get_llm(model_provider, model_name)
     
     # 设置初始输入
+    # 每次请求重置上一轮遗留的中间结果，避免聚合器混入同一线程中旧的SQL/RAG结果
     inputs = {
         "query": query,
+        "intent": None,
+        "sql_query": None,
+        "sql_answer": None,
+        "rag_answer": None,
+        "answer": None
+    }
+    
+    print(f"执行查询: {query}")
+    print(f"对话线程ID: {thread_id}")
+    
+    # thread_id、LLM实例和模型信息放在configurable中，不进入状态，也不写入检查点
+    config = {"configurable": {
+        "thread_id": thread_id,
         "llm": llm,
         "model_provider": model_provider or settings.model_provider,
-        "model_name": model_name or settings.model_name,
-        "thread_id": thread_id  # 将thread_id直接添加到初始状态中
-    }
+        "model_name": model_name or settings.model_name
+    }}
+    return inputs, config, thread_id
+
+def _finalize_result(result: Dict[str, Any], config: Dict[str, Any]) -> Dict[str, Any]:
+    """为图的输出补充thread_id和模型信息，并确保返回一个有效的回答"""
+    configurable = config["configurable"]
+    thread_id = configurable["thread_id"]
+    # 将thread_id和模型信息添加到结果中
+    result["thread_id"] = thread_id
+    result["model_provider"] = configurable["model_provider"]
+    result["model_name"] = configurable["model_name"]
+    
+    # 确保返回一个有效的回答
+    if not result.get("answer"):
+        return {
+            "answer": "无法处理查询，请尝试其他问题。",
+            "thread_id": thread_id
+        }
+    
+    return result
+
+def _lookup_answer_cache(query: str, model_provider=None, model_name=None, use_cache: bool = True) -> Tuple[Optional[tuple], Optional[Dict[str, Any]]]:
+    """
+    在答案缓存中查找查询
+    
+    聊天意图和依赖对话线程的查询不使用缓存
+    
+    Returns:
+        (缓存键, 缓存的结果)；不使用缓存时缓存键为None，未命中时结果为None
+    """
+    if not settings.answer_cache_enabled:
+        return None, None
+    if not use_cache:
+        answer_cache.stats["bypasses"] += 1
+        return None, None
+    
+    key, rule_intent = answer_cache.make_key(
+        query, model_provider or settings.model_provider, model_name or settings.model_name
+    )
+    if rule_intent == "chat":
+        answer_cache.stats["bypasses"] += 1
+        return None, None
+    
+    cached = answer_cache.get(key)
+    if cached is not None:
+        print(f"答案缓存命中: {query}")
+    return key, cached
+
+def _cached_result(cached: Dict[str, Any], thread_id=None) -> Dict[str, Any]:
+    """为缓存的结果补充thread_id"""
+    cached["thread_id"] = thread_id or str(uuid.uuid4())
+    return cached
+
+def invoke_graph(query: str, model_provider=None, model_name=None, thread_id=None, use_cache: bool = True) -> Dict[str, Any]:
+    """
+    调用图处理查询
+    
+    Args:
+        query: 用户查询
+        model_provider: 模型提供商，可选 'openai' 或 'ollama'
+        model_name: 模型名称
+        thread_id: 对话线程ID，用于保持对话上下文
+        use_cache: 是否使用答案缓存，依赖对话上下文的查询应传入False
+        
+    Returns:
+        Dict: 包含处理结果的字典
+    """
+    # 相同问题直接返回缓存的答案
+    cache_key, cached = _lookup_answer_cache(query, model_provider, model_name, use_cache)
+    if cached is not None:
+        return _cached_result(cached, thread_id)
+    
+    # 获取已编译的图
+    graph = get_graph()
+    inputs, config, thread_id = _prepare_inputs(query, model_provider, model_name, thread_id)
     
     # 执行图，添加错误处理
     try:
-        print(f"执行查询: {query}")
-        print(f"对话线程ID: {thread_id}")
-        
-        # 根据LangGraph文档，正确的方式是在configurable中传递thread_id
-        config = {"configurable": {"thread_id": thread_id}}
-        result = graph.invoke(inputs, config)
-        
-        # 将thread_id添加到结果中
-        result["thread_id"] = thread_id
-        
-        # 确保返回一个有效的回答
-        if not result.get("answer"):
-            return {
-                "answer": "无法处理查询，请尝试其他问题。",
-                "thread_id": thread_id
-            }
-        
+        result = _finalize_result(graph.invoke(inputs, config), config)
+        if cache_key is not None:
+            answer_cache.put(cache_key, result)
         return result
     except Exception as e:
         print(f"图执行错误: {e}")
         return {
             "answer": f"处理查询时出错: {str(e)}",
             "thread_id": thread_id
-        } 
\ No newline at end of file
+        }
+
+async def ainvoke_graph(query: str, model_provider=None, model_name=None, thread_id=None, use_cache: bool = True) -> Dict[str, Any]:
+    """
+    异步调用图处理查询，参数和返回值与invoke_graph相同
+    
+    LLM调用通过ainvoke完成，等待期间不占用线程池中的工作线程
+    """
+    # 启用近似匹配时查找缓存需要计算嵌入，放到线程池中执行
+    cache_key, cached = await asyncio.to_thread(
+        _lookup_answer_cache, query, model_provider, model_name, use_cache
+    )
+    if cached is not None:
+        return _cached_result(cached, thread_id)
+    
+    graph = get_graph()
+    # 首次创建Ollama/Qwen客户端时会同步探测服务，放到线程池中执行
+    inputs, config, thread_id = await asyncio.to_thread(
+        _prepare_inputs, query, model_provider, model_name, thread_id
+    )
+    
+    try:
+        result = _finalize_result(await graph.ainvoke(inputs, config), config)
+        if cache_key is not None:
+            await asyncio.to_thread(answer_cache.put, cache_key, result)
+        return result
+    except Exception as e:
+        print(f"图执行错误: {e}")
+        return {
+            "answer": f"处理查询时出错: {str(e)}",
+            "thread_id": thread_id
+        }
+
+# 需要把LLM输出逐token推送给客户端的节点
+STREAMING_NODES = ("rag", "chat")
+
+async def astream_graph(query: str, model_provider=None, model_name=None, thread_id=None, use_cache: bool = True) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    流式调用图处理查询，按节点完成顺序产出事件
+    
+    Args:
+        query: 用户查询
+        model_provider: 模型提供商
+        model_name: 模型名称
+        thread_id: 对话线程ID
+        
+    Yields:
+        (事件名称, 事件数据)，事件名称依次为:
+        - intent: 意图分类完成
+        - sql: SQL节点完成
+        - token: RAG或聊天节点中LLM生成的一个token
+        - rag: RAG节点完成
+        - done: 图执行完成，数据为与invoke_graph相同格式的最终结果
+        答案缓存命中时只产出intent和done事件
+    
+    Raises:
+        图执行出错时抛出异常，由调用方推送error事件，不会产出done事件
+    """
+    cache_key, cached = await asyncio.to_thread(
+        _lookup_answer_cache, query, model_provider, model_name, use_cache
+    )
+    if cached is not None:
+        yield "intent", {"intent": cached.get("intent")}
+        yield "done", _cached_result(cached, thread_id)
+        return
+    
+    graph = get_graph()
+    inputs, config, thread_id = await asyncio.to_thread(
+        _prepare_inputs, query, model_provider, model_name, thread_id
+    )
+    
+    # values模式每一步产出完整状态（消息通道经归约函数合并了历史），最后一次即为与invoke_graph相同的结果
+    result = dict(inputs)
+    
+    async for mode, chunk in graph.astream(inputs, config, stream_mode=["updates", "messages", "values"]):
+        if mode == "values":
+            result = dict(chunk)
+            continue
+        if mode == "messages":
+            message, metadata = chunk
+            node = metadata.get("langgraph_node")
+            content = getattr(message, "content", message)
+            if node in STREAMING_NODES and content:
+                yield "token", {"node": node, "content": content}
+            continue
+        
+        for node, update in chunk.items():
+            if not update:
+                continue
+            if node == "intent_classifier":
+                yield "intent", {"intent": update.get("intent")}
+            elif node == "sql":
+                yield "sql", {"sql_result": update.get("sql_answer")}
+            elif node == "rag":
+                yield "rag", {"rag_result": update.get("rag_answer")}
+    
+    result = _finalize_result(result, config)
+    if cache_key is not None:
+        await asyncio.to_thread(answer_cache.put, cache_key, result)
+    yield "done", result
@@ -0,0 +1,121 @@
+"""
+基于规则的快速意图分类
+
+在调用LLM之前用确定性规则识别明显的查询（登录号、关键词提示、问候语），
+置信度达到阈值时直接返回意图，省去一次LLM调用
+"""
+import re
+from typing import Any, Dict, Optional, Tuple
+from app.config import settings
+
+# GEO登录号，如GSE10000、GSM250001、GPL570
+# 中文字符也属于\w，因此不能用\b作为边界
+ACCESSION_PATTERN = re.compile(r"(?<![A-Za-z0-9])(?:GSE|GSM|GPL|GDS)\d+(?![0-9])", re.IGNORECASE)
+
+# 问候和致谢，仅当整条查询只有这些内容时才视为聊天
+GREETING_PATTERN = re.compile(
+    r"^\s*(你好|您好|哈喽|嗨|早上好|中午好|下午好|晚上好|早安|晚安|谢谢|多谢|感谢|再见|拜拜|"
+    r"hi|hello|hey|thanks|thank you|bye)(呀|啊|哦|啦)?\s*[!！。.,，~～?？]*\s*$",
+    re.IGNORECASE
+)
+
+# 结构化数据查询的提示词，与意图分类提示中的示例保持一致
+DATA_CUES = ("有多少", "多少个", "多少", "列出", "获取", "统计", "数量", "哪些", "显示所有", "查询所有")
+
+# 数据库中存在的实体
+ENTITY_CUES = ("gse", "gsm", "gpl", "样本", "数据集", "记录", "平台", "物种", "发布日期", "登录号")
+
+# 知识性问题的提示词
+# 强提示词（与意图分类提示中的示例一致）单独即可判定为RAG；
+# 弱提示词也常见于闲聊（如"今天天气如何"），只给出低置信度，交由LLM确认
+STRONG_KNOWLEDGE_CUES = ("什么是", "是什么", "解释", "描述", "研究了什么", "研究目的")
+WEAK_KNOWLEDGE_CUES = ("介绍", "原理", "为什么", "如何", "怎么", "意义")
+KNOWLEDGE_CUES = STRONG_KNOWLEDGE_CUES + WEAK_KNOWLEDGE_CUES
+
+# 快速路径命中统计
+_fast_path_stats = {"total": 0, "hits": 0, "by_intent": {}}
+
+def classify_by_rules(query: str) -> Tuple[Optional[str], float]:
+    """
+    使用确定性规则判断查询意图
+
+    Args:
+        query: 用户查询
+
+    Returns:
+        (意图, 置信度)；无法判断时意图为None，置信度为0
+    """
+    text = query.strip()
+    if not text:
+        return None, 0.0
+
+    if GREETING_PATTERN.match(text):
+        return "chat", 0.98
+
+    lowered = text.lower()
+    has_accession = bool(ACCESSION_PATTERN.search(text))
+    has_data_cue = any(cue in lowered for cue in DATA_CUES)
+    has_entity = has_accession or any(cue in lowered for cue in ENTITY_CUES)
+    has_knowledge_cue = any(cue in lowered for cue in KNOWLEDGE_CUES)
+
+    if has_accession:
+        if has_data_cue and has_knowledge_cue:
+            return "both", 0.9
+        if has_data_cue:
+            return "sql", 0.95
+        if has_knowledge_cue:
+            return "both", 0.85
+        return "sql", 0.7
+
+    if has_data_cue and has_entity and not has_knowledge_cue:
+        return "sql", 0.9
+    if has_knowledge_cue and not has_data_cue:
+        if any(cue in lowered for cue in STRONG_KNOWLEDGE_CUES):
+            return "rag", 0.9
+        return "rag", 0.6
+    if has_data_cue:
+        return "sql", 0.6
+
+    return None, 0.0
+
+def fast_path_intent(query: str) -> Optional[str]:
+    """
+    快速路径：规则置信度不低于配置阈值时返回意图，否则返回None交给LLM分类
+
+    Args:
+        query: 用户查询
+
+    Returns:
+        意图或None
+    """
+    _fast_path_stats["total"] += 1
+    if not settings.intent_fast_path_enabled:
+        return None
+
+    intent, confidence = classify_by_rules(query)
+    if intent is None or confidence < settings.intent_fast_path_threshold:
+        return None
+
+    _fast_path_stats["hits"] += 1
+    by_intent = _fast_path_stats["by_intent"]
+    by_intent[intent] = by_intent.get(intent, 0) + 1
+    print(f"规则快速分类: {intent} (置信度 {confidence:.2f})")
+    return intent
+
+def get_fast_path_stats() -> Dict[str, Any]:
+    """
+    获取快速路径命中统计
+
+    Returns:
+        统计信息字典，包含命中率
+    """
+    total = _fast_path_stats["total"]
+    hits = _fast_path_stats["hits"]
+    return {
+        "enabled": settings.intent_fast_path_enabled,
+        "threshold": settings.intent_fast_path_threshold,
+        "total": total,
+        "hits": hits,
+        "hit_rate": hits / total if total else 0.0,
+        "by_intent": dict(_fast_path_stats["by_intent"])
+    }
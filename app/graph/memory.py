@@ -1,15 +1,620 @@
 """
-提供图的内存管理功能
+提供图的会话存储（checkpointer）
+
+会话状态保存在SQLite文件中（WAL模式），多个uvicorn工作进程共享同一个文件，重启后会话不丢失。
+存储有上界：
+- 每个线程（每个checkpoint_ns）只保留最近checkpoint_keep_last个检查点
+- 后台压缩线程定期删除超过checkpoint_thread_ttl秒没有活动的线程；线程数超过checkpoint_max_threads时删除最久未活动的线程
+- 通道值按(通道, 版本)单独存储，检查点只写入版本变化的通道；不再被任何检查点引用的通道值在压缩时删除。
+  删除过旧检查点的线程记在threads.dirty中，任何工作进程（包括重启后）压缩时都能清理
+- 消息历史通道只追加：每条消息在messages表中按(线程, 序号)只保存一次，检查点中的通道值只记录序号区间，
+  读取时按区间重建裁剪后的历史；每轮对话只写入新增的消息，不再把整个历史重新序列化
+"""
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+)
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from app.config import settings
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+
+try:
+    from langgraph.checkpoint.base import get_checkpoint_metadata
+except ImportError:
+    # 旧版本的langgraph没有该函数，元数据原样保存
+    def get_checkpoint_metadata(config: Dict[str, Any], metadata: CheckpointMetadata) -> CheckpointMetadata:
+        return metadata
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    dirty INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_threads_updated ON threads(updated_at);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    checkpoint_type TEXT NOT NULL,
+    checkpoint BLOB NOT NULL,
+    metadata_type TEXT NOT NULL,
+    metadata BLOB NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS blobs (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    channel TEXT NOT NULL,
+    version TEXT NOT NULL,
+    type TEXT NOT NULL,
+    value BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS messages (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    seq INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    value BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT NOT NULL,
+    value BLOB,
+    task_path TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+) WITHOUT ROWID;
 """
-from langgraph.checkpoint.memory import InMemorySaver
-import inspect
-
-# 创建全局的内存存储器
-# 这将在整个应用程序生命周期内保持会话状态
-memory_saver = InMemorySaver()
-
-# 打印InMemorySaver对象的属性，用于调试
-print("InMemorySaver的属性和方法:")
-for attr in dir(memory_saver):
-    if not attr.startswith('__'):
-        print(f"- {attr}: {type(getattr(memory_saver, attr))}") 
\ No newline at end of file
+
+# 通道值为消息区间引用时blobs.type的取值，value为"起始序号,结束序号"（左闭右开）
+MESSAGE_RANGE_TYPE = "message_range"
+
+class BoundedSqliteSaver(BaseCheckpointSaver):
+    """
+    基于SQLite文件、有容量上限的checkpointer
+
+    Args:
+        path: SQLite文件路径
+        keep_last: 每个线程保留的检查点数
+        thread_ttl: 线程没有活动多少秒后被删除，None表示不按时间删除
+        max_threads: 最多保留的线程数，None表示不限制
+        compact_interval: 后台压缩的间隔（秒），None表示不启动后台压缩线程
+    """
+
+    # 按消息逐条追加存储的通道，None表示按普通通道整体序列化
+    message_channel: Optional[str] = "messages"
+
+    def __init__(
+        self,
+        path: str,
+        keep_last: int = 5,
+        thread_ttl: Optional[float] = 7 * 24 * 3600,
+        max_threads: Optional[int] = 10000,
+        compact_interval: Optional[float] = 300.0,
+        serde: Any = None
+    ):
+        super().__init__(serde=serde)
+        self.path = path
+        self.keep_last = max(1, keep_last)
+        self.thread_ttl = thread_ttl
+        self.max_threads = max_threads
+        self.compact_interval = compact_interval
+        self._lock = threading.Lock()
+        self.stats = {"puts": 0, "put_bytes": 0, "writes": 0, "write_bytes": 0, "serialize_seconds": 0.0, "pruned_checkpoints": 0, "evicted_threads": 0, "deleted_blobs": 0, "compactions": 0, "appended_messages": 0}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        is_new = not os.path.exists(path)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30.0)
+        if is_new:
+            # 增量回收删除后的空闲页，需在建表前设置
+            self._conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._conn.execute("PRAGMA busy_timeout = 30000")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+        self._conn.commit()
+
+        self._stop = threading.Event()
+        self._compactor = None
+        if compact_interval:
+            self._compactor = threading.Thread(target=self._compact_loop, name="checkpoint-compactor", daemon=True)
+            self._compactor.start()
+
+    def _migrate(self) -> None:
+        """为旧版本的会话存储添加dirty列，已有线程全部标记为待清理"""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(threads)")}
+        if "dirty" not in columns:
+            self._conn.execute("ALTER TABLE threads ADD COLUMN dirty INTEGER NOT NULL DEFAULT 0")
+            self._conn.execute("UPDATE threads SET dirty = 1")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_threads_dirty ON threads(dirty) WHERE dirty = 1")
+
+    # 读取
+
+    def _load_blobs(self, thread_id: str, checkpoint_ns: str, versions: ChannelVersions) -> Dict[str, Any]:
+        """读取检查点引用的通道值，调用方需持有锁"""
+        values: Dict[str, Any] = {}
+        for channel, version in versions.items():
+            row = self._conn.execute(
+                "SELECT type, value FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                (thread_id, checkpoint_ns, channel, str(version))
+            ).fetchone()
+            if row is None or row[0] == "empty":
+                continue
+            if row[0] == MESSAGE_RANGE_TYPE:
+                values[channel] = self._load_messages(thread_id, checkpoint_ns, row[1])
+                continue
+            values[channel] = self.serde.loads_typed((row[0], row[1]))
+        return values
+
+    @staticmethod
+    def _parse_range(value: bytes) -> Tuple[int, int]:
+        start, end = bytes(value).decode().split(",")
+        return int(start), int(end)
+
+    def _load_messages(self, thread_id: str, checkpoint_ns: str, value: bytes) -> List[Any]:
+        """按序号区间重建消息历史，调用方需持有锁"""
+        start, end = self._parse_range(value)
+        rows = self._conn.execute(
+            "SELECT type, value FROM messages WHERE thread_id = ? AND checkpoint_ns = ? AND seq >= ? AND seq < ? ORDER BY seq",
+            (thread_id, checkpoint_ns, start, end)
+        ).fetchall()
+        return [self.serde.loads_typed((type_, blob)) for type_, blob in rows]
+
+    def _load_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> List[Tuple[str, str, Any]]:
+        rows = self._conn.execute(
+            "SELECT task_id, channel, type, value FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_path, task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id)
+        ).fetchall()
+        return [(task_id, channel, self.serde.loads_typed((type_, value))) for task_id, channel, type_, value in rows]
+
+    def _make_tuple(self, thread_id: str, checkpoint_ns: str, row: Tuple) -> CheckpointTuple:
+        """由checkpoints表的一行构造CheckpointTuple，调用方需持有锁"""
+        checkpoint_id, parent_checkpoint_id, checkpoint_type, checkpoint_blob, metadata_type, metadata_blob = row
+        checkpoint = self.serde.loads_typed((checkpoint_type, checkpoint_blob))
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}},
+            checkpoint={**checkpoint, "channel_values": self._load_blobs(thread_id, checkpoint_ns, checkpoint["channel_versions"])},
+            metadata=self.serde.loads_typed((metadata_type, metadata_blob)),
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_checkpoint_id}}
+                if parent_checkpoint_id else None
+            ),
+            pending_writes=self._load_writes(thread_id, checkpoint_ns, checkpoint_id)
+        )
+
+    def get_tuple(self, config: Dict[str, Any]) -> Optional[CheckpointTuple]:
+        """读取指定的检查点，没有指定checkpoint_id时读取线程的最新检查点"""
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        columns = "checkpoint_id, parent_checkpoint_id, checkpoint_type, checkpoint, metadata_type, metadata"
+        with self._lock:
+            if checkpoint_id:
+                row = self._conn.execute(
+                    f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id)
+                ).fetchone()
+            else:
+                row = self._conn.execute(
+                    f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns)
+                ).fetchone()
+            if row is None:
+                return None
+            return self._make_tuple(thread_id, checkpoint_ns, row)
+
+    def list(
+        self,
+        config: Optional[Dict[str, Any]],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None
+    ) -> Iterator[CheckpointTuple]:
+        """按检查点ID从新到旧列出检查点"""
+        clauses, params = [], []
+        if config:
+            clauses.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            checkpoint_ns = config["configurable"].get("checkpoint_ns")
+            if checkpoint_ns is not None:
+                clauses.append("checkpoint_ns = ?")
+                params.append(checkpoint_ns)
+            checkpoint_id = get_checkpoint_id(config)
+            if checkpoint_id:
+                clauses.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        before_id = get_checkpoint_id(before) if before else None
+        if before_id:
+            clauses.append("checkpoint_id < ?")
+            params.append(before_id)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, checkpoint_type, checkpoint, metadata_type, metadata "
+                f"FROM checkpoints {where} ORDER BY thread_id, checkpoint_ns, checkpoint_id DESC",
+                params
+            ).fetchall()
+            results = []
+            for thread_id, checkpoint_ns, *row in rows:
+                if limit is not None and len(results) >= limit:
+                    break
+                if filter:
+                    metadata = self.serde.loads_typed((row[4], row[5]))
+                    if not all(metadata.get(key) == value for key, value in filter.items()):
+                        continue
+                results.append(self._make_tuple(thread_id, checkpoint_ns, tuple(row)))
+        yield from results
+
+    # 写入
+
+    def _touch(self, thread_id: str, now: float) -> None:
+        self._conn.execute(
+            "INSERT INTO threads (thread_id, created_at, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(thread_id) DO UPDATE SET updated_at = excluded.updated_at",
+            (thread_id, now, now)
+        )
+
+    def put(
+        self,
+        config: Dict[str, Any],
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: Optional[ChannelVersions] = None
+    ) -> Dict[str, Any]:
+        """保存检查点，只写入版本变化的通道值，并删除超出keep_last的旧检查点"""
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        values = checkpoint.get("channel_values", {})
+        stored = {key: value for key, value in checkpoint.items() if key != "channel_values"}
+        if new_versions is None:
+            # 旧版本的langgraph不传new_versions，写入全部通道
+            new_versions = checkpoint.get("channel_versions", {})
+
+        started = time.perf_counter()
+        blob_rows, messages = [], None
+        for channel, version in new_versions.items():
+            if channel == self.message_channel and isinstance(values.get(channel), list):
+                # 消息逐条序列化，写入时只保存新增的消息
+                messages = (str(version), [self.serde.dumps_typed(message) for message in values[channel]])
+                continue
+            type_, value = self.serde.dumps_typed(values[channel]) if channel in values else ("empty", None)
+            blob_rows.append((thread_id, checkpoint_ns, channel, str(version), type_, value))
+        checkpoint_type, checkpoint_blob = self.serde.dumps_typed(stored)
+        metadata_type, metadata_blob = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        size = len(checkpoint_blob) + len(metadata_blob) + sum(len(row[5] or b"") for row in blob_rows)
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            # 追加消息前要读取上一次的消息区间，先取得写锁，避免两个工作进程分配相同的序号
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if messages is not None:
+                    range_value, message_bytes = self._append_messages(thread_id, checkpoint_ns, messages[1])
+                    blob_rows.append((thread_id, checkpoint_ns, self.message_channel, messages[0], MESSAGE_RANGE_TYPE, range_value))
+                    size += message_bytes + len(range_value)
+                self._conn.executemany("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)", blob_rows)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                     checkpoint_type, checkpoint_blob, metadata_type, metadata_blob)
+                )
+                self._touch(thread_id, time.time())
+                self._prune_thread(thread_id, checkpoint_ns)
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self.stats["puts"] += 1
+            self.stats["put_bytes"] += size
+            self.stats["serialize_seconds"] += elapsed
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    def _append_messages(self, thread_id: str, checkpoint_ns: str, messages: List[Tuple[str, bytes]]) -> Tuple[bytes, int]:
+        """
+        保存消息历史中新增的消息，调用方需持有锁并在写事务中
+
+        与线程最近一次保存的消息区间比较：区间末尾与新历史开头相同的部分（归约函数裁剪掉最早的消息后剩下的部分）直接复用，
+        只追加其后的消息
+
+        Returns:
+            (消息区间引用, 写入的字节数)
+        """
+        previous = self._conn.execute(
+            "SELECT value FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND type = ? "
+            "ORDER BY version DESC LIMIT 1",
+            (thread_id, checkpoint_ns, self.message_channel, MESSAGE_RANGE_TYPE)
+        ).fetchone()
+        stored: List[Tuple[str, bytes]] = []
+        end = self._conn.execute(
+            "SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE thread_id = ? AND checkpoint_ns = ?",
+            (thread_id, checkpoint_ns)
+        ).fetchone()[0]
+        if previous is not None:
+            start, previous_end = self._parse_range(previous[0])
+            if previous_end == end:
+                stored = [
+                    (type_, bytes(blob)) for type_, blob in self._conn.execute(
+                        "SELECT type, value FROM messages WHERE thread_id = ? AND checkpoint_ns = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                        (thread_id, checkpoint_ns, max(start, end - len(messages)), end)
+                    ).fetchall()
+                ]
+
+        # 上一次历史的最长后缀，同时是新历史的前缀
+        overlap = 0
+        for length in range(min(len(stored), len(messages)), 0, -1):
+            if stored[-length:] == [(type_, bytes(blob)) for type_, blob in messages[:length]]:
+                overlap = length
+                break
+        new_rows = [
+            (thread_id, checkpoint_ns, end + index, type_, blob)
+            for index, (type_, blob) in enumerate(messages[overlap:])
+        ]
+        self._conn.executemany("INSERT INTO messages VALUES (?, ?, ?, ?, ?)", new_rows)
+        self.stats["appended_messages"] += len(new_rows)
+        range_value = f"{end - overlap},{end + len(new_rows)}".encode()
+        return range_value, sum(len(row[4] or b"") for row in new_rows)
+
+    def put_writes(self, config: Dict[str, Any], writes: Sequence[Tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        """保存节点对检查点的中间写入"""
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        started = time.perf_counter()
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, blob = self.serde.dumps_typed(value)
+            rows.append((thread_id, checkpoint_ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx), channel, type_, blob, task_path))
+        elapsed = time.perf_counter() - started
+        # 特殊通道（错误、中断等）的写入可以覆盖，普通写入已存在时保持不变
+        special = [row for row in rows if row[4] < 0]
+        regular = [row for row in rows if row[4] >= 0]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", special)
+                self._conn.executemany("INSERT OR IGNORE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", regular)
+            self.stats["writes"] += len(rows)
+            self.stats["write_bytes"] += sum(len(row[7] or b"") for row in rows)
+            self.stats["serialize_seconds"] += elapsed
+
+    def _prune_thread(self, thread_id: str, checkpoint_ns: str) -> None:
+        """删除超出keep_last的旧检查点及其写入，调用方需持有锁并在事务中"""
+        stale = self._conn.execute(
+            "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+            "ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?",
+            (thread_id, checkpoint_ns, self.keep_last)
+        ).fetchall()
+        if not stale:
+            return
+        params = [(thread_id, checkpoint_ns, checkpoint_id) for checkpoint_id, in stale]
+        self._conn.executemany("DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", params)
+        self._conn.executemany("DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", params)
+        self.stats["pruned_checkpoints"] += len(stale)
+        # 旧检查点引用的通道值在压缩时统一清理，标记写入数据库，由任一工作进程的压缩处理
+        self._conn.execute("UPDATE threads SET dirty = 1 WHERE thread_id = ?", (thread_id,))
+
+    def get_next_version(self, current: Optional[str], channel: Any = None) -> str:
+        """通道版本号：单调递增的序号加随机后缀，字符串可直接比较大小"""
+        if current is None:
+            current_version = 0
+        elif isinstance(current, int):
+            current_version = current
+        else:
+            current_version = int(str(current).split(".")[0])
+        return f"{current_version + 1:032}.{random.random():016}"
+
+    # 删除和压缩
+
+    def _delete_threads(self, thread_ids: Sequence[str]) -> None:
+        """删除线程的全部数据，调用方需持有锁并在事务中"""
+        params = [(thread_id,) for thread_id in thread_ids]
+        for table in ("checkpoints", "blobs", "messages", "writes", "threads"):
+            self._conn.executemany(f"DELETE FROM {table} WHERE thread_id = ?", params)
+
+    def delete_thread(self, thread_id: str) -> None:
+        """删除一个线程的全部检查点、写入、通道值和消息"""
+        with self._lock:
+            with self._conn:
+                self._delete_threads([thread_id])
+
+    def clear(self) -> int:
+        """删除全部线程，返回删除的线程数"""
+        with self._lock:
+            with self._conn:
+                count = self._conn.execute("SELECT COUNT(*) FROM threads").fetchone()[0]
+                for table in ("checkpoints", "blobs", "messages", "writes", "threads"):
+                    self._conn.execute(f"DELETE FROM {table}")
+        return count
+
+    def list_threads(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """按最近活动时间从新到旧列出线程"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT t.thread_id, t.created_at, t.updated_at, "
+                "(SELECT COUNT(*) FROM checkpoints c WHERE c.thread_id = t.thread_id) "
+                "FROM threads t ORDER BY t.updated_at DESC LIMIT ?",
+                (limit if limit is not None else -1,)
+            ).fetchall()
+        return [
+            {"thread_id": thread_id, "created_at": created_at, "updated_at": updated_at, "checkpoints": checkpoints}
+            for thread_id, created_at, updated_at, checkpoints in rows
+        ]
+
+    def _collect_blobs(self, thread_id: str) -> int:
+        """
+        删除线程中不再被任何检查点引用的通道值
+
+        调用方需持有锁，并已用BEGIN IMMEDIATE开始事务：读取引用和删除之间其他工作进程不能提交新的检查点，
+        否则新写入的通道值会因为其检查点不在引用集合中而被误删
+        """
+        referenced = set()
+        for checkpoint_ns, checkpoint_type, checkpoint_blob in self._conn.execute(
+            "SELECT checkpoint_ns, checkpoint_type, checkpoint FROM checkpoints WHERE thread_id = ?", (thread_id,)
+        ).fetchall():
+            checkpoint = self.serde.loads_typed((checkpoint_type, checkpoint_blob))
+            referenced.update((checkpoint_ns, channel, str(version)) for channel, version in checkpoint["channel_versions"].items())
+        stale = [
+            (thread_id, checkpoint_ns, channel, version)
+            for checkpoint_ns, channel, version in self._conn.execute(
+                "SELECT checkpoint_ns, channel, version FROM blobs WHERE thread_id = ?", (thread_id,)
+            ).fetchall()
+            if (checkpoint_ns, channel, version) not in referenced
+        ]
+        self._conn.executemany("DELETE FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?", stale)
+        # 消息区间只向后移动，早于剩余最小起始序号的消息不再被引用
+        starts: Dict[str, int] = {}
+        for checkpoint_ns, value in self._conn.execute(
+            "SELECT checkpoint_ns, value FROM blobs WHERE thread_id = ? AND type = ?", (thread_id, MESSAGE_RANGE_TYPE)
+        ).fetchall():
+            start, _ = self._parse_range(value)
+            starts[checkpoint_ns] = min(start, starts.get(checkpoint_ns, start))
+        for checkpoint_ns, in self._conn.execute(
+            "SELECT DISTINCT checkpoint_ns FROM messages WHERE thread_id = ?", (thread_id,)
+        ).fetchall():
+            if checkpoint_ns in starts:
+                self._conn.execute(
+                    "DELETE FROM messages WHERE thread_id = ? AND checkpoint_ns = ? AND seq < ?",
+                    (thread_id, checkpoint_ns, starts[checkpoint_ns])
+                )
+            else:
+                self._conn.execute("DELETE FROM messages WHERE thread_id = ? AND checkpoint_ns = ?", (thread_id, checkpoint_ns))
+        return len(stale)
+
+    def compact(self) -> Dict[str, int]:
+        """
+        压缩存储：按TTL和线程数上限删除线程，清理不再引用的通道值，回收空闲页
+
+        Returns:
+            本次删除的线程数和通道值数
+        """
+        evicted, deleted_blobs = 0, 0
+        with self._lock:
+            # 先取得写锁再读取，压缩期间其他工作进程的put等待提交
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                expired = []
+                if self.thread_ttl:
+                    expired = [row[0] for row in self._conn.execute(
+                        "SELECT thread_id FROM threads WHERE updated_at < ?", (time.time() - self.thread_ttl,)
+                    ).fetchall()]
+                if self.max_threads:
+                    expired += [row[0] for row in self._conn.execute(
+                        "SELECT thread_id FROM threads ORDER BY updated_at DESC LIMIT -1 OFFSET ?", (self.max_threads,)
+                    ).fetchall()]
+                expired = list(dict.fromkeys(expired))
+                if expired:
+                    self._delete_threads(expired)
+                    evicted = len(expired)
+                dirty = [row[0] for row in self._conn.execute("SELECT thread_id FROM threads WHERE dirty = 1").fetchall()]
+                for thread_id in dirty:
+                    deleted_blobs += self._collect_blobs(thread_id)
+                self._conn.executemany("UPDATE threads SET dirty = 0 WHERE thread_id = ?", [(thread_id,) for thread_id in dirty])
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._conn.execute("PRAGMA incremental_vacuum")
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.stats["evicted_threads"] += evicted
+            self.stats["deleted_blobs"] += deleted_blobs
+            self.stats["compactions"] += 1
+        if evicted or deleted_blobs:
+            print(f"会话存储压缩完成: 删除 {evicted} 个线程，{deleted_blobs} 个通道值")
+        return {"evicted_threads": evicted, "deleted_blobs": deleted_blobs}
+
+    def _compact_loop(self) -> None:
+        while not self._stop.wait(self.compact_interval):
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"会话存储压缩失败: {e}")
+
+    def close(self) -> None:
+        self._stop.set()
+        with self._lock:
+            self._conn.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取会话存储的统计信息"""
+        with self._lock:
+            threads, checkpoints, blobs, messages = self._conn.execute(
+                "SELECT (SELECT COUNT(*) FROM threads), (SELECT COUNT(*) FROM checkpoints), (SELECT COUNT(*) FROM blobs), "
+                "(SELECT COUNT(*) FROM messages)"
+            ).fetchone()
+            page_count = self._conn.execute("PRAGMA page_count").fetchone()[0]
+            page_size = self._conn.execute("PRAGMA page_size").fetchone()[0]
+            return {
+                **self.stats,
+                "threads": threads,
+                "checkpoints": checkpoints,
+                "blobs": blobs,
+                "messages": messages,
+                "db_bytes": page_count * page_size,
+                "avg_put_bytes": self.stats["put_bytes"] / self.stats["puts"] if self.stats["puts"] else 0.0,
+                "avg_write_bytes": self.stats["write_bytes"] / self.stats["writes"] if self.stats["writes"] else 0.0,
+            }
+
+    # 异步接口：SQLite操作在线程池中执行，不阻塞事件循环
+
+    async def aget_tuple(self, config: Dict[str, Any]) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[Dict[str, Any]],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None
+    ):
+        results = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for result in results:
+            yield result
+
+    async def aput(
+        self,
+        config: Dict[str, Any],
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: Optional[ChannelVersions] = None
+    ) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: Dict[str, Any], writes: Sequence[Tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+# 全局的会话存储，同一个SQLite文件在多个工作进程和重启之间共享
+memory_saver = BoundedSqliteSaver(
+    settings.checkpoint_db_path,
+    keep_last=settings.checkpoint_keep_last,
+    thread_ttl=settings.checkpoint_thread_ttl,
+    max_threads=settings.checkpoint_max_threads,
+    compact_interval=settings.checkpoint_compact_interval
+)
@@ -2,34 +2,117 @@
 # 将用于定义图中的各个节点和处理函数 
 
 import langgraph
-from app.tools.sql_toolkit import get_sql_chain
+from app.tools.sql_toolkit import get_sql_chain, get_table_info, search_gse
 from app.tools.rag_toolkit import get_rag_chain
-from typing import Dict, Any, TypedDict, Optional, Annotated, Literal, List
+from app.tools.llm_toolkit import get_llm
+from typing import Dict, Any, TypedDict, Optional, Annotated, Literal, List, Union
 from langgraph.graph import END
+from langchain_core.runnables import RunnableConfig
 from app.graph.memory import memory_saver
+from app.graph.intent_rules import fast_path_intent
+from app.config import settings
 import json
+import re
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
 # 避免使用复杂的LLMChain对象作为状态
-# 而是在每个节点内部创建链
+# 链按(类型, 模型提供商, 模型名称)缓存，在请求间复用
+_chain_cache: Dict[tuple, Any] = {}
+_chain_cache_lock = threading.Lock()
 
-# 定义查询意图类型
-QueryIntent = Literal["sql", "rag", "both", "unknown", "chat"]
+_CHAIN_FACTORIES = {
+    "sql": get_sql_chain,
+    "rag": get_rag_chain,
+}
 
-def intent_classifier_node(state: Dict[str, Any]) -> Dict[str, Any]:
+def get_cached_chain(kind: str, llm: Any, model_provider: Optional[str] = None, model_name: Optional[str] = None) -> Any:
     """
-    意图分类器节点：判断用户查询的意图
+    获取缓存的SQL或RAG链，不存在时使用给定的LLM构建
     
     Args:
-        state: 当前状态，包含查询和LLM实例
+        kind: 链类型，'sql' 或 'rag'
+        llm: 语言模型实例，仅在首次构建时使用
+        model_provider: 模型提供商，作为缓存键的一部分
+        model_name: 模型名称，作为缓存键的一部分
         
     Returns:
-        更新后的状态，包含意图分类结果
+        可复用的链对象
     """
-    query = state["query"]
-    llm = state["llm"]
+    key = (kind, model_provider or settings.model_provider, model_name or settings.model_name)
+    chain = _chain_cache.get(key)
+    if chain is None:
+        with _chain_cache_lock:
+            chain = _chain_cache.get(key)
+            if chain is None:
+                chain = _CHAIN_FACTORIES[kind](llm)
+                _chain_cache[key] = chain
+                print(f"构建并缓存{kind.upper()}链: {key[1]}/{key[2]}")
+    return chain
+
+def warm_chains(llm: Any, model_provider: Optional[str] = None, model_name: Optional[str] = None) -> None:
+    """
+    为指定模型预先构建所有链
     
-    # 构建意图分类提示
-    intent_prompt = f"""分析以下中文查询，并确定其最适合由哪种系统处理。
+    Args:
+        llm: 语言模型实例
+        model_provider: 模型提供商
+        model_name: 模型名称
+    """
+    for kind in _CHAIN_FACTORIES:
+        get_cached_chain(kind, llm, model_provider, model_name)
+
+def _runtime(config: Optional[RunnableConfig]) -> Dict[str, Any]:
+    """
+    从运行配置中取出LLM实例和模型信息
+    
+    这些运行时对象通过config["configurable"]传入，不保存在状态中，也就不会写入检查点；
+    没有传入LLM实例时（如直接调用已编译的图）按模型信息获取
+    """
+    configurable = (config or {}).get("configurable", {})
+    model_provider = configurable.get("model_provider") or settings.model_provider
+    model_name = configurable.get("model_name") or settings.model_name
+    llm = configurable.get("llm") or get_llm(model_provider, model_name)
+    return {
+        "llm": llm,
+        "model_provider": model_provider,
+        "model_name": model_name,
+        "thread_id": configurable.get("thread_id", "")
+    }
+
+# 同步执行路径下用于实现分支超时的线程池
+# 超时的任务无法被强制终止，会在后台继续执行完毕，但结果会被丢弃
+_branch_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="graph-branch")
+
+def _run_branch(func, *args) -> Any:
+    """在分支超时限制内同步执行func，超时抛出TimeoutError"""
+    timeout = settings.branch_timeout
+    if not timeout:
+        return func(*args)
+    future = _branch_executor.submit(func, *args)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        raise TimeoutError(f"超过{timeout}秒")
+
+async def _arun_branch(coro) -> Any:
+    """在分支超时限制内等待协程，超时后取消并抛出TimeoutError"""
+    timeout = settings.branch_timeout
+    if not timeout:
+        return await coro
+    try:
+        return await asyncio.wait_for(coro, timeout=timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"超过{timeout}秒")
+
+# 定义查询意图类型
+QueryIntent = Literal["sql", "rag", "both", "unknown", "chat"]
+
+def _build_intent_prompt(query: str) -> str:
+    """构建意图分类提示"""
+    return f"""分析以下中文查询，并确定其最适合由哪种系统处理。
     
 查询: "{query}"
 
@@ -45,132 +128,338 @@ def intent_classifier_node(state: Dict[str, Any]) -> Dict[str, Any]:
 
 仅返回一个单词作为分类结果: SQL, RAG, BOTH, CHAT 或 UNKNOWN
 """
+
+def _build_intent_sql_prompt(query: str, schema: str) -> str:
+    """构建单次调用的提示：同时返回意图分类和（需要时）SQL查询"""
+    return f"""分析以下中文查询，确定其最适合由哪种系统处理；如果需要查询数据库，同时生成SQL查询。
+
+查询: "{query}"
+
+可能的分类:
+- SQL: 如果查询明确请求数据库中的结构化数据，如GSE记录、特定ID、样本数量等。例如"GSE10000包含多少个样本"、"列出所有GSE记录"等。
+- RAG: 如果查询寻求一般知识、解释或分析，这些信息可能存在于知识库中。例如"什么是RNA-seq技术"、"解释单细胞测序"等。
+- BOTH: 如果查询同时需要结构化数据和知识库信息。例如"GSE10000研究了什么，使用了什么平台"等。
+- CHAT: 如果查询与生物信息无关，是普通聊天、日常问题或闲聊。例如"你好"、"今天天气如何"等。
+- UNKNOWN: 如果无法确定查询意图。
+
+数据库表结构:
+{schema}
+
+仅返回一个JSON对象，不要包含代码块标记或其他解释，格式如下:
+{{"intent": "SQL|RAG|BOTH|CHAT|UNKNOWN", "sql": "分类为SQL或BOTH时回答问题的SQLite查询，否则为null"}}
+"""
+
+def _parse_intent_and_sql(text: str) -> Optional[Dict[str, Any]]:
+    """
+    解析单次调用返回的JSON结果
     
+    Returns:
+        包含intent和sql_query的状态更新；解析失败时返回None
+    """
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if not match:
+        return None
     try:
-        # 使用LLM进行意图分类
-        response = llm.invoke(intent_prompt)
-        intent = response.content.strip().upper()
+        data = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("intent"), str):
+        return None
+    
+    intent = _parse_intent(data["intent"])
+    sql_query = data.get("sql")
+    if intent not in ("sql", "both") or not isinstance(sql_query, str) or not sql_query.strip():
+        sql_query = None
+    return {"intent": intent, "sql_query": sql_query}
+
+def _classification_prompt(query: str) -> tuple:
+    """
+    选择意图分类提示
+    
+    Returns:
+        (提示, 是否为单次调用模式)
+    """
+    if settings.intent_sql_single_call:
+        try:
+            return _build_intent_sql_prompt(query, get_table_info(query)), True
+        except Exception as e:
+            print(f"获取表结构失败，使用普通意图分类: {e}")
+    return _build_intent_prompt(query), False
+
+def _parse_classification(text: str, single_call: bool) -> Dict[str, Any]:
+    """将LLM的分类输出转换为状态更新；单次调用结果解析失败时只保留意图，SQL交给SQL节点重新生成"""
+    if single_call:
+        update = _parse_intent_and_sql(text)
+        if update is not None:
+            print(f"查询意图分类: {update['intent']}，预生成SQL: {update['sql_query']}")
+            return update
+        print("单次调用结果解析失败，回退到分别生成意图和SQL")
+    intent = _parse_intent(text)
+    print(f"查询意图分类: {intent}")
+    return {"intent": intent}
+
+def _response_text(response: Any) -> str:
+    """提取LLM响应文本，兼容聊天模型和纯文本模型"""
+    return getattr(response, "content", response).strip()
+
+def _parse_intent(text: str) -> str:
+    """将LLM返回的分类结果标准化为意图"""
+    intent = text.upper()
+    
+    # 标准化意图结果
+    if "SQL" in intent:
+        return "sql"
+    elif "RAG" in intent:
+        return "rag"
+    elif "BOTH" in intent:
+        return "both"
+    elif "CHAT" in intent:
+        return "chat"
+    else:
+        return "unknown"
+
+def intent_classifier_node(state: Dict[str, Any], config: RunnableConfig) -> Dict[str, Any]:
+    """
+    意图分类器节点：判断用户查询的意图
+    
+    Args:
+        state: 当前状态，包含查询
+        config: 运行配置，configurable中包含LLM实例和模型信息
         
-        # 标准化意图结果
-        if "SQL" in intent:
-            intent = "sql"
-        elif "RAG" in intent:
-            intent = "rag"
-        elif "BOTH" in intent:
-            intent = "both"
-        elif "CHAT" in intent:
-            intent = "chat"
-        else:
-            intent = "unknown"
-            
-        print(f"查询意图分类: {intent}")
+    Returns:
+        更新后的状态，包含意图分类结果
+    """
+    query = state["query"]
+    runtime = _runtime(config)
+    llm = runtime["llm"]
+    
+    # 明显的查询直接由规则分类，不调用LLM
+    intent = fast_path_intent(query)
+    if intent:
+        return {"intent": intent}
+    
+    try:
+        # 使用LLM进行意图分类，单次调用模式下同时生成SQL
+        prompt, single_call = _classification_prompt(query)
+        response = llm.invoke(prompt)
         
         # 返回更新后的状态，包含意图
-        return {"intent": intent}
+        return _parse_classification(_response_text(response), single_call)
     except Exception as e:
         print(f"意图分类错误: {e}")
         # 默认为rag，避免总是使用SQL
         return {"intent": "rag"}
 
-def sql_node(state: Dict[str, Any]) -> Dict[str, Any]:
+async def aintent_classifier_node(state: Dict[str, Any], config: RunnableConfig) -> Dict[str, Any]:
+    """意图分类器节点的异步版本，使用llm.ainvoke"""
+    query = state["query"]
+    runtime = _runtime(config)
+    llm = runtime["llm"]
+    
+    intent = fast_path_intent(query)
+    if intent:
+        return {"intent": intent}
+    
+    try:
+        prompt, single_call = _classification_prompt(query)
+        response = await llm.ainvoke(prompt)
+        return _parse_classification(_response_text(response), single_call)
+    except Exception as e:
+        print(f"意图分类错误: {e}")
+        return {"intent": "rag"}
+
+def sql_node(state: Dict[str, Any], config: RunnableConfig) -> Dict[str, Any]:
     """
     SQL节点：使用SQL工具包查询数据库
     
     Args:
-        state: 当前状态，包含查询和LLM实例
+        state: 当前状态，包含查询
+        config: 运行配置，configurable中包含LLM实例和模型信息
         
     Returns:
         更新后的状态，包含SQL查询结果
     """
     query = state["query"]
-    llm = state["llm"]
+    runtime = _runtime(config)
+    llm = runtime["llm"]
+    
+    sql_query = state.get("sql_query")
+    
+    def answer():
+        # 关键词式的数据集检索直接查询全文索引，不需要LLM生成SQL
+        if not sql_query:
+            sql_answer = search_gse(query)
+            if sql_answer:
+                return sql_answer
+        # 获取缓存的SQL链并执行查询，单次调用模式下意图分类已生成SQL，直接执行
+        sql_chain = get_cached_chain("sql", llm, runtime["model_provider"], runtime["model_name"])
+        return sql_chain.run(query, sql_query)
     
     try:
-        # 创建SQL链并执行查询
-        sql_chain = get_sql_chain(llm)
-        sql_answer = sql_chain.run(query)
+        # 全文检索也计入分支超时
+        sql_answer = _run_branch(answer)
         
         # 返回更新后的状态
         return {"sql_answer": sql_answer}
+    except TimeoutError as e:
+        print(f"SQL查询超时: {e}")
+        return {"sql_answer": f"SQL查询超时（{e}），未返回结果"}
     except Exception as e:
         print(f"SQL查询错误: {e}")
         return {"sql_answer": f"SQL查询错误: {str(e)}"}
 
-def rag_node(state: Dict[str, Any]) -> Dict[str, Any]:
+async def asql_node(state: Dict[str, Any], config: RunnableConfig) -> Dict[str, Any]:
+    """SQL节点的异步版本"""
+    query = state["query"]
+    runtime = _runtime(config)
+    llm = runtime["llm"]
+    
+    sql_query = state.get("sql_query")
+    
+    async def answer():
+        if not sql_query:
+            sql_answer = await asyncio.to_thread(search_gse, query)
+            if sql_answer:
+                return sql_answer
+        sql_chain = get_cached_chain("sql", llm, runtime["model_provider"], runtime["model_name"])
+        return await sql_chain.arun(query, sql_query)
+    
+    try:
+        sql_answer = await _arun_branch(answer())
+        return {"sql_answer": sql_answer}
+    except TimeoutError as e:
+        print(f"SQL查询超时: {e}")
+        return {"sql_answer": f"SQL查询超时（{e}），未返回结果"}
+    except Exception as e:
+        print(f"SQL查询错误: {e}")
+        return {"sql_answer": f"SQL查询错误: {str(e)}"}
+
+def rag_node(state: Dict[str, Any], config: RunnableConfig) -> Dict[str, Any]:
     """
     RAG节点：使用检索增强生成查询文档
     
     Args:
-        state: 当前状态，包含查询和LLM实例
+        state: 当前状态，包含查询
+        config: 运行配置，configurable中包含LLM实例和模型信息
         
     Returns:
         更新后的状态，包含RAG查询结果
     """
     query = state["query"]
-    llm = state["llm"]
+    runtime = _runtime(config)
+    llm = runtime["llm"]
     
     try:
-        # 创建RAG链并执行查询
-        rag_chain = get_rag_chain(llm)
-        rag_answer = rag_chain.run(query)
+        # 获取缓存的RAG链并执行查询
+        rag_chain = get_cached_chain("rag", llm, runtime["model_provider"], runtime["model_name"])
+        rag_answer = _run_branch(rag_chain.run, query)
         
         # 返回更新后的状态
         return {"rag_answer": rag_answer}
+    except TimeoutError as e:
+        print(f"RAG查询超时: {e}")
+        return {"rag_answer": f"RAG查询超时（{e}），未返回结果"}
+    except Exception as e:
+        print(f"RAG查询错误: {e}")
+        return {"rag_answer": f"RAG查询错误: {str(e)}"}
+
+async def arag_node(state: Dict[str, Any], config: RunnableConfig) -> Dict[str, Any]:
+    """RAG节点的异步版本"""
+    query = state["query"]
+    runtime = _runtime(config)
+    llm = runtime["llm"]
+    
+    try:
+        rag_chain = get_cached_chain("rag", llm, runtime["model_provider"], runtime["model_name"])
+        rag_answer = await _arun_branch(rag_chain.arun(query))
+        return {"rag_answer": rag_answer}
+    except TimeoutError as e:
+        print(f"RAG查询超时: {e}")
+        return {"rag_answer": f"RAG查询超时（{e}），未返回结果"}
     except Exception as e:
         print(f"RAG查询错误: {e}")
         return {"rag_answer": f"RAG查询错误: {str(e)}"}
 
-def chat_node(state: Dict[str, Any]) -> Dict[str, Any]:
+# 聊天系统提示
+CHAT_SYSTEM_PROMPT = """你是一个AI助手，回答用户的各种问题。
+对于非生物信息相关的普通聊天，请提供友好、自然、有帮助的回答。
+保持回答简洁、清晰。
+如果用户询问之前的对话内容，请查看历史消息并进行回答。"""
+
+def _prepare_chat_messages(state: Dict[str, Any], thread_id: str) -> tuple:
     """
-    聊天节点：处理与生物信息无关的普通聊天
+    准备聊天请求，不修改状态中的消息历史
     
     Args:
-        state: 当前状态，包含查询和LLM实例
+        state: 当前状态
+        thread_id: 对话线程ID，仅用于日志
         
     Returns:
-        更新后的状态，包含聊天回复
+        (本轮的用户消息, 发送给LLM的完整消息列表)
     """
     query = state["query"]
-    llm = state["llm"]
-    thread_id = state.get("thread_id", "")
     
-    # 如果状态中已存在消息历史，则使用它；否则初始化一个新的
-    messages = state.get("messages", [])
+    # 状态中的消息历史只读，本轮的消息由节点作为增量返回，经归约函数追加到历史
+    history = state.get("messages") or []
+    user_message = {"role": "user", "content": query}
     
-    # 添加当前用户消息到历史
-    if not any(msg.get("role") == "user" and msg.get("content") == query for msg in messages):
-        messages.append({"role": "user", "content": query})
+    print(f"对话线程ID: {thread_id}")
+    print(f"历史消息数量: {len(history)}")
     
-    try:
-        print(f"对话线程ID: {thread_id}")
-        print(f"历史消息数量: {len(messages)}")
-        
-        # 聊天系统提示
-        system_prompt = """你是一个AI助手，回答用户的各种问题。
-对于非生物信息相关的普通聊天，请提供友好、自然、有帮助的回答。
-保持回答简洁、清晰。
-如果用户询问之前的对话内容，请查看历史消息并进行回答。"""
-        
-        # 构建完整的聊天请求
-        chat_messages = [{"role": "system", "content": system_prompt}]
-        chat_messages.extend(messages)
+    # 构建完整的聊天请求
+    chat_messages = [{"role": "system", "content": CHAT_SYSTEM_PROMPT}]
+    chat_messages.extend(history)
+    chat_messages.append(user_message)
+    
+    # 打印历史消息用于调试
+    print("聊天消息历史:")
+    for i, msg in enumerate(chat_messages):
+        print(f"  {i}. {msg['role']}: {msg['content'][:50]}...")
+    
+    return user_message, chat_messages
+
+def chat_node(state: Dict[str, Any], config: RunnableConfig) -> Dict[str, Any]:
+    """
+    聊天节点：处理与生物信息无关的普通聊天
+    
+    Args:
+        state: 当前状态，包含查询和消息历史
+        config: 运行配置，configurable中包含LLM实例和模型信息
         
-        # 打印历史消息用于调试
-        print("聊天消息历史:")
-        for i, msg in enumerate(chat_messages):
-            print(f"  {i}. {msg['role']}: {msg['content'][:50]}...")
+    Returns:
+        更新后的状态，包含聊天回复和本轮新增的消息
+    """
+    runtime = _runtime(config)
+    llm = runtime["llm"]
+    
+    try:
+        user_message, chat_messages = _prepare_chat_messages(state, runtime["thread_id"])
         
         # 使用LLM生成回答
         response = llm.invoke(chat_messages)
-        chat_answer = response.content.strip()
+        chat_answer = _response_text(response)
         
-        # 添加AI回复到历史
-        messages.append({"role": "assistant", "content": chat_answer})
-        
-        # 返回更新后的状态
+        # 只返回本轮的用户消息和AI回复，检查点中消息通道按增量追加
+        return {
+            "answer": chat_answer,
+            "messages": [user_message, {"role": "assistant", "content": chat_answer}]
+        }
+    except Exception as e:
+        print(f"聊天节点错误: {e}")
+        return {"answer": f"抱歉，处理您的问题时出现了错误: {str(e)}"}
+
+async def achat_node(state: Dict[str, Any], config: RunnableConfig) -> Dict[str, Any]:
+    """聊天节点的异步版本"""
+    runtime = _runtime(config)
+    llm = runtime["llm"]
+    
+    try:
+        user_message, chat_messages = _prepare_chat_messages(state, runtime["thread_id"])
+        response = await llm.ainvoke(chat_messages)
+        chat_answer = _response_text(response)
         return {
             "answer": chat_answer,
-            "messages": messages  # 保存更新后的消息历史
+            "messages": [user_message, {"role": "assistant", "content": chat_answer}]
         }
     except Exception as e:
         print(f"聊天节点错误: {e}")
@@ -202,7 +491,7 @@ def aggregator_node(state: Dict[str, Any]) -> Dict[str, Any]:
     # 返回最终答案
     return {"answer": answer}
 
-def route_node(state: Dict[str, Any]) -> str:
+def route_node(state: Dict[str, Any]) -> Union[str, List[str]]:
     """
     路由节点：根据意图决定下一个节点
     
@@ -210,7 +499,7 @@ def route_node(state: Dict[str, Any]) -> str:
         state: 当前状态，包含意图分类结果
         
     Returns:
-        下一个节点的名称
+        下一个节点的名称；BOTH意图返回SQL和RAG两个节点，两者并行执行
     """
     intent = state.get("intent", "rag")
     
@@ -221,8 +510,8 @@ def route_node(state: Dict[str, Any]) -> str:
         print("路由到RAG节点")
         return "rag"
     elif intent == "both":
-        print("路由到SQL节点，然后RAG节点")
-        return "sql"
+        print("并行路由到SQL节点和RAG节点")
+        return ["sql", "rag"]
     elif intent == "chat":
         print("路由到聊天节点")
         return "chat"
@@ -0,0 +1,351 @@
+"""
+进程内的BM25词法索引
+
+与向量库使用相同的文本块，在导入时一起构建。向量检索对GSE编号、基因符号、DESeq2等工具名这类需要精确匹配的词不敏感，
+BM25检索结果与向量检索结果按chunk_id做倒数排名融合（RRF），不增加向量检索的k。
+
+分词：中文按相邻两字切分（bigram，单字的中文片段保留单字），英文和数字按词切分并转为小写，
+带连字符或点的词（如crispr-cas9）同时保留整体和各部分。
+
+索引目录中包含：
+- vocab.json: 词到编号的映射
+- term_offsets.npy: 每个词的倒排表在postings.npy/tfs.npy中的起止位置（CSR格式）
+- postings.npy: 文本块编号（uint32），tfs.npy: 词频（uint16）
+- doc_lengths.npy: 每个文本块的词数
+- docs.jsonl/doc_offsets.npy: 文本块内容和元数据，检索后只读取top-k
+- index.json: 文本块数、词数、平均长度
+- metadata_index.json: accession/organism/topic到行号的二级索引，用于按元数据预过滤
+"""
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import time
+import numpy as np
+from app.config import settings
+from app.tools.metadata_filters import Filters, MetadataIndex
+
+VOCAB_FILE = "vocab.json"
+TERM_OFFSETS_FILE = "term_offsets.npy"
+POSTINGS_FILE = "postings.npy"
+TFS_FILE = "tfs.npy"
+DOC_LENGTHS_FILE = "doc_lengths.npy"
+DOCS_FILE = "docs.jsonl"
+DOC_OFFSETS_FILE = "doc_offsets.npy"
+MANIFEST_FILE = "index.json"
+
+# BM25参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 倒数排名融合的平滑常数
+RRF_K = 60
+
+_TOKEN_PATTERN = re.compile(r"[一-鿿]+|[a-z0-9]+(?:[-.][a-z0-9]+)*")
+
+def tokenize(text: str) -> List[str]:
+    """中文按bigram切分，英文和数字按词切分"""
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(text.lower()):
+        piece = match.group()
+        if "一" <= piece[0] <= "鿿":
+            if len(piece) == 1:
+                tokens.append(piece)
+            else:
+                tokens.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+        else:
+            tokens.append(piece)
+            if "-" in piece or "." in piece:
+                tokens.extend(part for part in re.split(r"[-.]", piece) if part)
+    return tokens
+
+class BM25Builder:
+    """
+    边读取文本块边构建BM25索引，文本块内容直接写入临时目录，倒排表保存在紧凑的数组中
+
+    Args:
+        path: 索引目录，构建完成后整体替换
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self._docs = open(os.path.join(self.tmp_path, DOCS_FILE), "wb")
+        self._doc_offsets = array("q", [0])
+        self._doc_lengths = array("I")
+        self._vocab: Dict[str, int] = {}
+        self._postings: List[array] = []
+        self._tfs: List[array] = []
+        self._metadata_index = MetadataIndex()
+
+    def add(self, document: Any) -> None:
+        """添加一个文本块（page_content、metadata）"""
+        doc_id = len(self._doc_lengths)
+        tokens = tokenize(document.page_content)
+        counts: Dict[str, int] = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, count in counts.items():
+            term_id = self._vocab.get(token)
+            if term_id is None:
+                term_id = self._vocab[token] = len(self._postings)
+                self._postings.append(array("I"))
+                self._tfs.append(array("H"))
+            self._postings[term_id].append(doc_id)
+            self._tfs[term_id].append(min(count, 65535))
+        self._doc_lengths.append(len(tokens))
+        self._metadata_index.add(doc_id, document.metadata)
+
+        line = json.dumps({"page_content": document.page_content, "metadata": document.metadata}, ensure_ascii=False).encode("utf-8") + b"\n"
+        self._docs.write(line)
+        self._doc_offsets.append(self._doc_offsets[-1] + len(line))
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    def save(self) -> Dict[str, Any]:
+        """写入数组文件并替换旧索引"""
+        self._docs.close()
+        term_offsets = np.zeros(len(self._postings) + 1, dtype=np.int64)
+        np.cumsum([len(postings) for postings in self._postings], out=term_offsets[1:])
+        postings = np.lib.format.open_memmap(os.path.join(self.tmp_path, POSTINGS_FILE), mode="w+", dtype=np.uint32, shape=(int(term_offsets[-1]),))
+        tfs = np.lib.format.open_memmap(os.path.join(self.tmp_path, TFS_FILE), mode="w+", dtype=np.uint16, shape=(int(term_offsets[-1]),))
+        for term_id in range(len(self._postings)):
+            start, end = term_offsets[term_id], term_offsets[term_id + 1]
+            postings[start:end] = np.frombuffer(self._postings[term_id], dtype=np.uint32)
+            tfs[start:end] = np.frombuffer(self._tfs[term_id], dtype=np.uint16)
+        postings.flush()
+        tfs.flush()
+        del postings, tfs
+
+        np.save(os.path.join(self.tmp_path, TERM_OFFSETS_FILE), term_offsets)
+        np.save(os.path.join(self.tmp_path, DOC_LENGTHS_FILE), np.frombuffer(self._doc_lengths, dtype=np.uint32))
+        np.save(os.path.join(self.tmp_path, DOC_OFFSETS_FILE), np.frombuffer(self._doc_offsets, dtype=np.int64))
+        with open(os.path.join(self.tmp_path, VOCAB_FILE), "w", encoding="utf-8") as f:
+            json.dump(self._vocab, f, ensure_ascii=False)
+        self._metadata_index.save(self.tmp_path)
+
+        count = len(self._doc_lengths)
+        manifest = {
+            "count": count,
+            "terms": len(self._vocab),
+            "avg_length": sum(self._doc_lengths) / count if count else 0.0,
+            "created": time.time()
+        }
+        with open(os.path.join(self.tmp_path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+
+        old_path = f"{self.path}.old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(self.path):
+            os.replace(self.path, old_path)
+        os.replace(self.tmp_path, self.path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        print(f"BM25索引构建完成: {count} 个文本块，{len(self._vocab)} 个词")
+        return manifest
+
+    def abort(self) -> None:
+        """放弃构建，保留原有索引"""
+        self._docs.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+class BM25Index:
+    """
+    只读的BM25索引，数组以mmap方式打开
+
+    Args:
+        path: 索引目录
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        self._manifest_mtime = os.stat(manifest_path).st_mtime_ns
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        with open(os.path.join(path, VOCAB_FILE), "r", encoding="utf-8") as f:
+            self.vocab: Dict[str, int] = json.load(f)
+        self.term_offsets = np.load(os.path.join(path, TERM_OFFSETS_FILE), mmap_mode="r")
+        self.postings = np.load(os.path.join(path, POSTINGS_FILE), mmap_mode="r")
+        self.tfs = np.load(os.path.join(path, TFS_FILE), mmap_mode="r")
+        self.doc_lengths = np.load(os.path.join(path, DOC_LENGTHS_FILE), mmap_mode="r")
+        self.doc_offsets = np.load(os.path.join(path, DOC_OFFSETS_FILE), mmap_mode="r")
+        self._docs_fd = os.open(os.path.join(path, DOCS_FILE), os.O_RDONLY)
+        self.metadata_index = MetadataIndex.load(path)
+        # 长度归一化项只与文本块有关，加载时计算一次
+        avg_length = self.manifest.get("avg_length") or 1.0
+        self._norms = (BM25_K1 * (1 - BM25_B + BM25_B * np.asarray(self.doc_lengths, dtype=np.float32) / avg_length)).astype(np.float32)
+
+    def __len__(self) -> int:
+        return self.doc_lengths.shape[0]
+
+    def is_stale(self) -> bool:
+        """索引目录是否已被重新构建"""
+        try:
+            return os.stat(os.path.join(self.path, MANIFEST_FILE)).st_mtime_ns != self._manifest_mtime
+        except OSError:
+            return False
+
+    def _read_document(self, row: int) -> Dict[str, Any]:
+        start, end = int(self.doc_offsets[row]), int(self.doc_offsets[row + 1])
+        return json.loads(os.pread(self._docs_fd, end - start, start))
+
+    def search(self, query: str, k: int = 4, filters: Optional[Filters] = None) -> List[Tuple[Any, float]]:
+        """
+        按BM25检索
+
+        Args:
+            query: 查询文本
+            k: 返回的文本块数
+            filters: {字段: 取值}形式的元数据过滤条件，旧版本索引没有元数据索引时忽略
+
+        Returns:
+            [(Document, BM25分数), ...]，按分数从高到低排列；没有匹配的词时返回空列表
+        """
+        from langchain_core.documents import Document
+
+        total = len(self)
+        term_ids = {self.vocab[token] for token in tokenize(query) if token in self.vocab}
+        if total == 0 or not term_ids:
+            return []
+
+        scores = np.zeros(total, dtype=np.float32)
+        for term_id in term_ids:
+            start, end = int(self.term_offsets[term_id]), int(self.term_offsets[term_id + 1])
+            doc_ids = self.postings[start:end]
+            tfs = self.tfs[start:end].astype(np.float32)
+            df = end - start
+            idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+            # 每个词在一个文本块中只出现一次，可以直接按下标累加
+            scores[doc_ids] += idf * tfs * (BM25_K1 + 1) / (tfs + self._norms[doc_ids])
+
+        if filters and self.metadata_index is not None:
+            allowed = np.zeros(total, dtype=bool)
+            allowed[self.metadata_index.rows(filters)] = True
+            scores[~allowed] = 0.0
+
+        matched = int(np.count_nonzero(scores))
+        k = min(k, matched)
+        if k == 0:
+            return []
+        candidates = np.argpartition(-scores, k - 1)[:k] if k < total else np.arange(total)
+        ranked = candidates[np.argsort(-scores[candidates])]
+        results = []
+        for row in ranked:
+            record = self._read_document(int(row))
+            results.append((Document(page_content=record["page_content"], metadata=record.get("metadata") or {}), float(scores[row])))
+        return results
+
+    def close(self) -> None:
+        if self._docs_fd is not None:
+            os.close(self._docs_fd)
+            self._docs_fd = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except (AttributeError, OSError):
+            pass
+
+def document_key(document: Any) -> str:
+    """融合时识别同一文本块的键，旧数据没有chunk_id时使用内容"""
+    return document.metadata.get("chunk_id") or document.page_content
+
+def reciprocal_rank_fusion(result_lists: Iterable[List[Any]], k: int, rrf_k: int = RRF_K) -> List[Any]:
+    """
+    倒数排名融合：每个文本块的分数为其在各结果列表中1 / (rrf_k + 名次)之和
+
+    Args:
+        result_lists: 多个按相关度排列的Document列表
+        k: 返回的文本块数
+        rrf_k: 平滑常数
+
+    Returns:
+        融合后的前k个Document
+    """
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Any] = {}
+    for results in result_lists:
+        for rank, document in enumerate(results, 1):
+            key = document_key(document)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            documents.setdefault(key, document)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[key] for key in ranked]
+
+def resolve_bm25_index_path() -> str:
+    """BM25索引目录的绝对路径"""
+    return os.path.normpath(os.path.join(os.getcwd(), settings.bm25_index_path))
+
+_bm25_index: Optional[BM25Index] = None
+_bm25_lock = threading.Lock()
+_bm25_state: Dict[str, Any] = {"searches": 0, "hits": 0, "error": None, "checked_at": None}
+
+def get_bm25_index() -> Optional[BM25Index]:
+    """
+    获取当前进程的BM25索引，第一次调用时加载，重新构建后自动重新加载
+
+    Returns:
+        BM25Index；未启用、索引不存在或加载失败时返回None，检索退化为只使用向量检索
+    """
+    global _bm25_index
+    if not settings.bm25_enabled:
+        return None
+    index = _bm25_index
+    if index is not None and not index.is_stale():
+        return index
+
+    with _bm25_lock:
+        if _bm25_index is not None and not _bm25_index.is_stale():
+            return _bm25_index
+        # 索引不存在时每隔vector_retry_interval秒再检查一次
+        checked_at = _bm25_state["checked_at"]
+        if _bm25_index is None and checked_at is not None and time.monotonic() - checked_at < settings.vector_retry_interval:
+            return None
+        _bm25_state["checked_at"] = time.monotonic()
+
+        path = resolve_bm25_index_path()
+        if not os.path.exists(os.path.join(path, MANIFEST_FILE)):
+            _bm25_index = None
+            _bm25_state["error"] = f"BM25索引不存在: {path}，请重新运行 python -m app.data_loader.ingest_chromadb"
+            print(_bm25_state["error"])
+            return None
+        try:
+            _bm25_index = BM25Index(path)
+            _bm25_state["error"] = None
+            print(f"已加载BM25索引: {len(_bm25_index)} 个文本块，{len(_bm25_index.vocab)} 个词")
+        except Exception as e:
+            _bm25_index = None
+            _bm25_state["error"] = f"加载BM25索引失败: {e}"
+            print(_bm25_state["error"])
+        return _bm25_index
+
+def bm25_search(query: str, k: int, filters: Optional[Filters] = None) -> List[Any]:
+    """BM25检索，索引不可用时返回空列表"""
+    index = get_bm25_index()
+    if index is None:
+        return []
+    results = [document for document, _ in index.search(query, k, filters)]
+    _bm25_state["searches"] += 1
+    if results:
+        _bm25_state["hits"] += 1
+    return results
+
+def get_bm25_stats() -> Dict[str, Any]:
+    """获取BM25索引的统计信息"""
+    index = _bm25_index
+    return {
+        "enabled": settings.bm25_enabled,
+        "loaded": index is not None,
+        "documents": len(index) if index is not None else 0,
+        "terms": len(index.vocab) if index is not None else 0,
+        "searches": _bm25_state["searches"],
+        "hits": _bm25_state["hits"],
+        "error": _bm25_state["error"],
+    }
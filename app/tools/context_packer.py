@@ -0,0 +1,166 @@
+"""
+RAG上下文装配
+
+检索得到的候选文本块先按最大边际相关性（MMR）重排并去掉近似重复的文本块，
+再按顺序贪心装入按模型配置的token预算，提示更短，生成更快、更便宜。
+候选文本块和查询的嵌入来自嵌入缓存（导入和检索时已经计算过），不会重新调用嵌入模型。
+
+token数优先使用tiktoken计算，未安装或没有对应编码时按字符估算。
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import re
+import threading
+import numpy as np
+from app.config import settings
+from app.tools.vector_store import get_embeddings
+
+_encoders: Dict[str, Any] = {}
+_encoders_lock = threading.Lock()
+
+_CJK_PATTERN = re.compile(r"[一-鿿]")
+_WORD_PATTERN = re.compile(r"[A-Za-z0-9]+|[^\sA-Za-z0-9一-鿿]")
+
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "candidates": 0, "duplicates_dropped": 0, "truncated": 0, "baseline_tokens": 0, "packed_tokens": 0}
+
+def _get_encoder(model: str) -> Optional[Any]:
+    """按模型缓存tiktoken编码器，不可用时返回None"""
+    with _encoders_lock:
+        if model not in _encoders:
+            try:
+                import tiktoken
+                try:
+                    _encoders[model] = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    _encoders[model] = tiktoken.get_encoding("cl100k_base")
+            except Exception:
+                _encoders[model] = None
+        return _encoders[model]
+
+def count_tokens(text: str, model: str) -> int:
+    """
+    计算文本的token数
+
+    没有tiktoken时按每个汉字1个token、每个英文单词或符号约1.3个token估算
+    """
+    encoder = _get_encoder(model)
+    if encoder is not None:
+        return len(encoder.encode(text))
+    cjk = len(_CJK_PATTERN.findall(text))
+    others = len(_WORD_PATTERN.findall(text))
+    return cjk + int(others * 1.3 + 0.5)
+
+def _truncate(text: str, budget: int, model: str) -> str:
+    """截断文本到budget个token以内"""
+    encoder = _get_encoder(model)
+    if encoder is not None:
+        return encoder.decode(encoder.encode(text)[:budget])
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle], model) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low]
+
+def get_context_budget(model: str) -> int:
+    """模型的上下文token预算，rag_context_tokens_by_model中没有配置时使用rag_context_tokens"""
+    return settings.rag_context_tokens_by_model.get(model, settings.rag_context_tokens)
+
+def mmr_order(query_vector: np.ndarray, doc_vectors: np.ndarray, lambda_mult: float, duplicate_threshold: float) -> Tuple[List[int], int]:
+    """
+    按最大边际相关性排列候选文本块
+
+    每一步选择 lambda_mult * 与查询的相似度 - (1 - lambda_mult) * 与已选文本块的最大相似度 最高的候选；
+    与已选文本块的相似度不低于duplicate_threshold的候选视为近似重复并丢弃
+
+    Returns:
+        (排列后的候选下标, 丢弃的近似重复数)
+    """
+    query_vector = query_vector / (np.linalg.norm(query_vector) or 1.0)
+    norms = np.linalg.norm(doc_vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    doc_vectors = doc_vectors / norms
+
+    relevance = doc_vectors @ query_vector
+    similarity = doc_vectors @ doc_vectors.T
+    remaining = list(range(len(doc_vectors)))
+    max_similarity = np.full(len(doc_vectors), -np.inf, dtype=np.float32)
+    order, dropped = [], 0
+    while remaining:
+        candidates = np.asarray(remaining)
+        redundancy = np.where(np.isfinite(max_similarity[candidates]), max_similarity[candidates], 0.0)
+        scores = lambda_mult * relevance[candidates] - (1 - lambda_mult) * redundancy
+        best = int(candidates[int(np.argmax(scores))])
+        remaining.remove(best)
+        order.append(best)
+        max_similarity = np.maximum(max_similarity, similarity[best])
+        duplicates = [index for index in remaining if max_similarity[index] >= duplicate_threshold]
+        for index in duplicates:
+            remaining.remove(index)
+        dropped += len(duplicates)
+    return order, dropped
+
+def pack_context(query: str, docs: List[Any], model: str) -> List[str]:
+    """
+    选择装入提示的文本块
+
+    Args:
+        query: 查询文本
+        docs: 按检索相关度排列的候选文本块
+        model: 生成回答的模型名称，决定token预算和分词方式
+
+    Returns:
+        装入上下文的文本块内容，最多rag_top_k个，总token数不超过预算
+    """
+    if not docs:
+        return []
+    texts = [doc.page_content for doc in docs]
+    order, dropped = list(range(len(texts))), 0
+    if len(texts) > 1:
+        try:
+            embeddings = get_embeddings()
+            query_vector = np.asarray(embeddings.embed_query(query), dtype=np.float32)
+            doc_vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+            order, dropped = mmr_order(query_vector, doc_vectors, settings.rag_mmr_lambda, settings.rag_duplicate_threshold)
+        except Exception as e:
+            # 嵌入不可用时保持检索顺序，只做token预算控制
+            print(f"MMR重排失败，保持检索顺序: {e}")
+
+    budget = get_context_budget(model)
+    # 上下文中文本块之间用空行分隔
+    separator_tokens = count_tokens("\n\n", model)
+    packed, used, truncated = [], 0, 0
+    for index in order:
+        if len(packed) >= settings.rag_top_k:
+            break
+        cost = count_tokens(texts[index], model) + (separator_tokens if packed else 0)
+        if used + cost <= budget:
+            packed.append(texts[index])
+            used += cost
+        elif not packed:
+            # 第一个文本块就超出预算时截断，保证上下文不为空
+            packed.append(_truncate(texts[index], budget, model))
+            used = budget
+            truncated += 1
+            break
+
+    baseline = count_tokens("\n\n".join(texts[:settings.rag_top_k]), model)
+    with _stats_lock:
+        _stats["requests"] += 1
+        _stats["candidates"] += len(texts)
+        _stats["duplicates_dropped"] += dropped
+        _stats["truncated"] += truncated
+        _stats["baseline_tokens"] += baseline
+        _stats["packed_tokens"] += used
+    return packed
+
+def get_context_stats() -> Dict[str, Any]:
+    """获取上下文装配的统计信息，tokens_saved为与直接拼接前rag_top_k个文本块相比节省的token数"""
+    with _stats_lock:
+        return {
+            **_stats,
+            "tokens_saved": max(0, _stats["baseline_tokens"] - _stats["packed_tokens"]),
+            "tokenizer": "tiktoken" if any(_encoders.values()) else "estimate",
+        }
@@ -0,0 +1,149 @@
+"""
+按内容寻址的嵌入缓存
+
+以(嵌入模型, 文本的SHA-256)为键把嵌入持久化到SQLite，导入和查询共用同一个缓存文件：
+重新导入未变化的语料不再调用嵌入模型，重复的查询也不再重新计算嵌入。
+SQLite前面有一层有界的内存LRU，热点查询不需要访问磁盘。
+"""
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+import hashlib
+import os
+import sqlite3
+import threading
+
+# 每条SQL中IN子句的最大参数数（SQLite默认上限为999）
+_LOOKUP_CHUNK = 500
+
+def text_hash(text: str) -> str:
+    """文本的SHA-256摘要，作为缓存键的一部分"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class CachedEmbeddings:
+    """
+    带持久化缓存的嵌入模型包装，接口与LangChain的Embeddings相同
+
+    Args:
+        embeddings: 实际计算嵌入的模型，需提供embed_documents和embed_query
+        model: 嵌入模型名称，不同模型的嵌入互不共享
+        path: SQLite缓存文件路径
+        max_memory_entries: 内存LRU的最大条目数
+    """
+
+    def __init__(self, embeddings: Any, model: str, path: str, max_memory_entries: int = 4096):
+        self.embeddings = embeddings
+        self.model = model
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "embed_calls": 0}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash TEXT NOT NULL, dim INTEGER NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, text_hash)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+    def _remember(self, key: str, vector: List[float]) -> None:
+        """放入内存LRU，调用方需持有锁"""
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        """依次从内存和SQLite中查找嵌入"""
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            missing = []
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is None:
+                    missing.append(key)
+                else:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+            self.stats["memory_hits"] += len(found)
+
+            for start in range(0, len(missing), _LOOKUP_CHUNK):
+                chunk = missing[start:start + _LOOKUP_CHUNK]
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({', '.join('?' * len(chunk))})",
+                    [self.model, *chunk]
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f", blob).tolist()
+                    found[key] = vector
+                    self._remember(key, vector)
+                self.stats["disk_hits"] += len(rows)
+        return found
+
+    def _store(self, vectors: Dict[str, List[float]]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, dim, vector) VALUES (?, ?, ?, ?)",
+                [(self.model, key, len(vector), array("f", vector).tobytes()) for key, vector in vectors.items()]
+            )
+            self._conn.commit()
+            for key, vector in vectors.items():
+                self._remember(key, vector)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        计算一批文本的嵌入，只对缓存中没有的文本（去重后）调用嵌入模型
+
+        Args:
+            texts: 文本列表
+
+        Returns:
+            与texts一一对应的嵌入
+        """
+        keys = [text_hash(text) for text in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+
+        pending: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in pending:
+                pending[key] = text
+        if pending:
+            with self._lock:
+                self.stats["misses"] += len(pending)
+                self.stats["embed_calls"] += 1
+            computed = self.embeddings.embed_documents(list(pending.values()))
+            new_vectors = {key: [float(x) for x in vector] for key, vector in zip(pending, computed)}
+            self._store(new_vectors)
+            found.update(new_vectors)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        """计算查询文本的嵌入"""
+        key = text_hash(text)
+        found = self._lookup([key])
+        if key in found:
+            return found[key]
+        with self._lock:
+            self.stats["misses"] += 1
+            self.stats["embed_calls"] += 1
+        vector = [float(x) for x in self.embeddings.embed_query(text)]
+        self._store({key: vector})
+        return vector
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        with self._lock:
+            lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+            hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+            return {
+                **self.stats,
+                "memory_entries": len(self._memory),
+                "hit_rate": hits / lookups if lookups else 0.0
+            }
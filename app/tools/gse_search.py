@@ -0,0 +1,364 @@
+"""
+GSE标题和摘要的全文检索
+
+用SQLite FTS5建立gse_fts索引（外部内容表，内容来自gse），由触发器与gse保持同步。
+索引由app/db/schema.sql（scripts/setup_db.sh）或GEO导入创建，已有数据库可用
+python -m app.tools.gse_search 重建；应用只读打开数据库，索引缺失时检索返回None，由LLM生成SQL。
+优先使用trigram分词器：按3字符子串建立索引，中英文都可以做子串匹配（如metabol匹配metabolism/metabolic）；
+trigram无法匹配少于3个字符的词，未收录在术语表中的两字中文词改用LIKE在标题和摘要中匹配。
+SQLite不支持trigram时退回unicode61分词器，英文词按前缀匹配。
+
+"找关于肝脏脂肪代谢的数据集"这类关键词式的问题不再由LLM生成全表扫描的LIKE查询，
+而是抽取检索词（中文生物医学术语映射为GEO元数据中使用的英文词干）后查询索引，按bm25排序
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import argparse
+import re
+import sqlite3
+
+# 参与全文索引的gse列，标题在排序时的权重更高
+FTS_COLUMNS = ("title", "description")
+FTS_WEIGHTS = {"title": 10.0, "description": 1.0}
+
+# 检索结果中返回的gse列
+RESULT_COLUMNS = ("accession", "title", "organism", "platform", "sample_count")
+
+FTS_TRIGGERS = ("gse_fts_ai", "gse_fts_ad", "gse_fts_au")
+
+# 关键词式检索的提示，如"找关于…的数据集"、"搜索…的研究"、"…相关的系列"：
+# 需要同时有检索用语和数据集类的名词，只有"找"的问题（如"找一下肝癌的生存率"）不是数据集检索
+KEYWORD_SEARCH_PATTERN = re.compile(r"找|搜索|查找|检索|关于|有关|相关|涉及|search|find", re.IGNORECASE)
+DATASET_CUE_PATTERN = re.compile(r"数据集|研究|实验|系列|gse|geo|dataset|series|stud(?:y|ies)", re.IGNORECASE)
+
+# 需要统计或精确条件的问题仍交给LLM生成SQL
+AGGREGATE_CUES = ("多少", "几个", "统计", "数量", "平均", "总共", "最多", "最少", "排序", "count")
+
+ACCESSION_PATTERN = re.compile(r"(?<![A-Za-z0-9])(?:GSE|GSM|GPL|GDS)\d+(?![0-9])", re.IGNORECASE)
+
+# 中文术语到GEO元数据中英文词干的映射，按长度从长到短匹配
+TERM_GLOSSARY = {
+    "单细胞": ("single-cell", "single cell"),
+    "干细胞": ("stem cell",),
+    "巨噬细胞": ("macrophage",),
+    "神经元": ("neuron",),
+    "转录组": ("transcriptom",),
+    "表达谱": ("expression profil",),
+    "甲基化": ("methylation",),
+    "染色质": ("chromatin",),
+    "测序": ("sequencing",),
+    "非酒精性脂肪肝": ("nafld", "nonalcoholic fatty liver"),
+    "脂肪肝": ("fatty liver", "steatosis"),
+    "肝脏": ("liver", "hepat"),
+    "肝": ("liver", "hepat"),
+    "脂肪": ("adipo", "lipid", "fat"),
+    "代谢": ("metabol",),
+    "脑": ("brain",),
+    "肺": ("lung", "pulmonary"),
+    "心脏": ("heart", "cardi"),
+    "肾脏": ("kidney", "renal"),
+    "肾": ("kidney", "renal"),
+    "肠道": ("intestin", "gut"),
+    "结肠": ("colon",),
+    "胰腺": ("pancrea",),
+    "乳腺": ("breast", "mammary"),
+    "前列腺": ("prostate",),
+    "皮肤": ("skin",),
+    "肌肉": ("muscle",),
+    "骨": ("bone",),
+    "血液": ("blood",),
+    "肿瘤": ("tumor", "cancer"),
+    "癌": ("cancer", "carcinoma"),
+    "白血病": ("leukemia",),
+    "淋巴瘤": ("lymphoma",),
+    "免疫": ("immun",),
+    "炎症": ("inflamm",),
+    "感染": ("infect",),
+    "病毒": ("virus", "viral"),
+    "糖尿病": ("diabet",),
+    "肥胖": ("obes",),
+    "衰老": ("aging", "ageing"),
+    "胚胎": ("embryo",),
+    "发育": ("develop",),
+    "缺氧": ("hypoxia",),
+    "高脂": ("high-fat", "high fat"),
+    "饮食": ("diet",),
+    "药物": ("drug",),
+    "小鼠": ("mouse", "mice"),
+    "大鼠": ("rat",),
+    "人类": ("human",),
+    "斑马鱼": ("zebrafish",),
+    "拟南芥": ("arabidopsis",),
+}
+
+# 从问题中去掉的中文虚词和检索用语
+CHINESE_FILLERS = re.compile(
+    r"帮我|请|一下|找|搜索|查找|检索|关于|有关|相关|涉及|的|了|和|与|及|或|在|中|有哪些|哪些|一些|所有|"
+    r"数据集|数据|研究|实验|系列|样本|结果|是否|有没有|吗|呢"
+)
+
+ENGLISH_STOPWORDS = {
+    "find", "search", "about", "related", "dataset", "datasets", "series", "study", "studies",
+    "the", "and", "for", "with", "that", "this", "from", "any", "all", "gse", "geo", "data"
+}
+
+def is_searchable(question: str) -> bool:
+    """判断问题能否用全文检索回答：不针对具体编号，也不需要统计"""
+    if ACCESSION_PATTERN.search(question):
+        return False
+    lowered = question.lower()
+    return not any(cue in lowered for cue in AGGREGATE_CUES)
+
+def is_keyword_search(question: str) -> bool:
+    """判断问题是否是关键词式的数据集检索"""
+    return (
+        is_searchable(question)
+        and bool(KEYWORD_SEARCH_PATTERN.search(question))
+        and bool(DATASET_CUE_PATTERN.search(question))
+    )
+
+def _candidate_terms(question: str) -> List[str]:
+    """从问题中抽取去重后的全部候选检索词，不限长度"""
+    terms: List[str] = []
+    text = question
+
+    for chinese in sorted(TERM_GLOSSARY, key=len, reverse=True):
+        if chinese in text:
+            terms.extend(TERM_GLOSSARY[chinese])
+            text = text.replace(chinese, " ")
+
+    for word in re.findall(r"[A-Za-z][A-Za-z0-9\-]*", text):
+        if word.lower() not in ENGLISH_STOPWORDS:
+            terms.append(word.lower())
+
+    # 未收录的中文片段原样作为短语检索（中文标题或摘要）
+    for run in re.findall(r"[一-鿿]+", text):
+        for piece in CHINESE_FILLERS.split(run):
+            terms.append(piece)
+
+    return [term for term in dict.fromkeys(terms) if term]
+
+def extract_search_terms(question: str, min_length: int = 3) -> List[str]:
+    """
+    从问题中抽取检索词
+
+    Args:
+        question: 用户问题
+        min_length: 检索词的最小长度，trigram分词器无法匹配少于3个字符的词
+
+    Returns:
+        检索词列表（英文小写）
+    """
+    return [term for term in _candidate_terms(question) if len(term) >= min_length]
+
+def extract_like_terms(question: str, min_length: int = 3) -> List[str]:
+    """
+    抽取短于min_length、无法用全文索引匹配的中文检索词（至少2个字符），改用LIKE匹配
+
+    Args:
+        question: 用户问题
+        min_length: 全文索引能匹配的最小长度
+
+    Returns:
+        中文检索词列表
+    """
+    return [
+        term for term in _candidate_terms(question)
+        if 2 <= len(term) < min_length and re.fullmatch(r"[一-鿿]+", term)
+    ]
+
+def _fts_info(conn: sqlite3.Connection) -> Optional[Tuple[str, List[str]]]:
+    """返回gse_fts的(分词器, 列)，索引不存在时返回None"""
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'gse_fts'").fetchone()
+    if row is None:
+        return None
+    tokenizer = "trigram" if "trigram" in row[0] else "unicode61"
+    columns = [info[1] for info in conn.execute("PRAGMA table_info(gse_fts)")]
+    return tokenizer, columns
+
+def drop_fts_triggers(conn: sqlite3.Connection) -> None:
+    """删除同步触发器，批量导入期间使用，导入后调用ensure_fts_index(rebuild=True)重建索引"""
+    for trigger in FTS_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+def ensure_fts_index(conn: sqlite3.Connection, rebuild: bool = False) -> Optional[str]:
+    """
+    创建或修复gse_fts索引及其同步触发器
+
+    gse的可索引列发生变化（如旧数据库补齐了description列）时重建索引；
+    触发器缺失（如批量导入中断）时重新创建并重建索引内容
+
+    Args:
+        conn: 可写的sqlite3连接
+        rebuild: 是否强制从gse重建索引内容
+
+    Returns:
+        使用的分词器，gse表不存在时返回None
+    """
+    gse_columns = {row[1] for row in conn.execute("PRAGMA table_info(gse)")}
+    columns = [column for column in FTS_COLUMNS if column in gse_columns]
+    if not columns:
+        return None
+
+    info = _fts_info(conn)
+    if info is not None and info[1] != columns:
+        drop_fts_triggers(conn)
+        conn.execute("DROP TABLE gse_fts")
+        info = None
+
+    if info is None:
+        column_list = ", ".join(columns)
+        try:
+            conn.execute(f"CREATE VIRTUAL TABLE gse_fts USING fts5({column_list}, content='gse', content_rowid='id', tokenize='trigram')")
+            tokenizer = "trigram"
+        except sqlite3.OperationalError as e:
+            print(f"SQLite不支持trigram分词器（{e}），使用unicode61")
+            conn.execute(f"CREATE VIRTUAL TABLE gse_fts USING fts5({column_list}, content='gse', content_rowid='id', tokenize='unicode61 remove_diacritics 2')")
+            tokenizer = "unicode61"
+        rebuild = True
+    else:
+        tokenizer = info[0]
+
+    existing_triggers = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'gse'")}
+    if not set(FTS_TRIGGERS) <= existing_triggers:
+        column_list = ", ".join(columns)
+        new_values = ", ".join(f"new.{column}" for column in columns)
+        old_values = ", ".join(f"old.{column}" for column in columns)
+        conn.executescript(f"""
+            CREATE TRIGGER IF NOT EXISTS gse_fts_ai AFTER INSERT ON gse BEGIN
+                INSERT INTO gse_fts(rowid, {column_list}) VALUES (new.id, {new_values});
+            END;
+            CREATE TRIGGER IF NOT EXISTS gse_fts_ad AFTER DELETE ON gse BEGIN
+                INSERT INTO gse_fts(gse_fts, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+            END;
+            CREATE TRIGGER IF NOT EXISTS gse_fts_au AFTER UPDATE OF {column_list} ON gse BEGIN
+                INSERT INTO gse_fts(gse_fts, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+                INSERT INTO gse_fts(rowid, {column_list}) VALUES (new.id, {new_values});
+            END;
+        """)
+        rebuild = True
+
+    if rebuild:
+        conn.execute("INSERT INTO gse_fts(gse_fts) VALUES ('rebuild')")
+        print(f"已重建GSE全文索引（{tokenizer}分词器，列: {', '.join(columns)}）")
+    conn.commit()
+    return tokenizer
+
+class GSEFullTextSearch:
+    """
+    基于gse_fts的排序检索
+
+    Args:
+        acquire: 获取只读连接的函数
+        release: 归还连接的函数
+        limit: 默认返回的结果数
+    """
+
+    def __init__(
+        self,
+        acquire: Callable[[], sqlite3.Connection],
+        release: Callable[[sqlite3.Connection], None],
+        limit: int = 10
+    ):
+        self.acquire = acquire
+        self.release = release
+        self.limit = limit
+        self.stats = {"searches": 0, "hits": 0, "no_terms": 0, "like_fallbacks": 0}
+
+    def build_match(self, question: str, tokenizer: str) -> Optional[str]:
+        """
+        把问题转换为FTS5 MATCH表达式，各检索词之间为OR关系，匹配的词越多bm25得分越高
+
+        Returns:
+            MATCH表达式，没有可用的检索词时返回None
+        """
+        min_length = 3 if tokenizer == "trigram" else 2
+        terms = extract_search_terms(question, min_length=min_length)
+        if not terms:
+            return None
+        # trigram按子串匹配；unicode61按词匹配，使用前缀查询兼容词干
+        suffix = "" if tokenizer == "trigram" else "*"
+        return " OR ".join('"' + term.replace('"', '""') + '"' + suffix for term in terms)
+
+    def search(self, question: str, limit: Optional[int] = None) -> Optional[Tuple[str, List[str], List[Tuple[Any, ...]]]]:
+        """
+        检索与问题相关的GSE记录
+
+        Args:
+            question: 用户问题
+            limit: 返回的结果数
+
+        Returns:
+            (检索条件, 列名, 按相关性排序的行)；索引不存在或没有检索词时返回None。
+            同时有MATCH和LIKE条件时，两者都命中的行排在前面
+        """
+        limit = limit or self.limit
+        conn = self.acquire()
+        try:
+            info = _fts_info(conn)
+            if info is None:
+                return None
+            tokenizer, fts_columns = info
+            match = self.build_match(question, tokenizer)
+            like_terms = extract_like_terms(question) if tokenizer == "trigram" else []
+            self.stats["searches"] += 1
+            if match is None and not like_terms:
+                self.stats["no_terms"] += 1
+                return None
+
+            gse_columns = {row[1] for row in conn.execute("PRAGMA table_info(gse)")}
+            columns = [column for column in RESULT_COLUMNS if column in gse_columns]
+            select = ", ".join("gse." + column for column in columns)
+            conditions = []
+            fts_rows: List[Tuple[Any, ...]] = []
+            like_rows: List[Tuple[Any, ...]] = []
+            if match is not None:
+                weights = ", ".join(str(FTS_WEIGHTS.get(column, 1.0)) for column in fts_columns)
+                sql = (
+                    f"SELECT {select} FROM gse_fts JOIN gse ON gse.id = gse_fts.rowid "
+                    f"WHERE gse_fts MATCH ? ORDER BY bm25(gse_fts, {weights}) LIMIT ?"
+                )
+                fts_rows = conn.execute(sql, (match, limit)).fetchall()
+                conditions.append(f"gse_fts MATCH {match}")
+            if like_terms:
+                # 两字中文词trigram无法匹配，在标题和摘要中逐行做LIKE匹配，按命中列的权重排序
+                self.stats["like_fallbacks"] += 1
+                score = " + ".join(
+                    f"(gse.{column} LIKE ?) * {FTS_WEIGHTS.get(column, 1.0)}"
+                    for _ in like_terms for column in fts_columns
+                )
+                params = [f"%{term}%" for term in like_terms for _ in fts_columns]
+                sql = f"SELECT * FROM (SELECT {select}, {score} AS score FROM gse) WHERE score > 0 ORDER BY score DESC LIMIT ?"
+                like_rows = [row[:-1] for row in conn.execute(sql, (*params, limit)).fetchall()]
+                conditions.append(" OR ".join(f"LIKE '%{term}%'" for term in like_terms))
+        finally:
+            self.release(conn)
+
+        rows = _merge_rows(fts_rows, like_rows, limit)
+        if rows:
+            self.stats["hits"] += 1
+        return " OR ".join(conditions), columns, rows
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取检索统计信息"""
+        return dict(self.stats)
+
+def _merge_rows(fts_rows: List[Tuple[Any, ...]], like_rows: List[Tuple[Any, ...]], limit: int) -> List[Tuple[Any, ...]]:
+    """合并全文检索和LIKE的结果：两者都命中的行在前，其余按全文检索、LIKE的顺序，去重后取前limit行"""
+    if not like_rows:
+        return fts_rows[:limit]
+    like_set = set(like_rows)
+    both = [row for row in fts_rows if row in like_set]
+    return list(dict.fromkeys(both + fts_rows + like_rows))[:limit]
+
+if __name__ == "__main__":
+    from app.config import settings
+    parser = argparse.ArgumentParser(description="创建或重建GSE全文索引（gse_fts）")
+    parser.add_argument("--db", default=settings.database_url.split("///")[-1], help="数据库文件路径，默认为DATABASE_URL对应的文件")
+    args = parser.parse_args()
+    conn = sqlite3.connect(args.db)
+    try:
+        tokenizer = ensure_fts_index(conn, rebuild=True)
+    finally:
+        conn.close()
+    if tokenizer is None:
+        print(f"数据库中没有gse表: {args.db}")
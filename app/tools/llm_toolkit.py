@@ -1,152 +1,282 @@
 from langchain_openai import AzureChatOpenAI, ChatOpenAI
 from app.config import settings
-from typing import Any, Optional
-import traceback
+from typing import Any, Dict, Optional, Tuple
+import httpx
+import threading
+import time
 
-def get_llm(model_provider=None, model_name=None) -> Any:
+# 长连接LLM客户端注册表
+# 每个(模型提供商, 模型名称, temperature)只创建一个客户端，所有客户端共享同一个HTTP连接池，
+# 避免每次请求重新建立TCP/TLS连接
+_llm_registry: Dict[Tuple[str, str, float], Any] = {}
+_llm_registry_lock = threading.Lock()
+_registry_stats = {"hits": 0, "misses": 0, "fallbacks": 0}
+
+# 服务不可用时回退得到的客户端只缓存一段时间（秒），过期后重新探测原服务，避免一次临时故障永久改变路由
+FALLBACK_RETRY_INTERVAL = 60.0
+_fallback_expiry: Dict[Tuple[str, str, float], float] = {}
+
+_http_client: Optional[httpx.Client] = None
+_http_async_client: Optional[httpx.AsyncClient] = None
+_http_transport: Optional[httpx.HTTPTransport] = None
+_http_async_transport: Optional[httpx.AsyncHTTPTransport] = None
+_http_client_lock = threading.Lock()
+
+# Ollama和Qwen健康检查的超时（秒），只列出模型，不触发生成
+HEALTH_CHECK_TIMEOUT = 5.0
+
+def _pool_limits() -> httpx.Limits:
+    """根据配置创建连接池限制"""
+    return httpx.Limits(
+        max_connections=settings.llm_max_connections,
+        max_keepalive_connections=settings.llm_max_keepalive_connections,
+        keepalive_expiry=settings.llm_keepalive_expiry
+    )
+
+def get_http_clients() -> Tuple[httpx.Client, httpx.AsyncClient]:
     """
-    获取LLM实例，支持OpenAI、Ollama和Qwen
-    
+    获取共享的同步和异步HTTP客户端
+
+    Returns:
+        (同步客户端, 异步客户端)
+    """
+    global _http_client, _http_async_client, _http_transport, _http_async_transport
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                timeout = httpx.Timeout(settings.llm_request_timeout)
+                # 连接池在传输层中，Ollama客户端无法直接接收httpx客户端，通过共享传输层复用同一个连接池
+                _http_async_transport = httpx.AsyncHTTPTransport(limits=_pool_limits())
+                _http_transport = httpx.HTTPTransport(limits=_pool_limits())
+                _http_async_client = httpx.AsyncClient(transport=_http_async_transport, timeout=timeout)
+                _http_client = httpx.Client(transport=_http_transport, timeout=timeout)
+    return _http_client, _http_async_client
+
+def _ollama_client_kwargs() -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Ollama客户端的httpx参数，使用共享的传输层（连接池）
+
+    Returns:
+        (同步客户端参数, 异步客户端参数)
+    """
+    get_http_clients()
+    timeout = httpx.Timeout(settings.llm_request_timeout)
+    return {"transport": _http_transport, "timeout": timeout}, {"transport": _http_async_transport, "timeout": timeout}
+
+def is_ollama_available(base_url: Optional[str] = None) -> bool:
+    """
+    检查Ollama服务是否可用
+
+    请求/api/tags列出本地模型，不调用模型生成
+    """
+    http_client, _ = get_http_clients()
+    url = (base_url or settings.ollama_base_url or "http://localhost:11434").rstrip("/")
+    try:
+        response = http_client.get(f"{url}/api/tags", timeout=HEALTH_CHECK_TIMEOUT)
+        response.raise_for_status()
+        return True
+    except httpx.HTTPError as e:
+        print(f"Ollama服务不可用: {str(e)}")
+        return False
+
+def is_qwen_available(base_url: Optional[str] = None, api_key: Optional[str] = None) -> bool:
+    """
+    检查Qwen（OpenAI兼容接口）是否可用
+
+    请求{base_url}/models列出模型，同时校验API Key，不调用模型生成
+    """
+    http_client, _ = get_http_clients()
+    url = (base_url or settings.qwen_base_url or "").rstrip("/")
+    if not url:
+        return False
+    try:
+        response = http_client.get(
+            f"{url}/models",
+            headers={"Authorization": f"Bearer {api_key or settings.qwen_api_key}"},
+            timeout=HEALTH_CHECK_TIMEOUT
+        )
+        response.raise_for_status()
+        return True
+    except httpx.HTTPError as e:
+        print(f"Qwen服务不可用: {str(e)}")
+        return False
+
+def _create_azure_llm(model_name: str, temperature: float) -> Any:
+    """使用共享连接池创建Azure OpenAI实例"""
+    http_client, http_async_client = get_http_clients()
+
+    # 输出配置信息
+    print(f"使用Azure OpenAI - Endpoint: {settings.azure_endpoint}")
+    print(f"API Version: {settings.api_version}")
+
+    return AzureChatOpenAI(
+        model_name=model_name,
+        temperature=temperature,
+        openai_api_key=settings.openai_api_key,
+        azure_endpoint=settings.azure_endpoint,
+        openai_api_version=settings.api_version,
+        http_client=http_client,
+        http_async_client=http_async_client
+    )
+
+def _create_llm(model_provider: str, model_name: str, temperature: float) -> Tuple[Any, bool]:
+    """
+    创建新的LLM实例，服务不可用时回退到Azure OpenAI
+
     Args:
-        model_provider: 模型提供商，可选 'openai'、'ollama' 或 'qwen'
+        model_provider: 模型提供商
         model_name: 模型名称
-        
+        temperature: 采样温度
+
     Returns:
-        语言模型实例
+        (语言模型实例, 是否为回退得到的实例)
     """
-    # 如果未指定，使用配置中的默认值
-    model_provider = model_provider or settings.model_provider
-    model_name = model_name or settings.model_name
-    
-    print(f"使用模型提供商: {model_provider}")
-    print(f"使用模型: {model_name}")
-    
     # 根据提供商选择模型
     if model_provider == "openai":
-        # 获取Azure OpenAI配置
-        api_key = settings.openai_api_key
-        api_version = settings.api_version
-        azure_endpoint = settings.azure_endpoint
-        
-        # 输出配置信息
-        print(f"使用Azure OpenAI - Endpoint: {azure_endpoint}")
-        print(f"API Version: {api_version}")
-        
         # 使用Azure ChatOpenAI创建LLM实例
-        llm = AzureChatOpenAI(
-            model_name=model_name, 
-            temperature=0,
-            openai_api_key=api_key,
-            azure_endpoint=azure_endpoint,
-            openai_api_version=api_version
-        )
-    
+        return _create_azure_llm(model_name, temperature), False
+
     elif model_provider == "ollama":
         try:
             # 仅在需要时导入Ollama
-            from langchain_community.llms import Ollama
-            
-            # 使用Ollama本地模型
-            ollama_base_url = settings.ollama_base_url
-            print(f"使用Ollama - Base URL: {ollama_base_url}")
-            
-            # 尝试创建Ollama实例
-            try:
-                llm = Ollama(
-                    model=model_name,
-                    base_url=ollama_base_url,
-                    temperature=0
-                )
-                # 测试Ollama是否可用
-                llm.invoke("测试")
-            except Exception as e:
-                print(f"Ollama服务不可用: {str(e)}")
-                print(f"详细错误: {traceback.format_exc()}")
-                print("回退到OpenAI模型")
-                
-                # 回退到OpenAI
-                api_key = settings.openai_api_key
-                api_version = settings.api_version
-                azure_endpoint = settings.azure_endpoint
-                
-                llm = AzureChatOpenAI(
-                    model_name=settings.model_name, 
-                    temperature=0,
-                    openai_api_key=api_key,
-                    azure_endpoint=azure_endpoint,
-                    openai_api_version=api_version
-                )
+            from langchain_ollama import OllamaLLM
         except ImportError:
             print("Ollama库未安装，回退到OpenAI模型")
-            
-            # 回退到OpenAI
-            api_key = settings.openai_api_key
-            api_version = settings.api_version
-            azure_endpoint = settings.azure_endpoint
-            
-            llm = AzureChatOpenAI(
-                model_name=settings.model_name, 
-                temperature=0,
-                openai_api_key=api_key,
-                azure_endpoint=azure_endpoint,
-                openai_api_version=api_version
-            )
-    
+            return _create_azure_llm(settings.model_name, temperature), True
+
+        # 使用Ollama本地模型
+        ollama_base_url = settings.ollama_base_url
+        print(f"使用Ollama - Base URL: {ollama_base_url}")
+
+        # 通过/api/tags检查服务是否可用，不发送生成请求
+        if not is_ollama_available(ollama_base_url):
+            print("回退到OpenAI模型")
+            return _create_azure_llm(settings.model_name, temperature), True
+
+        sync_kwargs, async_kwargs = _ollama_client_kwargs()
+        return OllamaLLM(
+            model=model_name,
+            base_url=ollama_base_url,
+            temperature=temperature,
+            sync_client_kwargs=sync_kwargs,
+            async_client_kwargs=async_kwargs
+        ), False
+
     elif model_provider == "qwen":
-        try:
-            # 仅在需要时导入Qwen相关库
-            from langchain_openai import ChatOpenAI
-            
-            # 获取Qwen配置
-            qwen_api_key = settings.qwen_api_key
-            qwen_base_url = settings.qwen_base_url
-            
-            print(f"使用Qwen模型")
-            
-            # 尝试创建Qwen实例
-            try:
-                llm = ChatOpenAI(
-                    model=model_name or "qwen-max",  # 默认使用qwen-max
-                    api_key=qwen_api_key,
-                    base_url=qwen_base_url,
-                    temperature=0
-                )
-                # 测试Qwen是否可用
-                llm.invoke("测试")
-            except Exception as e:
-                print(f"Qwen服务不可用: {str(e)}")
-                print(f"详细错误: {traceback.format_exc()}")
-                print("回退到OpenAI模型")
-                
-                # 回退到OpenAI
-                api_key = settings.openai_api_key
-                api_version = settings.api_version
-                azure_endpoint = settings.azure_endpoint
-                
-                llm = AzureChatOpenAI(
-                    model_name=settings.model_name, 
-                    temperature=0,
-                    openai_api_key=api_key,
-                    azure_endpoint=azure_endpoint,
-                    openai_api_version=api_version
-                )
-        except ImportError:
-            print("OpenAI库未安装，回退到OpenAI Azure模型")
-            
-            # 回退到OpenAI
-            api_key = settings.openai_api_key
-            api_version = settings.api_version
-            azure_endpoint = settings.azure_endpoint
-            
-            llm = AzureChatOpenAI(
-                model_name=settings.model_name, 
-                temperature=0,
-                openai_api_key=api_key,
-                azure_endpoint=azure_endpoint,
-                openai_api_version=api_version
-            )
-    
+        # 获取Qwen配置
+        qwen_api_key = settings.qwen_api_key
+        qwen_base_url = settings.qwen_base_url
+        print(f"使用Qwen模型")
+
+        # 通过/models检查服务是否可用，不发送生成请求
+        if not is_qwen_available(qwen_base_url, qwen_api_key):
+            print("回退到OpenAI模型")
+            return _create_azure_llm(settings.model_name, temperature), True
+
+        http_client, http_async_client = get_http_clients()
+        return ChatOpenAI(
+            model=model_name or "qwen-max",  # 默认使用qwen-max
+            api_key=qwen_api_key,
+            base_url=qwen_base_url,
+            temperature=temperature,
+            http_client=http_client,
+            http_async_client=http_async_client
+        ), False
+
     else:
         raise ValueError(f"不支持的模型提供商: {model_provider}")
-    
-    return llm 
\ No newline at end of file
+
+def get_llm(model_provider=None, model_name=None, temperature: float = 0) -> Any:
+    """
+    获取LLM实例，支持OpenAI、Ollama和Qwen
+
+    同一(模型提供商, 模型名称, temperature)在进程内只创建一次，之后复用同一个长连接客户端。
+    服务不可用时回退到Azure OpenAI，回退结果只缓存FALLBACK_RETRY_INTERVAL秒，过期后重新探测原服务；
+    也可通过reset_llm_registry()立即清空。
+
+    Args:
+        model_provider: 模型提供商，可选 'openai'、'ollama' 或 'qwen'
+        model_name: 模型名称
+        temperature: 采样温度
+
+    Returns:
+        语言模型实例
+    """
+    # 如果未指定，使用配置中的默认值
+    model_provider = model_provider or settings.model_provider
+    model_name = model_name or settings.model_name
+    key = (model_provider, model_name, float(temperature))
+
+    llm = _lookup_registry(key)
+    if llm is not None:
+        _registry_stats["hits"] += 1
+        return llm
+
+    with _llm_registry_lock:
+        llm = _lookup_registry(key)
+        if llm is None:
+            print(f"使用模型提供商: {model_provider}")
+            print(f"使用模型: {model_name}")
+            llm, is_fallback = _create_llm(model_provider, model_name, temperature)
+            _llm_registry[key] = llm
+            if is_fallback:
+                _fallback_expiry[key] = time.monotonic() + FALLBACK_RETRY_INTERVAL
+                _registry_stats["fallbacks"] += 1
+            else:
+                _fallback_expiry.pop(key, None)
+            _registry_stats["misses"] += 1
+        else:
+            _registry_stats["hits"] += 1
+
+    return llm
+
+def _lookup_registry(key: Tuple[str, str, float]) -> Optional[Any]:
+    """查找注册表中的客户端，回退得到的客户端过期后视为未命中"""
+    expiry = _fallback_expiry.get(key)
+    if expiry is not None and time.monotonic() >= expiry:
+        return None
+    return _llm_registry.get(key)
+
+def reset_llm_registry() -> None:
+    """清空LLM客户端注册表，下一次调用get_llm时重新创建客户端"""
+    with _llm_registry_lock:
+        _llm_registry.clear()
+        _fallback_expiry.clear()
+
+def _connection_stats(client: Any) -> Dict[str, Any]:
+    """读取httpx客户端底层连接池中的连接数量"""
+    try:
+        connections = client._transport._pool.connections
+        return {
+            "connections": len(connections),
+            "idle": sum(1 for conn in connections if conn.is_idle())
+        }
+    except Exception:
+        return {"connections": None, "idle": None}
+
+def get_pool_stats() -> Dict[str, Any]:
+    """
+    获取LLM客户端注册表和HTTP连接池的统计信息
+
+    Returns:
+        统计信息字典
+    """
+    stats = {
+        "clients": [
+            {"model_provider": provider, "model_name": model, "temperature": temperature}
+            for provider, model, temperature in list(_llm_registry)
+        ],
+        "hits": _registry_stats["hits"],
+        "misses": _registry_stats["misses"],
+        "fallbacks": _registry_stats["fallbacks"],
+        "fallback_clients": sum(1 for expiry in list(_fallback_expiry.values()) if expiry > time.monotonic()),
+        "limits": {
+            "max_connections": settings.llm_max_connections,
+            "max_keepalive_connections": settings.llm_max_keepalive_connections,
+            "keepalive_expiry": settings.llm_keepalive_expiry
+        }
+    }
+    if _http_client is not None:
+        stats["sync_pool"] = _connection_stats(_http_client)
+        stats["async_pool"] = _connection_stats(_http_async_client)
+    return stats
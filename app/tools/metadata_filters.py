@@ -0,0 +1,171 @@
+"""
+基于元数据的检索过滤
+
+导入时为文本块补充accession、organism元数据；检索时从查询中提取数据集编号、物种和主题，
+作为预过滤条件下推到向量库和BM25索引，只在匹配的文本块中检索。
+很多文本块没有organism元数据，物种条件由rag_toolkit.retrieve作为加权条件使用，不单独作为硬过滤。
+
+NumPy向量索引和BM25索引各自保存一份元数据二级索引（字段 -> 取值 -> 行号数组），
+Chroma使用集合自带的元数据索引（where条件）。
+"""
+from typing import Any, Dict, Iterable, List, Optional, Union
+import json
+import os
+import re
+import numpy as np
+
+# 可用于过滤的元数据字段
+FILTER_FIELDS = ("accession", "organism", "topic")
+
+METADATA_INDEX_FILE = "metadata_index.json"
+
+# 中文紧跟编号时\b不成立（如"GSE10000研究"），只要求前面不是字母或数字
+ACCESSION_PATTERN = re.compile(r"(?<![A-Za-z0-9])GSE\d+", re.IGNORECASE)
+
+# 物种别名 -> GEO中的物种名；单字"人"容易误匹配（如"人们"），不作为别名
+ORGANISM_ALIASES = {
+    "homo sapiens": "Homo sapiens",
+    "human": "Homo sapiens",
+    "人类": "Homo sapiens",
+    "人源": "Homo sapiens",
+    "人脑": "Homo sapiens",
+    "人体": "Homo sapiens",
+    "mus musculus": "Mus musculus",
+    "mouse": "Mus musculus",
+    "mice": "Mus musculus",
+    "小鼠": "Mus musculus",
+    "rattus norvegicus": "Rattus norvegicus",
+    "大鼠": "Rattus norvegicus",
+    "danio rerio": "Danio rerio",
+    "zebrafish": "Danio rerio",
+    "斑马鱼": "Danio rerio",
+    "drosophila melanogaster": "Drosophila melanogaster",
+    "果蝇": "Drosophila melanogaster",
+    "caenorhabditis elegans": "Caenorhabditis elegans",
+    "线虫": "Caenorhabditis elegans",
+    "arabidopsis thaliana": "Arabidopsis thaliana",
+    "拟南芥": "Arabidopsis thaliana",
+    "saccharomyces cerevisiae": "Saccharomyces cerevisiae",
+    "酵母": "Saccharomyces cerevisiae",
+}
+
+_ORGANISM_PATTERN = re.compile(
+    "|".join(
+        rf"(?<![a-z]){re.escape(alias)}(?![a-z])" if alias.isascii() else re.escape(alias)
+        for alias in sorted(ORGANISM_ALIASES, key=len, reverse=True)
+    ),
+    re.IGNORECASE
+)
+
+Filters = Dict[str, Union[str, List[str]]]
+
+def find_accessions(text: str) -> List[str]:
+    """按出现顺序返回文本中不重复的GSE编号（大写）"""
+    return list(dict.fromkeys(match.upper() for match in ACCESSION_PATTERN.findall(text)))
+
+def find_organisms(text: str) -> List[str]:
+    """按出现顺序返回文本中提到的物种（GEO物种名）"""
+    return list(dict.fromkeys(ORGANISM_ALIASES[match.lower()] for match in _ORGANISM_PATTERN.findall(text)))
+
+def enrich_metadata(metadata: Dict[str, Any], text: str) -> Dict[str, Any]:
+    """
+    为文本块补充可过滤的元数据，已有的字段保持不变
+
+    accession依次取自来源和内容，内容中只提到一个数据集时才补充；organism同理
+    """
+    if not metadata.get("accession"):
+        accessions = find_accessions(str(metadata.get("source", ""))) or find_accessions(text)
+        if len(accessions) == 1:
+            metadata["accession"] = accessions[0]
+    else:
+        metadata["accession"] = str(metadata["accession"]).upper()
+    if not metadata.get("organism"):
+        organisms = find_organisms(text)
+        if len(organisms) == 1:
+            metadata["organism"] = organisms[0]
+    return metadata
+
+def extract_filters(query: str, topics: Iterable[str] = ()) -> Filters:
+    """
+    从查询中提取过滤条件
+
+    Args:
+        query: 查询文本
+        topics: 已知的主题取值，查询中出现某个主题时按主题过滤（查询中有数据集编号时不再按主题过滤）
+
+    Returns:
+        {字段: 取值或取值列表}，没有可用的条件时为空字典
+    """
+    filters: Filters = {}
+    accessions = find_accessions(query)
+    if accessions:
+        filters["accession"] = accessions[0] if len(accessions) == 1 else accessions
+    organisms = find_organisms(query)
+    if len(organisms) == 1:
+        filters["organism"] = organisms[0]
+    if not accessions:
+        lowered = query.lower()
+        matched = [topic for topic in topics if len(topic) >= 2 and topic.lower() in lowered]
+        if matched:
+            # 多个主题重叠时（如"RNA-seq"和"单细胞RNA-seq"）取最长的
+            filters["topic"] = max(matched, key=len)
+    return filters
+
+def to_chroma_where(filters: Filters) -> Dict[str, Any]:
+    """转换为Chroma的where条件"""
+    clauses = [
+        {field: {"$in": value}} if isinstance(value, list) else {field: value}
+        for field, value in filters.items()
+    ]
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+class MetadataIndex:
+    """
+    元数据二级索引：字段 -> 取值 -> 行号
+
+    构建时逐行add，save写入索引目录；load后用rows按条件取行号
+    """
+
+    def __init__(self, values: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.values: Dict[str, Dict[str, Any]] = values or {field: {} for field in FILTER_FIELDS}
+
+    def add(self, row: int, metadata: Dict[str, Any]) -> None:
+        for field in FILTER_FIELDS:
+            value = metadata.get(field)
+            if value is not None and value != "":
+                self.values[field].setdefault(str(value), []).append(row)
+
+    def save(self, directory: str) -> None:
+        with open(os.path.join(directory, METADATA_INDEX_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.values, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["MetadataIndex"]:
+        """读取索引目录中的元数据索引，旧版本索引没有时返回None"""
+        path = os.path.join(directory, METADATA_INDEX_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            values = json.load(f)
+        return cls({
+            field: {value: np.asarray(rows, dtype=np.int64) for value, rows in values.get(field, {}).items()}
+            for field in FILTER_FIELDS
+        })
+
+    def field_values(self, field: str) -> List[str]:
+        return list(self.values.get(field, {}))
+
+    def rows(self, filters: Filters) -> np.ndarray:
+        """满足全部条件的行号（同一字段的多个取值取并集，不同字段取交集），按行号排序"""
+        result: Optional[np.ndarray] = None
+        for field, value in filters.items():
+            index = self.values.get(field, {})
+            wanted = value if isinstance(value, list) else [value]
+            if field == "organism":
+                # 物种名大小写可能不一致
+                lowered = {item.lower() for item in wanted}
+                wanted = [key for key in index if key.lower() in lowered]
+            arrays = [np.asarray(index[item]) for item in wanted if item in index]
+            rows = np.unique(np.concatenate(arrays)) if arrays else np.empty(0, dtype=np.int64)
+            result = rows if result is None else np.intersect1d(result, rows, assume_unique=True)
+        return result if result is not None else np.empty(0, dtype=np.int64)
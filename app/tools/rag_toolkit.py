@@ -1,43 +1,14 @@
-from langchain_community.vectorstores import Chroma
-from langchain_core.documents import Document
 from langchain_core.prompts import PromptTemplate
 from app.config import settings
 from app.tools.llm_toolkit import get_llm
-import os
+from app.tools.vector_store import get_vectordb, similarity_search
+from app.tools.bm25_index import bm25_search, document_key, get_bm25_index, reciprocal_rank_fusion
+from app.tools.metadata_filters import extract_filters
+from app.tools.context_packer import pack_context
+import asyncio
+import threading
 import traceback
 
-# 创建内存向量存储作为后备
-class MemoryVectorStore:
-    def similarity_search(self, query, k=4):
-        """
-        内存向量存储的相似性搜索
-        
-        Args:
-            query: 查询字符串
-            k: 返回的文档数量
-            
-        Returns:
-            文档列表
-        """
-        return [
-            Document(page_content="这是一个内存向量存储的示例文档。由于无法访问真实的向量数据库，我们返回这个占位符。"),
-            Document(page_content="生物信息数据分析通常涉及基因组、转录组和蛋白质组等多种组学数据。"),
-            Document(page_content="GSE数据库是NCBI的基因表达综合数据库，收集了大量基因表达实验数据。"),
-            Document(page_content="生物信息学结合了生物学、计算机科学和统计学方法，用于分析大规模生物数据。"),
-            Document(page_content="GSE10000是一个关于小鼠肝脏表达的数据集，包含了多个样本的基因表达数据。"),
-            Document(page_content="GSE20000是一个人类大脑单细胞测序数据集，用于研究脑细胞的异质性。")
-        ]
-
-# 创建空的嵌入函数作为后备
-class DummyEmbeddings:
-    def embed_documents(self, texts):
-        """返回固定维度的零向量"""
-        return [[0.0] * 384 for _ in texts]
-        
-    def embed_query(self, text):
-        """返回固定维度的零向量"""
-        return [0.0] * 384
-
 # RAG提示模板
 RAG_TEMPLATE = """基于以下上下文信息，回答问题。如果上下文中没有相关信息，请说明无法回答。
 
@@ -48,72 +19,89 @@ RAG_TEMPLATE = """基于以下上下文信息，回答问题。如果上下文
 
 回答:"""
 
-# 直接使用内存向量存储，跳过Ollama嵌入
-print("使用内存向量存储进行RAG检索")
-vectordb = MemoryVectorStore()
+_retrieval_stats = {"searches": 0, "filtered": 0, "fallbacks": 0, "organism_boosted": 0}
+_retrieval_stats_lock = threading.Lock()
 
-# 以下代码暂时注释掉，因为没有Ollama服务
-"""
-try:
-    # 设置向量数据库路径
-    vector_db_path = settings.vector_db_path
-    if vector_db_path.startswith("./") or vector_db_path.startswith("../"):
-        vector_db_path = os.path.normpath(os.path.join(os.getcwd(), vector_db_path))
-    
-    # 创建数据目录
-    try:
-        os.makedirs(vector_db_path, exist_ok=True)
-        print(f"向量数据库路径: {vector_db_path}")
-    except Exception as e:
-        print(f"无法创建向量数据库目录: {str(e)}")
-        vector_db_path = os.path.join(os.getcwd(), "temp_vector_db")
-        os.makedirs(vector_db_path, exist_ok=True)
-        print(f"使用临时向量数据库路径: {vector_db_path}")
-        
-    # 创建嵌入模型
-    try:
-        # 尝试使用Ollama嵌入
-        from langchain_ollama import OllamaEmbeddings
-        embeddings = OllamaEmbeddings(model="bge-m3")
-        print("成功初始化Ollama嵌入模型")
-    except Exception as e:
-        print(f"初始化Ollama嵌入模型失败: {str(e)}")
-        print("使用虚拟嵌入模型")
-        embeddings = DummyEmbeddings()
-        
-    # 创建或加载向量数据库
-    try:
-        vectordb = Chroma(
-            collection_name="bio-rag",
-            embedding_function=embeddings,
-            persist_directory=vector_db_path
-        )
-        print(f"成功加载向量数据库: {vector_db_path}")
-        
-        # 检查是否为空，如果为空则添加一些示例文档
-        if vectordb._collection.count() == 0:
-            print("向量数据库为空，添加示例文档")
-            sample_texts = [
-                "生物信息学是一个将生物学、计算机科学和统计学结合的交叉学科领域。",
-                "基因表达数据分析通常包括质量控制、标准化和差异表达分析等步骤。",
-                "单细胞RNA测序(scRNA-seq)技术能够揭示细胞间的异质性。",
-                "GSE数据库是NCBI的基因表达综合数据库，收集了大量基因表达实验数据。",
-                "GSE10000是一个关于小鼠肝脏表达的数据集，包含了多个样本的基因表达数据。",
-                "GSE20000是一个人类大脑单细胞测序数据集，用于研究脑细胞的异质性。"
-            ]
-            vectordb.add_texts(sample_texts)
-            print("添加了6个示例文档到向量数据库")
-    except Exception as e:
-        print(f"加载向量数据库失败: {str(e)}")
-        print(f"详细错误: {traceback.format_exc()}")
-        print("使用内存向量存储")
-        vectordb = MemoryVectorStore()
-except Exception as e:
-    print(f"向量数据库初始化失败: {str(e)}")
-    print(f"详细错误: {traceback.format_exc()}")
-    print("使用内存向量存储")
-    vectordb = MemoryVectorStore()
-"""
+def _known_topics():
+    """已导入文本块的主题取值，来自BM25索引或NumPy向量索引的元数据索引"""
+    index = get_bm25_index()
+    metadata_index = getattr(index, "metadata_index", None)
+    if metadata_index is None and settings.vector_backend == "numpy":
+        metadata_index = getattr(get_vectordb(), "metadata_index", None)
+    return metadata_index.field_values("topic") if metadata_index is not None else []
+
+def _hybrid_search(query, k, filters):
+    """向量检索和BM25检索各取k个结果，按倒数排名融合；BM25没有结果时只使用向量检索结果"""
+    # 向量库在第一次检索时加载，不可用时抛出VectorStoreUnavailable
+    vector_docs = similarity_search(query, k, filters)
+    lexical_docs = bm25_search(query, k, filters)
+    if not lexical_docs:
+        return vector_docs
+    return reciprocal_rank_fusion([vector_docs, lexical_docs], k)
+
+def _top_up(docs, extra, k):
+    """过滤后的结果不足k个时，用未过滤的结果补足（去重，过滤后的结果在前）"""
+    seen = {document_key(doc) for doc in docs}
+    for doc in extra:
+        if len(docs) >= k:
+            break
+        if document_key(doc) not in seen:
+            seen.add(document_key(doc))
+            docs.append(doc)
+    return docs
+
+def _boost_organism(docs, organism, k):
+    """在候选中把物种元数据匹配的文本块按倒数排名融合提前，没有物种元数据的文本块保留在候选中"""
+    matching = [doc for doc in docs if str(doc.metadata.get("organism", "")).lower() == organism.lower()]
+    if not matching:
+        return docs[:k]
+    with _retrieval_stats_lock:
+        _retrieval_stats["organism_boosted"] += 1
+    return reciprocal_rank_fusion([matching, docs], k)
+
+def retrieve(query):
+    """
+    检索与查询相关的文本块
+
+    查询中提到数据集编号或已知主题时，先只在匹配的文本块中检索，结果不足rag_candidate_k个时再做一次不过滤的检索补足；
+    没有这类条件时只做一次不过滤的检索。
+    物种只作为加权条件，在已取得的候选中完成，不单独检索：方法、背景类文本块通常没有organism元数据，
+    硬过滤会把它们全部排除；查询中有数据集编号时不再按物种加权。
+    向量检索和BM25检索各取rag_candidate_k个结果（按物种加权时取两倍作为候选），按倒数排名融合
+    """
+    k = settings.rag_candidate_k
+    filters = extract_filters(query, _known_topics()) if settings.rag_metadata_filters else {}
+    organism = filters.pop("organism", None)
+    if "accession" in filters:
+        # 数据集编号已经确定了文本块，物种元数据可能缺失，不再作为条件
+        organism = None
+    with _retrieval_stats_lock:
+        _retrieval_stats["searches"] += 1
+
+    if filters:
+        docs = _hybrid_search(query, k, filters)
+        with _retrieval_stats_lock:
+            _retrieval_stats["filtered"] += 1
+        if len(docs) < k:
+            print(f"按元数据条件 {filters} 只检索到 {len(docs)} 个文本块，用全部文本块的结果补足")
+            with _retrieval_stats_lock:
+                _retrieval_stats["fallbacks"] += 1
+            docs = _top_up(list(docs), _hybrid_search(query, k, None), k)
+    else:
+        # 多取一些候选，物种加权后仍有足够的文本块
+        docs = _hybrid_search(query, k * 2 if organism else k, None)
+
+    if organism:
+        docs = _boost_organism(docs, organism, k)
+    return docs[:k]
+
+def get_retrieval_stats():
+    """
+    获取检索统计信息：filtered为按数据集编号或主题过滤的检索数，fallbacks为过滤后不足rag_candidate_k个、
+    用全部文本块补足的次数，organism_boosted为候选中有物种匹配的文本块并按物种加权的检索数
+    """
+    with _retrieval_stats_lock:
+        return dict(_retrieval_stats)
 
 def get_rag_chain(llm=None):
     """
@@ -137,24 +125,30 @@ def get_rag_chain(llm=None):
                     class DummyResponse:
                         content = "无法获取语言模型实例，返回占位符回答。"
                     return DummyResponse()
+                
+                async def ainvoke(self, prompt):
+                    return self.invoke(prompt)
             llm = DummyLLM()
     
     # 创建提示模板
     prompt = PromptTemplate.from_template(RAG_TEMPLATE)
+    # 上下文的token预算和分词方式按模型选择
+    model_name = getattr(llm, "model_name", None) or getattr(llm, "model", None) or settings.model_name
+    
+    def build_prompt(query, docs):
+        """经MMR去重并按token预算选择文本块后填充提示模板"""
+        context = "\n\n".join(pack_context(query, docs, model_name))
+        return prompt.format(context=context, query=query)
     
     # 返回一个简单的包装对象，提供run方法
     class RAGChain:
         def run(self, query):
             try:
-                # 执行向量检索
-                docs = vectordb.similarity_search(query, k=4)
-                context = "\n\n".join([doc.page_content for doc in docs])
-                
-                if isinstance(vectordb, MemoryVectorStore):
-                    context += "\n\n注意：这是一个内存向量存储的占位符，包含了一些基本的生物信息学信息。"
+                # 执行向量检索和BM25检索并融合结果
+                docs = retrieve(query)
                 
                 # 填充提示模板
-                formatted_prompt = prompt.format(context=context, query=query)
+                formatted_prompt = build_prompt(query, docs)
                 
                 # 使用LLM生成回答
                 try:
@@ -168,5 +162,23 @@ def get_rag_chain(llm=None):
                 print(f"检索错误: {str(e)}")
                 print(f"详细错误: {traceback.format_exc()}")
                 return f"检索错误: {str(e)}"
+        
+        async def arun(self, query):
+            """run的异步版本：检索在线程池中执行，回答通过llm.ainvoke生成"""
+            try:
+                docs = await asyncio.to_thread(retrieve, query)
+                formatted_prompt = build_prompt(query, docs)
+                
+                try:
+                    response = await llm.ainvoke(formatted_prompt)
+                    return getattr(response, "content", response)
+                except Exception as e:
+                    print(f"生成回答时出错: {str(e)}")
+                    print(f"详细错误: {traceback.format_exc()}")
+                    return f"生成回答时出错: {str(e)}"
+            except Exception as e:
+                print(f"检索错误: {str(e)}")
+                print(f"详细错误: {traceback.format_exc()}")
+                return f"检索错误: {str(e)}"
     
     return RAGChain() 
\ No newline at end of file
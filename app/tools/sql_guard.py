@@ -0,0 +1,182 @@
+"""
+LLM生成SQL的受控执行
+
+在执行之前和执行过程中加以限制，避免一条生成的查询拖垮工作进程或返回过大的结果：
+- 只允许单条SELECT/WITH语句，并使用只读连接执行
+- 通过EXPLAIN QUERY PLAN检查全表扫描，拒绝没有可用索引、需要全表扫描大表的查询
+- 没有LIMIT时自动追加LIMIT
+- 通过SQLite进度回调限制执行时间
+- 限制返回的行数和字节数，截断时在结果中注明
+"""
+from typing import Any, Callable, Dict, List, Optional
+import re
+import sqlite3
+import threading
+import time
+
+# SQL中的字符串字面量和注释，检查语句结构前先去掉
+_LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/", re.DOTALL)
+
+# 语句末尾的LIMIT子句
+_TRAILING_LIMIT_PATTERN = re.compile(r"\blimit\s+(?:\d+|:\w+|\?)(?:\s*(?:offset|,)\s*(?:\d+|:\w+|\?))?\s*$", re.IGNORECASE)
+
+# EXPLAIN QUERY PLAN中的全表扫描，兼容"SCAN gse"和旧版本的"SCAN TABLE gse"
+_FULL_SCAN_PATTERN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$")
+
+# 进度回调的调用间隔（虚拟机指令数）
+_PROGRESS_STEPS = 1000
+
+class SQLGuardError(Exception):
+    """生成的SQL违反执行限制"""
+
+class FullScanError(SQLGuardError):
+    """
+    查询需要全表扫描大表
+
+    Args:
+        message: 错误信息
+        tables: 需要全表扫描的大表
+    """
+
+    def __init__(self, message: str, tables: List[str]):
+        super().__init__(message)
+        self.tables = tables
+
+class GuardedExecutor:
+    """
+    受控的只读SQL执行器
+
+    Args:
+        connect: 返回只读sqlite3连接的函数
+        release: 归还连接的函数，默认直接关闭
+        max_rows: 最多返回的行数
+        max_bytes: 结果文本的最大字节数
+        timeout: 单条查询的执行时间上限（秒）
+        large_table_rows: 行数超过该值的表视为大表
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], sqlite3.Connection],
+        release: Optional[Callable[[sqlite3.Connection], None]] = None,
+        max_rows: int = 200,
+        max_bytes: int = 65536,
+        timeout: float = 5.0,
+        large_table_rows: int = 100000
+    ):
+        self.connect = connect
+        self.release = release or (lambda conn: conn.close())
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.large_table_rows = large_table_rows
+        self._table_rows: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def check_read_only(self, sql_query: str) -> str:
+        """
+        确认SQL是单条只读查询
+
+        Returns:
+            去掉结尾分号的SQL
+        """
+        sql_query = sql_query.strip().rstrip(";").strip()
+        stripped = _LITERAL_PATTERN.sub("''", sql_query)
+        if ";" in stripped:
+            raise SQLGuardError("只允许执行单条SQL语句")
+        keyword = stripped.lstrip("( \n\t").split(None, 1)[0].upper() if stripped.strip() else ""
+        if keyword not in ("SELECT", "WITH"):
+            raise SQLGuardError(f"只允许执行只读查询（SELECT/WITH），拒绝: {keyword or '空语句'}")
+        return sql_query
+
+    def _estimated_rows(self, conn: sqlite3.Connection, table: str) -> int:
+        """估算表的行数，MAX(rowid)只需访问B树的最右端，结果缓存60秒"""
+        with self._lock:
+            cached = self._table_rows.get(table)
+        if cached and time.monotonic() - cached[1] < 60:
+            return cached[0]
+        try:
+            rows = conn.execute(f'SELECT MAX(rowid) FROM "{table}"').fetchone()[0] or 0
+        except sqlite3.Error:
+            # 视图或WITHOUT ROWID表，无法估算
+            rows = 0
+        with self._lock:
+            self._table_rows[table] = (rows, time.monotonic())
+        return rows
+
+    def check_plan(self, conn: sqlite3.Connection, sql_query: str, parameters: Optional[Dict[str, Any]] = None) -> None:
+        """
+        检查查询计划，拒绝全表扫描大表的查询
+
+        LIMIT只能限制返回的行数，带过滤条件（如LIKE）的全表扫描仍要读完整张表，因此不依赖LIMIT放行；
+        使用索引的扫描（SCAN ... USING INDEX）不受限制
+
+        Raises:
+            FullScanError: 查询计划中有对大表的全表扫描
+        """
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {sql_query}", parameters or {}).fetchall()
+        large_scans = []
+        for row in plan:
+            match = _FULL_SCAN_PATTERN.match(row[-1])
+            if match and self._estimated_rows(conn, match.group(1)) > self.large_table_rows:
+                large_scans.append(match.group(1))
+        if len(large_scans) > 1:
+            raise FullScanError(f"查询需要同时全表扫描多张大表（{', '.join(large_scans)}），请添加连接或过滤条件", large_scans)
+        if large_scans:
+            raise FullScanError(f"查询需要全表扫描大表 {large_scans[0]}，没有可用的索引，请按索引列过滤", large_scans)
+
+    def apply_limit(self, sql_query: str) -> str:
+        """语句末尾没有LIMIT时追加LIMIT，多取一行用于判断是否截断"""
+        stripped = _LITERAL_PATTERN.sub("''", sql_query)
+        if _TRAILING_LIMIT_PATTERN.search(stripped):
+            return sql_query
+        return f"{sql_query}\nLIMIT {self.max_rows + 1}"
+
+    def execute(self, sql_query: str, parameters: Optional[Dict[str, Any]] = None) -> str:
+        """
+        受控地执行SQL查询
+
+        Args:
+            sql_query: SQL查询
+            parameters: 命名参数
+
+        Returns:
+            结果文本，格式与SQLDatabase.run相同；被截断时附加说明
+        """
+        sql_query = self.apply_limit(self.check_read_only(sql_query))
+        conn = self.connect()
+        deadline = time.monotonic() + self.timeout
+        try:
+            self.check_plan(conn, sql_query, parameters)
+            conn.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, _PROGRESS_STEPS)
+            try:
+                cursor = conn.execute(sql_query, parameters or {})
+                rows, size, truncated = [], 2, None
+                while True:
+                    row = cursor.fetchone()
+                    if row is None:
+                        break
+                    if len(rows) >= self.max_rows:
+                        truncated = f"仅返回前{self.max_rows}行"
+                        break
+                    row_size = len(repr(row).encode("utf-8")) + 2
+                    if size + row_size > self.max_bytes:
+                        truncated = f"结果超过{self.max_bytes}字节，仅返回前{len(rows)}行"
+                        break
+                    rows.append(tuple(row))
+                    size += row_size
+                cursor.close()
+            except sqlite3.OperationalError as e:
+                if "interrupted" in str(e):
+                    raise SQLGuardError(f"查询执行超过{self.timeout}秒，已中止")
+                raise
+            finally:
+                conn.set_progress_handler(None, _PROGRESS_STEPS)
+        finally:
+            self.release(conn)
+
+        result = str(rows) if rows else ""
+        if truncated:
+            print(f"SQL结果已截断: {truncated}")
+            result += f"\n（结果已截断：{truncated}）"
+        return result
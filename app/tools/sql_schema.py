@@ -0,0 +1,152 @@
+"""
+SQL提示词使用的表结构快照
+
+表结构描述（CREATE语句和示例行）只在PRAGMA schema_version变化时重新生成，
+并按问题中的关键词只挑选相关的表放入提示词；关键词由表名和列名推导，问题没有命中任何关键词时使用全部表
+"""
+from typing import Any, Dict, List, Optional, Set
+import re
+import sqlite3
+import threading
+
+# 表名、列名中的英文词对应的中文说法；每张表的关键词由实际的表名和列名按词拆分后推导，
+# 表结构变化（新增表或列）后自动生效
+IDENTIFIER_TERMS = {
+    "gse": ("系列", "数据集", "研究", "实验"),
+    "gsm": ("样本", "样品"),
+    "gpl": ("平台", "芯片"),
+    "series": ("系列", "数据集"),
+    "sample": ("样本", "样品"),
+    "platform": ("平台", "芯片", "测序仪", "仪器"),
+    "accession": ("编号", "登录号"),
+    "title": ("标题", "名称", "题目"),
+    "organism": ("物种", "生物"),
+    "technology": ("技术", "测序", "芯片", "仪器", "测序仪"),
+    "manufacturer": ("厂商", "制造商", "厂家", "公司", "品牌"),
+    "description": ("描述", "摘要", "简介", "内容"),
+    "release": ("发布", "公开", "上线"),
+    "updated": ("更新", "修改"),
+    "date": ("日期", "时间", "年份"),
+    "count": ("数量", "个数"),
+    "source": ("来源", "组织"),
+    "characteristics": ("特征", "性别", "年龄", "细胞类型"),
+    "treatment": ("处理", "药物", "对照"),
+}
+
+# 登录号前缀对应的表
+ACCESSION_TABLES = {"GSE": "gse", "GSM": "gsm", "GPL": "gpl"}
+ACCESSION_PATTERN = re.compile(r"(?<![A-Za-z0-9])(GSE|GSM|GPL)\d+", re.IGNORECASE)
+
+def table_keywords(table: str, columns: List[str]) -> Set[str]:
+    """
+    由表名和列名推导表的关键词
+
+    表名和列名本身（至少3个字符，避免id等短列名误匹配）以及按下划线拆出的词对应的中文说法
+    """
+    keywords = set()
+    for identifier in [table] + list(columns):
+        identifier = identifier.lower()
+        if len(identifier) >= 3:
+            keywords.add(identifier)
+        for word in identifier.split("_"):
+            keywords.update(IDENTIFIER_TERMS.get(word, ()))
+    return keywords
+
+def _keyword_in(keyword: str, text: str) -> bool:
+    """英文关键词按整词匹配，中文关键词按子串匹配"""
+    if keyword.isascii():
+        return re.search(rf"(?<![a-z0-9_]){re.escape(keyword)}(?![a-z0-9_])", text) is not None
+    return keyword in text
+
+class SchemaSnapshot:
+    """
+    缓存的表结构快照
+
+    Args:
+        db: LangChain的SQLDatabase实例，用于生成表结构描述
+        db_path: SQLite数据库文件路径，用于读取schema_version
+    """
+
+    def __init__(self, db: Any, db_path: str):
+        self.db = db
+        self.db_path = db_path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._schema_version = None
+        self._table_info: Dict[str, str] = {}
+        self._columns: Dict[str, List[str]] = {}
+        self._references: Dict[str, Set[str]] = {}
+        self._keywords: Dict[str, Set[str]] = {}
+        self.refresh_count = 0
+
+    def _current_schema_version(self) -> Optional[int]:
+        try:
+            if self._conn is None:
+                self._conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+            return self._conn.execute("PRAGMA schema_version").fetchone()[0]
+        except sqlite3.Error:
+            return None
+
+    def _refresh(self) -> None:
+        """重新生成每张表的结构描述，调用方需持有锁"""
+        table_info, columns, references = {}, {}, {}
+        for table in self.db.get_usable_table_names():
+            table_info[table] = self.db.get_table_info([table])
+            if self._conn is not None:
+                columns[table] = [row[1].lower() for row in self._conn.execute(f'PRAGMA table_info("{table}")')]
+                references[table] = {row[2] for row in self._conn.execute(f'PRAGMA foreign_key_list("{table}")')}
+        self._table_info, self._columns, self._references = table_info, columns, references
+        self._keywords = {table: table_keywords(table, columns.get(table, [])) for table in table_info}
+        self.refresh_count += 1
+        print(f"表结构快照已更新: {', '.join(table_info) or '无表'}")
+
+    def _ensure_fresh(self) -> None:
+        with self._lock:
+            version = self._current_schema_version()
+            if version != self._schema_version or not self._table_info:
+                self._refresh()
+                self._schema_version = version
+
+    def select_tables(self, question: str) -> List[str]:
+        """
+        根据问题挑选相关的表
+
+        匹配表名、列名及其中文说法，命中的表再补上问题中登录号前缀对应的表和被引用的表；
+        没有命中任何关键词时（只有登录号也算未命中）返回全部表，避免漏掉问题真正需要的表
+
+        Args:
+            question: 用户问题
+
+        Returns:
+            相关表名列表
+        """
+        self._ensure_fresh()
+        text = question.lower()
+        selected = {
+            table for table in self._table_info
+            if any(_keyword_in(keyword, text) for keyword in self._keywords.get(table, ()))
+        }
+        if not selected:
+            return list(self._table_info)
+
+        for match in ACCESSION_PATTERN.finditer(question):
+            table = ACCESSION_TABLES.get(match.group(1).upper())
+            if table in self._table_info:
+                selected.add(table)
+        for table in list(selected):
+            selected.update(ref for ref in self._references.get(table, ()) if ref in self._table_info)
+        return [table for table in self._table_info if table in selected]
+
+    def table_info(self, question: Optional[str] = None) -> str:
+        """
+        获取用于提示词的表结构描述
+
+        Args:
+            question: 用户问题；未提供时返回全部表
+
+        Returns:
+            表结构描述字符串
+        """
+        self._ensure_fresh()
+        tables = self.select_tables(question) if question else list(self._table_info)
+        return "\n\n".join(self._table_info[table] for table in tables)
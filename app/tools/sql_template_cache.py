@@ -0,0 +1,354 @@
+"""
+参数化的自然语言到SQL模板缓存
+
+只有字面量不同的问题（如"GSE10000有多少样本"和"GSE20000有多少样本"）共享同一条SQL模板：
+从问题中抽取登录号、数字和引号字符串，用占位符替换得到缓存键；
+把LLM生成的SQL中对应的字面量替换为命名参数得到模板。
+命中时直接用新问题中的字面量绑定参数执行，不再调用LLM生成SQL。
+"""
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import atexit
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+# GEO登录号，占位符中保留前缀，保证GSE和GSM的问题不会共享模板
+ACCESSION_PATTERN = re.compile(r"(?<![A-Za-z0-9])(GSE|GSM|GPL|GDS)(\d+)(?![0-9])", re.IGNORECASE)
+
+# 引号内的字符串，支持中英文引号
+QUOTED_PATTERN = re.compile(r"'([^']+)'|\"([^\"]+)\"|“([^”]+)”|‘([^’]+)’|「([^」]+)」")
+
+# 数字，中文字符也属于\w，因此边界只排除ASCII字母数字
+NUMBER_PATTERN = re.compile(r"(?<![A-Za-z0-9_.])\d+(?:\.\d+)?(?![A-Za-z0-9_.])")
+
+# SQL中的字符串字面量
+SQL_STRING_PATTERN = re.compile(r"'(?:[^']|'')*'")
+
+def extract_literals(question: str) -> Tuple[str, List[Tuple[str, Any]]]:
+    """
+    从问题中抽取字面量
+
+    Args:
+        question: 用户问题
+
+    Returns:
+        (去字面量后的问题, [(参数名, 字面量值), ...])
+    """
+    text = unicodedata.normalize("NFKC", question).strip()
+    literals: List[Tuple[str, Any]] = []
+    counters: Dict[str, int] = {}
+
+    def slot(kind: str, value: Any) -> str:
+        # 相同的值复用同一个参数
+        for name, existing in literals:
+            if name.startswith(kind) and existing == value:
+                return f"<{name.upper()}>"
+        index = counters.get(kind, 0)
+        counters[kind] = index + 1
+        name = f"{kind}{index}"
+        literals.append((name, value))
+        return f"<{name.upper()}>"
+
+    def replace_accession(match):
+        prefix = match.group(1).upper()
+        return slot(prefix.lower(), f"{prefix}{match.group(2)}")
+
+    def replace_quoted(match):
+        value = next(group for group in match.groups() if group is not None)
+        return slot("str", value)
+
+    def replace_number(match):
+        raw = match.group(0)
+        value = float(raw) if "." in raw else int(raw)
+        return slot("num", value)
+
+    text = ACCESSION_PATTERN.sub(replace_accession, text)
+    text = QUOTED_PATTERN.sub(replace_quoted, text)
+    text = NUMBER_PATTERN.sub(replace_number, text)
+
+    key = re.sub(r"\s+", " ", text.lower()).rstrip("?!.。！？~ ")
+    return key, literals
+
+def _sql_quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+def build_template(sql_query: str, literals: List[Tuple[str, Any]]) -> Optional[str]:
+    """
+    把SQL中的字面量替换为命名参数
+
+    每个字面量都必须在SQL中以完整的字符串或数字出现，数字只能出现一次，替换后SQL中不能残留这些值，
+    否则说明SQL与字面量的对应关系不明确，不生成模板
+
+    Args:
+        sql_query: LLM生成并执行成功的SQL
+        literals: extract_literals返回的字面量
+
+    Returns:
+        参数化的SQL模板，无法模板化时返回None
+    """
+    if not literals:
+        return None
+
+    string_literals = {name: value for name, value in literals if isinstance(value, str)}
+    number_literals = {name: value for name, value in literals if not isinstance(value, str)}
+    used = set()
+    number_uses: Dict[str, int] = {}
+
+    # 字符串字面量：整体匹配SQL中的'...'
+    quoted_to_name = {_sql_quote(value).lower(): name for name, value in string_literals.items()}
+
+    def replace_string(match):
+        name = quoted_to_name.get(match.group(0).lower())
+        if name is None:
+            return match.group(0)
+        used.add(name)
+        return f":{name}"
+
+    # 数字字面量：只替换字符串之外的数字
+    def replace_numbers(segment: str) -> str:
+        def replace_number(match):
+            raw = match.group(0)
+            value = float(raw) if "." in raw else int(raw)
+            for name, literal in number_literals.items():
+                if literal == value and type(literal) is type(value):
+                    used.add(name)
+                    number_uses[name] = number_uses.get(name, 0) + 1
+                    return f":{name}"
+            return raw
+        return NUMBER_PATTERN.sub(replace_number, segment)
+
+    parts = []
+    position = 0
+    for match in SQL_STRING_PATTERN.finditer(sql_query):
+        parts.append(replace_numbers(sql_query[position:match.start()]))
+        parts.append(replace_string(match))
+        position = match.end()
+    parts.append(replace_numbers(sql_query[position:]))
+    template = "".join(parts)
+
+    if used != {name for name, _ in literals}:
+        return None
+    # 同一个数字出现多次（如问题中的100恰好等于LLM自行添加的LIMIT 100），无法确定对应关系
+    if any(count > 1 for count in number_uses.values()):
+        return None
+    # 字面量仍以其他形式出现（如LIKE '%GSE10000%'），不能安全地替换
+    for value in string_literals.values():
+        if value.lower() in template.lower():
+            return None
+    return template
+
+class SQLTemplateCache:
+    """
+    持久化的SQL模板缓存
+
+    查找只在内存中进行，表结构版本通过共享连接池读取，不在锁内打开数据库文件。
+    修改先记在内存中，距上次保存超过save_interval秒时才写入文件，进程退出时保存剩余的修改；
+    保存时先合并文件中其他工作进程写入的模板，再通过临时文件和os.replace原子地替换
+
+    Args:
+        path: 缓存文件路径（JSON）
+        connect: 获取只读sqlite3连接的函数，用于校验模板和检测表结构变化
+        release: 归还连接的函数，默认直接关闭
+        max_entries: 最大模板数量，超出后淘汰最久未使用的模板
+        save_interval: 两次写入缓存文件的最小间隔（秒）
+    """
+
+    def __init__(
+        self,
+        path: str,
+        connect: Callable[[], sqlite3.Connection],
+        release: Optional[Callable[[sqlite3.Connection], None]] = None,
+        max_entries: int = 2048,
+        save_interval: float = 5.0
+    ):
+        self.path = path
+        self.connect = connect
+        self.release = release or (lambda conn: conn.close())
+        self.max_entries = max_entries
+        self.save_interval = save_interval
+        self._templates: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._removed = set()
+        self._last_save = time.monotonic()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "rejected": 0, "saves": 0}
+        self._templates = OrderedDict(self._read_file())
+        if self._templates:
+            print(f"加载了 {len(self._templates)} 条SQL模板: {self.path}")
+        atexit.register(self.flush)
+
+    def _read_file(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """读取缓存文件，按最近使用时间从旧到新排列"""
+        if not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"加载SQL模板缓存失败: {e}")
+            return []
+        return sorted(data.items(), key=lambda item: item[1].get("last_used", 0))
+
+    def _mark_dirty(self, removed_key: Optional[str] = None) -> None:
+        """记录未保存的修改，调用方需持有锁"""
+        self._dirty = True
+        if removed_key is not None:
+            self._removed.add(removed_key)
+
+    def _maybe_save(self) -> None:
+        """距上次保存超过save_interval秒时保存"""
+        if self._dirty and time.monotonic() - self._last_save >= self.save_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        把未保存的修改写入缓存文件
+
+        先合并文件中其他工作进程写入的模板（本进程删除的除外），
+        再写入本进程独有的临时文件并用os.replace替换，读者不会看到写了一半的文件
+        """
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                self._dirty = False
+                self._last_save = time.monotonic()
+                removed, self._removed = self._removed, set()
+
+            merged = dict(self._read_file())
+            with self._lock:
+                for key, entry in merged.items():
+                    if key not in removed and key not in self._templates:
+                        self._templates[key] = entry
+                entries = sorted(self._templates.items(), key=lambda item: item[1].get("last_used", 0))
+                self._templates = OrderedDict(entries[-self.max_entries:])
+                snapshot = dict(self._templates)
+
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(snapshot, f, ensure_ascii=False, indent=1)
+                os.replace(tmp_path, self.path)
+                self.stats["saves"] += 1
+            except OSError as e:
+                print(f"保存SQL模板缓存失败: {e}")
+                with self._lock:
+                    self._dirty = True
+                    self._removed |= removed
+
+    def _schema_version(self) -> Optional[int]:
+        """通过共享连接读取数据库的表结构版本，读取失败时返回None"""
+        try:
+            conn = self.connect()
+        except sqlite3.Error:
+            return None
+        try:
+            return conn.execute("PRAGMA schema_version").fetchone()[0]
+        except sqlite3.Error:
+            return None
+        finally:
+            self.release(conn)
+
+    def lookup(self, question: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        查找问题对应的SQL模板
+
+        Args:
+            question: 用户问题
+
+        Returns:
+            (SQL模板, 绑定参数)，未命中时返回None
+        """
+        key, literals = extract_literals(question)
+        with self._lock:
+            entry = self._templates.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+
+        if self._schema_version() != entry["schema_version"]:
+            # 表结构已变化，模板可能失效
+            with self._lock:
+                if self._templates.get(key) is entry:
+                    del self._templates[key]
+                    self._mark_dirty(key)
+            self.stats["misses"] += 1
+            self._maybe_save()
+            return None
+
+        with self._lock:
+            entry["last_used"] = time.time()
+            if key in self._templates:
+                self._templates.move_to_end(key)
+            self.stats["hits"] += 1
+        print(f"SQL模板缓存命中: {key}")
+        return entry["sql"], dict(literals)
+
+    def store(self, question: str, sql_query: str) -> bool:
+        """
+        校验并缓存生成的SQL的模板
+
+        Args:
+            question: 用户问题
+            sql_query: 对该问题执行成功的SQL
+
+        Returns:
+            是否缓存成功
+        """
+        key, literals = extract_literals(question)
+        if key in self._templates:
+            return False
+        template = build_template(sql_query, literals)
+        if template is None:
+            self.stats["rejected"] += 1
+            return False
+
+        # 用原始字面量预编译模板，确认参数可以正确绑定
+        try:
+            conn = self.connect()
+            try:
+                conn.execute(f"EXPLAIN {template}", dict(literals))
+                schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+            finally:
+                self.release(conn)
+        except sqlite3.Error as e:
+            print(f"SQL模板校验失败，不缓存: {e}")
+            self.stats["rejected"] += 1
+            return False
+
+        with self._lock:
+            self._templates[key] = {
+                "sql": template,
+                "params": [name for name, _ in literals],
+                "schema_version": schema_version,
+                "last_used": time.time()
+            }
+            self._removed.discard(key)
+            while len(self._templates) > self.max_entries:
+                self._templates.popitem(last=False)
+            self.stats["stores"] += 1
+            self._mark_dirty()
+        self._maybe_save()
+        print(f"缓存SQL模板: {key} -> {template}")
+        return True
+
+    def discard(self, question: str) -> None:
+        """删除问题对应的模板（如执行失败时）"""
+        key, _ = extract_literals(question)
+        with self._lock:
+            if self._templates.pop(key, None) is not None:
+                self._mark_dirty(key)
+        self._maybe_save()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取模板缓存统计信息"""
+        return {**self.stats, "size": len(self._templates), "unsaved": self._dirty}
@@ -1,10 +1,18 @@
 from langchain_community.utilities import SQLDatabase
-from langchain.chains import create_sql_query_chain
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnablePassthrough
 from app.config import settings
 from app.tools.llm_toolkit import get_llm
+from app.tools.sql_template_cache import SQLTemplateCache
+from app.tools.sql_schema import SchemaSnapshot
+from app.tools.sql_guard import FullScanError, GuardedExecutor
+from app.tools.gse_search import GSEFullTextSearch, is_keyword_search, is_searchable
+from app.db.connection import sqlite_pool
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.pool import NullPool
 import pathlib, sqlite3, os
+import asyncio
 import re
 import traceback
 
@@ -37,9 +45,20 @@ else:
         conn.close()
         print(f"成功创建基本数据库: {db_path}")
 
+# GSE标题和摘要的全文索引由schema.sql或GEO导入创建，这里只读检索；索引缺失时回退到LLM生成SQL
+gse_search = GSEFullTextSearch(sqlite_pool.acquire, sqlite_pool.release, limit=settings.fts_search_limit)
+
+# 不放入SQL提示词的内部表：全文索引及其影子表、导入进度表
+def _is_internal_table(table):
+    return table.startswith("gse_fts") or table == "ingest_progress"
+
 # 创建数据库连接
 try:
-    db = SQLDatabase.from_uri(db_url)
+    # 连接由共享连接池创建（只读并设置PRAGMA）；SQLAlchemy侧不再缓存连接，
+    # 内存模式重新加载后SQLDatabase能立即读到新的数据
+    engine = create_engine("sqlite://", creator=sqlite_pool.connect, poolclass=NullPool)
+    internal_tables = [table for table in inspect(engine).get_table_names() if _is_internal_table(table)]
+    db = SQLDatabase(engine, ignore_tables=internal_tables or None)
     print(f"成功连接到数据库: {db_url}")
 except Exception as e:
     print(f"连接数据库失败: {str(e)}")
@@ -48,6 +67,27 @@ except Exception as e:
     db = SQLDatabase.from_uri("sqlite:///:memory:")
     print("使用内存数据库作为后备")
 
+# 表结构快照，只在schema_version变化时重新读取表结构和示例行
+schema_snapshot = SchemaSnapshot(db, str(db_path))
+
+# 受控的SQL执行器：只读、检查查询计划、自动LIMIT、限制执行时间和结果大小
+sql_executor = GuardedExecutor(
+    connect=sqlite_pool.acquire,
+    release=sqlite_pool.release,
+    max_rows=settings.sql_max_rows,
+    max_bytes=settings.sql_max_result_bytes,
+    timeout=settings.sql_timeout,
+    large_table_rows=settings.sql_large_table_rows
+)
+
+# 参数化SQL模板缓存
+sql_template_cache = SQLTemplateCache(
+    settings.sql_template_cache_path,
+    connect=sqlite_pool.acquire,
+    release=sqlite_pool.release,
+    save_interval=settings.sql_template_cache_save_interval
+)
+
 # SQL查询提示模板
 SQL_TEMPLATE = """你是一个SQL专家。根据下面的表结构和问题，生成一个SQL查询来回答问题。
 只返回纯SQL查询，不要包含任何代码块标记、注释或其他解释。
@@ -59,6 +99,42 @@ SQL_TEMPLATE = """你是一个SQL专家。根据下面的表结构和问题，
 
 SQL查询:"""
 
+def get_table_info(question=None):
+    """
+    获取用于提示词的表结构描述
+    
+    Args:
+        question: 用户问题，提供时只返回与问题相关的表
+    
+    Returns:
+        表结构字符串
+    """
+    return schema_snapshot.table_info(question)
+
+def search_gse(question, keyword_only=True):
+    """
+    用全文索引回答关键词式的数据集检索问题（如"找关于肝脏脂肪代谢的数据集"）
+    
+    Args:
+        question: 用户问题
+        keyword_only: 为True时只处理关键词式的问题；为False时用于改写被拒绝的gse全表扫描，只排除统计和编号查询
+        
+    Returns:
+        格式与SQL查询结果相同的检索结果；不适合全文检索、没有检索词或没有命中时返回None
+    """
+    if not (is_keyword_search(question) if keyword_only else is_searchable(question)):
+        return None
+    try:
+        result = gse_search.search(question)
+    except sqlite3.Error as e:
+        print(f"全文检索错误: {str(e)}")
+        return None
+    if result is None or not result[2]:
+        return None
+    condition, columns, rows = result
+    print(f"全文检索命中 {len(rows)} 条: {condition}")
+    return f"查询: 全文检索 {condition}\n列: {', '.join(columns)}\n\n结果: {rows}"
+
 def clean_sql_query(sql_query):
     """
     清理SQL查询，移除代码块标记和其他非SQL内容
@@ -103,14 +179,22 @@ def get_sql_chain(llm=None):
                     class DummyResponse:
                         content = "SELECT * FROM gse LIMIT 5"
                     return DummyResponse()
+                
+                async def ainvoke(self, prompt):
+                    return self.invoke(prompt)
             llm = DummyLLM()
     
     # 创建提示模板
     prompt = PromptTemplate.from_template(SQL_TEMPLATE)
     
-    # 使用最新版本的API创建SQL查询链
+    # 创建SQL查询链，表结构来自缓存的快照并只包含与问题相关的表
     try:
-        sql_generator = create_sql_query_chain(llm, db, prompt=prompt)
+        sql_generator = (
+            RunnablePassthrough.assign(schema=lambda inputs: get_table_info(inputs["question"]))
+            | prompt
+            | llm
+            | StrOutputParser()
+        )
     except Exception as e:
         print(f"创建SQL查询链错误: {e}")
         print(f"详细错误: {traceback.format_exc()}")
@@ -123,11 +207,87 @@ def get_sql_chain(llm=None):
                     return "SELECT * FROM gse WHERE accession = 'GSE20000'"
                 else:
                     return "SELECT * FROM gse"
+            
+            async def ainvoke(self, inputs):
+                return self.invoke(inputs)
         sql_generator = BasicSQLGenerator()
     
     # 返回一个简单的包装对象，提供run方法
     class SQLChain:
-        def run(self, query):
+        def _execute(self, sql_query, parameters=None):
+            """通过受控执行器执行SQL查询，失败或违反限制时抛出异常"""
+            return sql_executor.execute(sql_query, parameters)
+        
+        def _run_template(self, query):
+            """
+            尝试用缓存的SQL模板回答问题
+            
+            Returns:
+                格式化的结果；未命中或执行失败时返回None
+            """
+            hit = sql_template_cache.lookup(query)
+            if hit is None:
+                return None
+            template, parameters = hit
+            try:
+                result = self._execute(template, parameters)
+                return f"查询: {template}\n参数: {parameters}\n\n结果: {result}"
+            except Exception as e:
+                print(f"执行SQL模板错误: {str(e)}，删除该模板并重新生成SQL")
+                sql_template_cache.discard(query)
+                return None
+        
+        def _run_sql(self, query, clean_query, fallback=False):
+            """
+            执行SQL查询，成功后缓存其参数化模板
+            
+            Args:
+                query: 用户问题
+                clean_query: 清理后的SQL
+                fallback: 为True时执行失败返回None，由调用方回退到重新生成SQL
+            """
+            try:
+                result = self._execute(clean_query)
+            except Exception as e:
+                if isinstance(e, FullScanError) and "gse" in e.tables:
+                    # 对gse的全表扫描通常是标题或摘要的LIKE查询，改用全文索引回答
+                    answer = search_gse(query, keyword_only=False)
+                    if answer is not None:
+                        print(f"拒绝全表扫描并改用全文检索: {clean_query}")
+                        return answer
+                if fallback:
+                    print(f"执行预生成SQL查询错误: {str(e)}，回退到重新生成SQL")
+                    return None
+                print(f"执行SQL查询错误: {str(e)}")
+                print(f"详细错误: {traceback.format_exc()}")
+                return f"查询: {clean_query}\n\n错误: {str(e)}"
+            
+            try:
+                sql_template_cache.store(query, clean_query)
+            except Exception as e:
+                print(f"缓存SQL模板失败: {str(e)}")
+            return f"查询: {clean_query}\n\n结果: {result}"
+        
+        def run(self, query, sql_query=None):
+            """
+            生成并执行SQL查询
+            
+            Args:
+                query: 用户问题
+                sql_query: 可选，已经生成好的SQL（如意图分类时一并生成），执行失败时回退到重新生成
+            """
+            if sql_query:
+                clean_query = clean_sql_query(sql_query)
+                print(f"使用预生成SQL查询: {clean_query}")
+                answer = self._run_sql(query, clean_query, fallback=True)
+                if answer is not None:
+                    return answer
+            
+            # 只有字面量不同的问题直接复用缓存的SQL模板
+            answer = self._run_template(query)
+            if answer is not None:
+                return answer
+            
             # 生成SQL查询
             try:
                 sql_query = sql_generator.invoke({"question": query})
@@ -136,18 +296,37 @@ def get_sql_chain(llm=None):
                 clean_query = clean_sql_query(sql_query)
                 print(f"原始SQL查询: {sql_query}")
                 print(f"清理后SQL查询: {clean_query}")
-                
-                # 执行查询
-                try:
-                    result = db.run(clean_query)
-                    return f"查询: {clean_query}\n\n结果: {result}"
-                except Exception as e:
-                    print(f"执行SQL查询错误: {str(e)}")
-                    print(f"详细错误: {traceback.format_exc()}")
-                    return f"查询: {clean_query}\n\n错误: {str(e)}"
             except Exception as e:
                 print(f"生成SQL查询失败: {str(e)}")
                 print(f"详细错误: {traceback.format_exc()}")
                 return f"生成SQL查询失败: {str(e)}"
+            
+            # 执行查询
+            return self._run_sql(query, clean_query)
+        
+        async def arun(self, query, sql_query=None):
+            """run的异步版本：异步生成SQL，数据库查询在线程池中执行，不阻塞事件循环"""
+            if sql_query:
+                clean_query = clean_sql_query(sql_query)
+                print(f"使用预生成SQL查询: {clean_query}")
+                answer = await asyncio.to_thread(self._run_sql, query, clean_query, True)
+                if answer is not None:
+                    return answer
+            
+            answer = await asyncio.to_thread(self._run_template, query)
+            if answer is not None:
+                return answer
+            
+            try:
+                sql_query = await sql_generator.ainvoke({"question": query})
+                clean_query = clean_sql_query(sql_query)
+                print(f"原始SQL查询: {sql_query}")
+                print(f"清理后SQL查询: {clean_query}")
+            except Exception as e:
+                print(f"生成SQL查询失败: {str(e)}")
+                print(f"详细错误: {traceback.format_exc()}")
+                return f"生成SQL查询失败: {str(e)}"
+            
+            return await asyncio.to_thread(self._run_sql, query, clean_query)
     
-    return SQLChain() 
\ No newline at end of file
+    return SQLChain()
\ No newline at end of file
@@ -0,0 +1,227 @@
+"""
+基于NumPy内存映射的向量索引
+
+索引目录中包含：
+- embeddings.npy: L2归一化后的嵌入矩阵（float32或float16），以mmap方式打开，
+  多个uvicorn工作进程共享同一份操作系统页缓存，不需要各自复制一份
+- meta.jsonl: 每行一个文档（page_content和metadata）
+- offsets.npy: 每个文档在meta.jsonl中的字节偏移，检索后只读取top-k文档
+- index.json: 嵌入模型、维度、数量和数据类型
+- metadata_index.json: accession/organism/topic到行号的二级索引，用于按元数据预过滤
+
+检索时把查询向量与矩阵做一次批量矩阵-向量乘积得到余弦相似度，再用argpartition取top-k。
+"""
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import json
+import os
+import shutil
+import time
+import numpy as np
+from app.tools.metadata_filters import Filters, MetadataIndex
+
+EMBEDDINGS_FILE = "embeddings.npy"
+META_FILE = "meta.jsonl"
+OFFSETS_FILE = "offsets.npy"
+MANIFEST_FILE = "index.json"
+
+# float16矩阵按块转换为float32再相乘，避免一次性复制整个矩阵
+FLOAT16_BLOCK_ROWS = 65536
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+class NumpyVectorIndex:
+    """
+    只读的内存映射向量索引
+
+    Args:
+        path: 索引目录
+        embeddings: 嵌入模型，需提供embed_query
+    """
+
+    def __init__(self, path: str, embeddings: Any):
+        self.path = path
+        self.embeddings = embeddings
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        self._manifest_mtime = os.stat(manifest_path).st_mtime_ns
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.matrix = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        self._meta_fd = os.open(os.path.join(path, META_FILE), os.O_RDONLY)
+        self.metadata_index = MetadataIndex.load(path)
+        if self.matrix.shape[0] != self.offsets.shape[0] - 1:
+            raise ValueError(f"索引文件不一致: {self.matrix.shape[0]} 个向量，{self.offsets.shape[0] - 1} 条元数据")
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    def is_stale(self) -> bool:
+        """索引目录是否已被重新构建"""
+        try:
+            return os.stat(os.path.join(self.path, MANIFEST_FILE)).st_mtime_ns != self._manifest_mtime
+        except OSError:
+            return False
+
+    def _scores(self, query_vector: np.ndarray) -> np.ndarray:
+        """计算查询向量与所有文档的余弦相似度"""
+        if self.matrix.dtype == np.float32:
+            return self.matrix @ query_vector
+        scores = np.empty(self.matrix.shape[0], dtype=np.float32)
+        for start in range(0, self.matrix.shape[0], FLOAT16_BLOCK_ROWS):
+            block = self.matrix[start:start + FLOAT16_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ query_vector
+        return scores
+
+    def _read_document(self, row: int) -> Dict[str, Any]:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        # os.pread不移动文件位置，多个线程可以同时读取
+        return json.loads(os.pread(self._meta_fd, end - start, start))
+
+    def filter_rows(self, filters: Optional[Filters]) -> Optional[np.ndarray]:
+        """满足过滤条件的行号；没有条件或旧版本索引没有元数据索引时返回None，表示不过滤"""
+        if not filters or self.metadata_index is None:
+            return None
+        return self.metadata_index.rows(filters)
+
+    def search_vector(self, query_vector: List[float], k: int = 4, rows: Optional[np.ndarray] = None) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        按向量检索
+
+        Args:
+            query_vector: 查询嵌入
+            k: 返回的文档数
+            rows: 只在这些行中检索（元数据预过滤的结果），None表示检索全部
+
+        Returns:
+            [(文档字典, 余弦相似度), ...]，按相似度从高到低排列
+        """
+        total = len(self) if rows is None else len(rows)
+        if total == 0:
+            return []
+        vector = np.asarray(query_vector, dtype=np.float32)
+        if vector.shape[0] != self.matrix.shape[1]:
+            raise ValueError(f"查询向量维度 {vector.shape[0]} 与索引维度 {self.matrix.shape[1]} 不一致，请检查嵌入模型")
+        vector = _normalize(vector)
+
+        # 预过滤后只计算匹配行的相似度
+        scores = self._scores(vector) if rows is None else self.matrix[rows].astype(np.float32) @ vector
+        k = min(k, total)
+        if k < total:
+            candidates = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(total)
+        ranked = candidates[np.argsort(-scores[candidates])]
+        row_ids = ranked if rows is None else rows[ranked]
+        return [(self._read_document(int(row)), float(score)) for row, score in zip(row_ids, scores[ranked])]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[Filters] = None) -> List[Tuple[Any, float]]:
+        """检索与查询最相似的文档及其余弦相似度，filter为{字段: 取值}形式的元数据过滤条件"""
+        from langchain_core.documents import Document
+        results = self.search_vector(self.embeddings.embed_query(query), k, self.filter_rows(filter))
+        return [
+            (Document(page_content=record["page_content"], metadata=record.get("metadata") or {}), score)
+            for record, score in results
+        ]
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Filters] = None) -> List[Any]:
+        """检索与查询最相似的文档，接口与LangChain向量库相同"""
+        return [document for document, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def close(self) -> None:
+        if self._meta_fd is not None:
+            os.close(self._meta_fd)
+            self._meta_fd = None
+
+    def __del__(self):
+        # 重新加载后旧索引对象不再被引用时关闭元数据文件
+        try:
+            self.close()
+        except (AttributeError, OSError):
+            pass
+
+    @classmethod
+    def build(
+        cls,
+        path: str,
+        documents: Iterable[Any],
+        embeddings: Any,
+        dtype: str = "float32",
+        batch_size: int = 64,
+        model: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        从文档构建索引，写入临时目录后整体替换旧索引
+
+        已打开旧索引的进程继续读取旧文件（mmap映射的文件被删除后仍然有效），重新加载后读到新索引
+
+        Args:
+            path: 索引目录
+            documents: 文档（page_content、metadata）的可迭代对象，按批嵌入，不需要全部读入内存
+            embeddings: 嵌入模型，需提供embed_documents
+            dtype: 矩阵的数据类型，float32或float16
+            batch_size: 每批嵌入的文档数
+            model: 嵌入模型名称，记录在index.json中
+
+        Returns:
+            index.json的内容
+        """
+        start_time = time.perf_counter()
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        raw_path = os.path.join(tmp_path, "embeddings.raw")
+        metadata_index = MetadataIndex()
+        offsets = [0]
+        count, dim = 0, None
+        with open(raw_path, "wb") as raw, open(os.path.join(tmp_path, META_FILE), "wb") as meta:
+            for batch in _batched(documents, batch_size):
+                vectors = _normalize(np.asarray(embeddings.embed_documents([doc.page_content for doc in batch]), dtype=np.float32))
+                if dim is None:
+                    dim = vectors.shape[1]
+                raw.write(vectors.astype(dtype).tobytes())
+                for doc in batch:
+                    metadata_index.add(len(offsets) - 1, doc.metadata)
+                    line = json.dumps({"page_content": doc.page_content, "metadata": doc.metadata}, ensure_ascii=False).encode("utf-8") + b"\n"
+                    meta.write(line)
+                    offsets.append(offsets[-1] + len(line))
+                count += len(batch)
+
+        if count == 0:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise ValueError("没有可导入的文档，保留原有索引")
+
+        # 原始数据转换为带头部的.npy文件，之后可以用np.load(mmap_mode="r")打开
+        matrix = np.lib.format.open_memmap(os.path.join(tmp_path, EMBEDDINGS_FILE), mode="w+", dtype=dtype, shape=(count, dim))
+        matrix[:] = np.memmap(raw_path, dtype=dtype, mode="r", shape=(count, dim))
+        matrix.flush()
+        del matrix
+        os.remove(raw_path)
+        np.save(os.path.join(tmp_path, OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+        metadata_index.save(tmp_path)
+
+        manifest = {"model": model, "dim": dim, "count": count, "dtype": dtype, "created": time.time()}
+        with open(os.path.join(tmp_path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+
+        old_path = f"{path}.old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        print(f"向量索引构建完成: {count} 条，维度 {dim}，{dtype}，耗时 {time.perf_counter() - start_time:.1f}秒")
+        return manifest
+
+def _batched(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,235 @@
+"""
+RAG检索使用的向量库
+
+后端由settings.vector_backend选择，每个进程在第一次检索时加载一次并复用。
+加载失败时抛出VectorStoreUnavailable，由RAG链返回明确的检索错误，不再返回占位文档；
+失败后间隔vector_retry_interval秒再重试，避免每个请求都重新尝试加载。
+"""
+from typing import Any, Callable, Dict, List, Optional
+from app.config import settings
+from app.tools.embedding_cache import CachedEmbeddings
+from app.tools.metadata_filters import Filters, to_chroma_where
+import os
+import threading
+import time
+import traceback
+
+class VectorStoreUnavailable(Exception):
+    """向量库无法加载或为空"""
+
+_embeddings: Optional[Any] = None
+_embeddings_lock = threading.Lock()
+
+def get_embeddings() -> Any:
+    """
+    获取进程内共享的嵌入模型，导入和查询使用同一个模型
+
+    启用嵌入缓存时包装为CachedEmbeddings，导入和查询共用同一个缓存文件
+    """
+    global _embeddings
+    with _embeddings_lock:
+        if _embeddings is None:
+            from langchain_ollama import OllamaEmbeddings
+            embeddings = OllamaEmbeddings(model=settings.embedding_model, base_url=settings.ollama_base_url)
+            if settings.embedding_cache_enabled:
+                embeddings = CachedEmbeddings(
+                    embeddings,
+                    model=settings.embedding_model,
+                    path=settings.embedding_cache_path,
+                    max_memory_entries=settings.embedding_cache_memory_entries
+                )
+            _embeddings = embeddings
+        return _embeddings
+
+def get_embedding_cache_stats() -> Optional[Dict[str, Any]]:
+    """获取嵌入缓存统计信息，未启用或尚未创建嵌入模型时返回None"""
+    if isinstance(_embeddings, CachedEmbeddings):
+        return _embeddings.get_stats()
+    return None
+
+def resolve_vector_db_path() -> str:
+    """向量库目录的绝对路径"""
+    return os.path.normpath(os.path.join(os.getcwd(), settings.vector_db_path))
+
+def hnsw_metadata() -> Dict[str, Any]:
+    """
+    Chroma集合的HNSW参数
+
+    space、M和construction_ef只在创建集合时生效；search_ef越大召回率越高、检索越慢，
+    打开已有集合时由apply_search_ef更新，不需要重新导入
+    """
+    return {
+        "hnsw:space": settings.vector_hnsw_space,
+        "hnsw:M": settings.vector_hnsw_m,
+        "hnsw:construction_ef": settings.vector_hnsw_construction_ef,
+        "hnsw:search_ef": settings.vector_hnsw_search_ef,
+    }
+
+def apply_search_ef(vectordb: Any, search_ef: int) -> bool:
+    """
+    把search_ef写入已有Chroma集合的HNSW向量段
+
+    Chroma的HNSW段在创建集合时复制一份集合元数据，加载段时只读取这份元数据，
+    collection.modify()只修改集合元数据，不会影响检索；因此直接更新向量段的元数据，
+    在第一次检索加载向量段之前调用时本进程立即生效，其他进程在下一次加载集合时生效
+
+    Args:
+        vectordb: LangChain的Chroma实例
+        search_ef: 检索时的候选集大小
+
+    Returns:
+        是否更新了向量段的元数据
+    """
+    from chromadb.types import SegmentScope
+
+    sysdb = vectordb._client._server._sysdb
+    updated = False
+    for segment in sysdb.get_segments(collection=vectordb._collection.id, scope=SegmentScope.VECTOR):
+        if (segment["metadata"] or {}).get("hnsw:search_ef") != search_ef:
+            sysdb.update_segment(segment["id"], metadata={"hnsw:search_ef": search_ef})
+            updated = True
+    return updated
+
+def _load_chroma() -> Any:
+    """打开持久化的Chroma集合"""
+    from langchain_community.vectorstores import Chroma
+
+    path = resolve_vector_db_path()
+    if not os.path.isdir(path):
+        raise VectorStoreUnavailable(f"向量库目录不存在: {path}，请先运行 python -m app.data_loader.ingest_chromadb")
+
+    vectordb = Chroma(
+        collection_name=settings.vector_collection,
+        embedding_function=get_embeddings(),
+        persist_directory=path,
+        collection_metadata=hnsw_metadata()
+    )
+    count = vectordb._collection.count()
+    if count == 0:
+        raise VectorStoreUnavailable(f"向量库集合 {settings.vector_collection} 为空: {path}，请先导入文档")
+
+    try:
+        if apply_search_ef(vectordb, settings.vector_hnsw_search_ef):
+            print(f"已将集合的hnsw:search_ef更新为 {settings.vector_hnsw_search_ef}")
+    except Exception as e:
+        print(f"更新集合的hnsw:search_ef失败，使用创建集合时的值: {e}")
+
+    metadata = vectordb._collection.metadata or {}
+    configured = {key: value for key, value in hnsw_metadata().items() if key != "hnsw:search_ef"}
+    mismatched = {key: metadata.get(key) for key in configured if metadata.get(key) != configured[key]}
+    if mismatched:
+        print(f"集合已有的HNSW参数与配置不同（需重新导入才能生效）: {mismatched}")
+    print(f"已加载Chroma集合 {settings.vector_collection}: {count} 条向量")
+    return vectordb
+
+def resolve_vector_index_path() -> str:
+    """NumPy向量索引目录的绝对路径"""
+    return os.path.normpath(os.path.join(os.getcwd(), settings.vector_index_path))
+
+def _load_numpy() -> Any:
+    """以内存映射方式打开NumPy向量索引"""
+    from app.tools.vector_index import MANIFEST_FILE, NumpyVectorIndex
+
+    path = resolve_vector_index_path()
+    if not os.path.exists(os.path.join(path, MANIFEST_FILE)):
+        raise VectorStoreUnavailable(f"向量索引不存在: {path}，请先运行 python -m app.data_loader.ingest_chromadb（VECTOR_BACKEND=numpy）")
+
+    index = NumpyVectorIndex(path, get_embeddings())
+    if len(index) == 0:
+        raise VectorStoreUnavailable(f"向量索引为空: {path}")
+    model = index.manifest.get("model")
+    if model and model != settings.embedding_model:
+        raise VectorStoreUnavailable(f"向量索引由嵌入模型 {model} 构建，与当前配置 {settings.embedding_model} 不一致，请重新导入")
+    print(f"已加载NumPy向量索引: {len(index)} 条向量，维度 {index.matrix.shape[1]}，{index.matrix.dtype}")
+    return index
+
+# 可选的向量库后端，值为加载函数
+VECTOR_BACKENDS: Dict[str, Callable[[], Any]] = {
+    "chroma": _load_chroma,
+    "numpy": _load_numpy,
+}
+
+_vectordb: Optional[Any] = None
+_vectordb_lock = threading.Lock()
+_load_state: Dict[str, Any] = {"backend": None, "load_seconds": None, "error": None, "failed_at": None, "loads": 0}
+
+def _is_stale(vectordb: Any) -> bool:
+    """支持检测的后端（NumPy索引）在重新构建后需要重新加载"""
+    is_stale = getattr(vectordb, "is_stale", None)
+    return bool(is_stale and is_stale())
+
+def get_vectordb() -> Any:
+    """
+    获取当前进程的向量库，第一次调用时加载
+
+    Returns:
+        提供similarity_search(query, k)的向量库对象
+
+    Raises:
+        VectorStoreUnavailable: 后端未知、加载失败或向量库为空
+    """
+    global _vectordb
+    if _vectordb is not None and not _is_stale(_vectordb):
+        return _vectordb
+
+    with _vectordb_lock:
+        if _vectordb is not None:
+            if not _is_stale(_vectordb):
+                return _vectordb
+            print("向量索引已重新构建，重新加载")
+            _vectordb = None
+
+        failed_at = _load_state["failed_at"]
+        if failed_at is not None and time.monotonic() - failed_at < settings.vector_retry_interval:
+            raise VectorStoreUnavailable(f"向量库不可用: {_load_state['error']}")
+
+        backend = settings.vector_backend
+        loader = VECTOR_BACKENDS.get(backend)
+        if loader is None:
+            raise VectorStoreUnavailable(f"未知的向量库后端: {backend}，可选: {', '.join(VECTOR_BACKENDS)}")
+
+        start = time.perf_counter()
+        try:
+            vectordb = loader()
+        except Exception as e:
+            _load_state.update(error=f"{backend}: {e}", failed_at=time.monotonic())
+            print(f"加载向量库失败（{backend}）: {e}")
+            if not isinstance(e, VectorStoreUnavailable):
+                print(f"详细错误: {traceback.format_exc()}")
+            raise VectorStoreUnavailable(f"向量库不可用: {backend}: {e}") from e
+
+        load_seconds = time.perf_counter() - start
+        _load_state.update(backend=backend, load_seconds=load_seconds, error=None, failed_at=None)
+        _load_state["loads"] += 1
+        print(f"向量库加载完成（{backend}），耗时 {load_seconds:.3f}秒")
+        _vectordb = vectordb
+        return _vectordb
+
+def similarity_search(query: str, k: int, filters: Optional[Filters] = None) -> List[Any]:
+    """
+    在当前向量库中检索，filters为{字段: 取值}形式的元数据过滤条件，按后端转换后下推
+
+    Raises:
+        VectorStoreUnavailable: 向量库不可用
+    """
+    vectordb = get_vectordb()
+    if not filters:
+        return vectordb.similarity_search(query, k=k)
+    if settings.vector_backend == "chroma":
+        return vectordb.similarity_search(query, k=k, filter=to_chroma_where(filters))
+    return vectordb.similarity_search(query, k=k, filter=filters)
+
+def reset_vectordb() -> None:
+    """丢弃已加载的向量库，下次检索时重新加载（如重新导入文档后）"""
+    global _vectordb
+    with _vectordb_lock:
+        _vectordb = None
+        _load_state.update(error=None, failed_at=None)
+
+def get_vector_store_stats() -> Dict[str, Any]:
+    """获取向量库的加载状态"""
+    return {
+        **{key: value for key, value in _load_state.items() if key != "failed_at"},
+        "configured_backend": settings.vector_backend,
+        "loaded": _vectordb is not None,
+    }
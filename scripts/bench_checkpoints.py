@@ -0,0 +1,75 @@
+"""
+微基准：比较消息历史整体序列化与逐条追加时每次请求写入检查点的字节数和序列化耗时
+
+使用与应用相同的AgentState和消息归约函数，节点不调用LLM，回答为固定长度的文本
+
+用法:
+    python scripts/bench_checkpoints.py [对话轮数] [回答字符数]
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langgraph.graph import StateGraph, END
+from app.config import settings
+from app.graph.builder import AgentState
+from app.graph.memory import BoundedSqliteSaver
+
+
+def build_chat_graph(saver, answer_chars):
+    """意图分类 -> 聊天两个节点，返回与应用中节点相同形状的更新"""
+    def intent_classifier(state):
+        return {"intent": "chat"}
+
+    def chat(state):
+        answer = "回" * answer_chars
+        return {
+            "answer": answer,
+            "messages": [{"role": "user", "content": state["query"]}, {"role": "assistant", "content": answer}]
+        }
+
+    workflow = StateGraph(AgentState)
+    workflow.add_node("intent_classifier", intent_classifier)
+    workflow.add_node("chat", chat)
+    workflow.set_entry_point("intent_classifier")
+    workflow.add_edge("intent_classifier", "chat")
+    workflow.add_edge("chat", END)
+    return workflow.compile(checkpointer=saver)
+
+
+def bench(label, message_channel, turns, answer_chars, directory):
+    """执行turns轮对话，打印历史达到上限后每次请求的检查点字节数和序列化耗时"""
+    saver = BoundedSqliteSaver(os.path.join(directory, f"{label}.db"), compact_interval=None)
+    saver.message_channel = message_channel
+    graph = build_chat_graph(saver, answer_chars)
+    config = {"configurable": {"thread_id": "bench"}}
+    inputs = {"intent": None, "sql_query": None, "sql_answer": None, "rag_answer": None, "answer": None}
+
+    # 前半部分的轮次用于填满历史，只统计后半部分
+    warmup = turns // 2
+    for turn in range(turns):
+        if turn == warmup:
+            puts, put_bytes, seconds = saver.stats["puts"], saver.stats["put_bytes"], saver.stats["serialize_seconds"]
+        graph.invoke({**inputs, "query": f"问题{turn}"}, config)
+    measured = turns - warmup
+    per_request = (saver.stats["put_bytes"] - put_bytes) / measured
+    per_request_ms = (saver.stats["serialize_seconds"] - seconds) / measured * 1000
+    print(f"{label:<8} 检查点 {(saver.stats['puts'] - puts) / measured:.1f} 个/请求  {per_request:10.0f} 字节/请求  序列化 {per_request_ms:.3f} ms/请求")
+    saver.close()
+    return per_request
+
+
+def main():
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    answer_chars = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    print(f"对话轮数: {turns}，回答字符数: {answer_chars}，历史上限: {settings.chat_history_max_messages}条")
+    with tempfile.TemporaryDirectory() as directory:
+        before = bench("整体序列化", None, turns, answer_chars, directory)
+        after = bench("逐条追加", "messages", turns, answer_chars, directory)
+    print(f"每次请求写入减少: {before / after:.1f}倍")
+
+
+if __name__ == "__main__":
+    main()
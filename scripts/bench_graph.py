@@ -0,0 +1,57 @@
+"""
+微基准：比较每次请求重新编译图/构建链与复用已编译图/缓存链的开销
+
+用法:
+    python scripts/bench_graph.py [重复次数]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import settings
+from app.graph.builder import build_graph, get_graph
+from app.graph.nodes import get_cached_chain
+from app.tools.llm_toolkit import get_llm
+from app.tools.sql_toolkit import get_sql_chain
+from app.tools.rag_toolkit import get_rag_chain
+
+
+def bench(label, func, repeat):
+    """执行func repeat次并打印平均耗时"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = time.perf_counter() - start
+    per_call_ms = elapsed / repeat * 1000
+    print(f"{label:<24} {per_call_ms:9.3f} ms/次")
+    return per_call_ms
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    llm = get_llm()
+    provider, model = settings.model_provider, settings.model_name
+
+    def per_request():
+        build_graph()
+        get_sql_chain(llm)
+        get_rag_chain(llm)
+
+    def cached():
+        get_graph()
+        get_cached_chain("sql", llm, provider, model)
+        get_cached_chain("rag", llm, provider, model)
+
+    # 先预热一次，保证缓存路径只测量查找开销
+    cached()
+
+    print(f"重复次数: {repeat}")
+    before = bench("每次请求重新构建", per_request, repeat)
+    after = bench("复用已编译图和缓存链", cached, repeat)
+    print(f"每次请求节省: {before - after:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,7 @@ cd "$(dirname "$0")/.."
 mkdir -p data/chroma
 
 # 更新.env文件中的向量数据库路径
-sed -i '' 's|VECTOR_DB_PATH=.*|VECTOR_DB_PATH=./data|' .env
+sed -i '' 's|VECTOR_DB_PATH=.*|VECTOR_DB_PATH=./data/chroma|' .env
 
 # 检查Ollama是否已安装
 if ! command -v ollama &> /dev/null; then
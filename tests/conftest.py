@@ -0,0 +1,25 @@
+"""
+测试的公共配置
+
+app.config在导入时读取必需的环境变量，app.graph.memory在导入时打开会话存储文件，
+因此在导入被测模块之前设置占位的环境变量，并把会话存储放到临时目录中
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+_tmp_dir = tempfile.mkdtemp(prefix="bioinfo-tests-")
+
+for key, value in {
+    "OPENAI_API_KEY": "test",
+    "API_VERSION": "test",
+    "AZURE_ENDPOINT": "http://localhost",
+    "DATABASE_URL": f"sqlite:///{os.path.join(_tmp_dir, 'bioinfo.db')}",
+    "VECTOR_DB_PATH": os.path.join(_tmp_dir, "chroma"),
+    "CHECKPOINT_DB_PATH": os.path.join(_tmp_dir, "checkpoints.db"),
+}.items():
+    os.environ.setdefault(key, value)
@@ -0,0 +1,26 @@
+from app.graph.answer_cache import AnswerCache
+
+RESULT = {"answer": "12个样本", "intent": "sql", "sql_answer": "[(12,)]"}
+
+def make_cache():
+    # 所有问题的嵌入都相同，只有字面量检查能区分它们
+    return AnswerCache(max_entries=16, ttl=60, version_fn=lambda: 1, similarity_threshold=0.9, embed_fn=lambda text: [1.0, 0.0])
+
+def test_semantic_hit_requires_identical_literals():
+    cache = make_cache()
+    key, _ = cache.make_key("GSE10000有多少样本", "openai", "gpt-4o")
+    cache.put(key, RESULT)
+
+    other, _ = cache.make_key("GSE20000有多少样本", "openai", "gpt-4o")
+    assert cache.get(other) is None
+
+    rephrased, _ = cache.make_key("GSE10000包含多少个样本", "openai", "gpt-4o")
+    assert cache.get(rephrased)["answer"] == "12个样本"
+    assert cache.stats["semantic_hits"] == 1
+
+def test_semantic_hit_requires_same_model():
+    cache = make_cache()
+    key, _ = cache.make_key("肝脏相关的数据集", "openai", "gpt-4o")
+    cache.put(key, RESULT)
+    other, _ = cache.make_key("和肝脏有关的数据集", "ollama", "llama3")
+    assert cache.get(other) is None
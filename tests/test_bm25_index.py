@@ -0,0 +1,87 @@
+import math
+
+import pytest
+from langchain_core.documents import Document
+
+from app.tools.bm25_index import BM25_B, BM25_K1, BM25Builder, BM25Index, reciprocal_rank_fusion, tokenize
+
+DOCUMENTS = [
+    Document(page_content="RNA-seq of human liver tissue", metadata={"chunk_id": "a", "accession": "GSE1", "organism": "Homo sapiens"}),
+    Document(page_content="liver liver liver fibrosis in mouse", metadata={"chunk_id": "b", "accession": "GSE2", "organism": "Mus musculus"}),
+    Document(page_content="single-cell atlas of the mouse brain", metadata={"chunk_id": "c", "accession": "GSE3"}),
+    Document(page_content="肝脏脂肪代谢研究", metadata={"chunk_id": "d"}),
+]
+
+@pytest.fixture
+def index(tmp_path):
+    builder = BM25Builder(str(tmp_path / "bm25"))
+    for document in DOCUMENTS:
+        builder.add(document)
+    builder.save()
+    index = BM25Index(str(tmp_path / "bm25"))
+    yield index
+    index.close()
+
+def bm25_score(query_tokens, document_tokens, corpus):
+    """按定义计算的BM25分数"""
+    avg_length = sum(len(tokens) for tokens in corpus) / len(corpus)
+    score = 0.0
+    for token in set(query_tokens):
+        tf = document_tokens.count(token)
+        if not tf:
+            continue
+        df = sum(1 for tokens in corpus if token in tokens)
+        idf = math.log(1 + (len(corpus) - df + 0.5) / (df + 0.5))
+        score += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * len(document_tokens) / avg_length))
+    return score
+
+def test_tokenize_splits_cjk_into_bigrams_and_keeps_hyphenated_parts():
+    assert tokenize("肝脏脂肪") == ["肝脏", "脏脂", "脂肪"]
+    assert tokenize("RNA-seq 肝") == ["rna-seq", "rna", "seq", "肝"]
+
+def test_search_scores_match_the_bm25_formula(index):
+    corpus = [tokenize(document.page_content) for document in DOCUMENTS]
+    results = index.search("mouse liver", k=4)
+    assert [document.metadata["chunk_id"] for document, _ in results] == ["b", "a", "c"]
+    for document, score in results:
+        expected = bm25_score(tokenize("mouse liver"), tokenize(document.page_content), corpus)
+        assert score == pytest.approx(expected, rel=1e-5)
+
+def test_search_matches_chinese_bigrams(index):
+    results = index.search("脂肪代谢", k=2)
+    assert [document.metadata["chunk_id"] for document, _ in results] == ["d"]
+
+def test_search_without_matching_terms_returns_nothing(index):
+    assert index.search("zebrafish", k=4) == []
+
+def test_search_applies_metadata_filters(index):
+    results = index.search("liver", k=4, filters={"organism": "homo sapiens"})
+    assert [document.metadata["chunk_id"] for document, _ in results] == ["a"]
+    assert index.search("liver", k=4, filters={"accession": "GSE3"}) == []
+
+def test_rebuild_replaces_index_and_marks_it_stale(tmp_path, index):
+    builder = BM25Builder(str(tmp_path / "bm25"))
+    builder.add(DOCUMENTS[0])
+    assert builder.save()["count"] == 1
+    assert index.is_stale()
+    assert len(BM25Index(str(tmp_path / "bm25"))) == 1
+
+def doc(chunk_id):
+    return Document(page_content=f"text {chunk_id}", metadata={"chunk_id": chunk_id})
+
+def test_reciprocal_rank_fusion_sums_reciprocal_ranks():
+    vector_hits = [doc("a"), doc("b"), doc("c")]
+    lexical_hits = [doc("c"), doc("d"), doc("a")]
+    fused = reciprocal_rank_fusion([vector_hits, lexical_hits], k=4, rrf_k=60)
+    # a: 1/61 + 1/63，c: 1/63 + 1/61，并列时保持先出现的顺序；b: 1/62，d: 1/62
+    assert [document.metadata["chunk_id"] for document in fused] == ["a", "c", "b", "d"]
+
+def test_reciprocal_rank_fusion_deduplicates_and_truncates():
+    fused = reciprocal_rank_fusion([[doc("a"), doc("b")], [doc("b")], []], k=1)
+    assert [document.metadata["chunk_id"] for document in fused] == ["b"]
+
+def test_reciprocal_rank_fusion_falls_back_to_content_without_chunk_id():
+    first = Document(page_content="same text", metadata={})
+    second = Document(page_content="same text", metadata={"source": "other"})
+    fused = reciprocal_rank_fusion([[first], [second]], k=4)
+    assert fused == [first]
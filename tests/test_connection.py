@@ -0,0 +1,61 @@
+import sqlite3
+import threading
+
+import pytest
+
+from app.db.connection import SQLitePool
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / "bioinfo.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE gse (accession TEXT)")
+    conn.execute("INSERT INTO gse VALUES ('GSE10000')")
+    conn.commit()
+    conn.close()
+    return str(path)
+
+def add_row(db_path, accession):
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO gse VALUES (?)", (accession,))
+    conn.commit()
+    conn.close()
+
+def test_stale_snapshot_connection_is_closed_on_release(db_path):
+    pool = SQLitePool(db_path, in_memory=True, refresh_interval=0)
+    conn = pool.acquire()
+    add_row(db_path, "GSE20000")
+    with pool.connection() as fresh:
+        assert fresh.execute("SELECT COUNT(*) FROM gse").fetchone()[0] == 2
+    pool.release(conn)
+    assert pool.get_stats()["idle"] == 1
+    with pool.connection() as reused:
+        assert reused is not conn
+    pool.close()
+
+def test_idle_connections_stay_current_under_concurrent_reloads(db_path):
+    pool = SQLitePool(db_path, size=4, in_memory=True, refresh_interval=0)
+    errors = []
+
+    def reader():
+        try:
+            for _ in range(50):
+                with pool.connection() as conn:
+                    conn.execute("SELECT COUNT(*) FROM gse").fetchone()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=reader) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for i in range(10):
+        add_row(db_path, f"GSE{30000 + i}")
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    idle = list(pool._idle.queue)
+    assert all(pool._conn_generation[id(conn)] == pool._generation for conn in idle)
+    stats = pool.get_stats()
+    assert stats["created"] - stats["closed"] == stats["idle"]
+    pool.close()
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from app.config import settings
+from app.tools import context_packer
+from app.tools.context_packer import count_tokens, mmr_order, pack_context
+
+# 查询向量为[1, 0, 0]；a和a2几乎相同，b相关度稍低但方向不同，c与查询无关
+VECTORS = {
+    "query": [1.0, 0.0, 0.0],
+    "a": [0.9, 0.1, 0.0],
+    "a2": [0.9, 0.11, 0.0],
+    "b": [0.7, 0.0, 0.7],
+    "c": [0.0, 1.0, 0.0],
+}
+
+class FakeEmbeddings:
+    def embed_query(self, text):
+        return VECTORS["query"]
+
+    def embed_documents(self, texts):
+        return [VECTORS[text.split()[0]] for text in texts]
+
+@pytest.fixture(autouse=True)
+def packer(monkeypatch):
+    # 固定使用按字符估算的token数，结果与是否安装tiktoken无关
+    monkeypatch.setattr(context_packer, "_get_encoder", lambda model: None)
+    monkeypatch.setattr(context_packer, "get_embeddings", lambda: FakeEmbeddings())
+    monkeypatch.setattr(settings, "rag_top_k", 4)
+    monkeypatch.setattr(settings, "rag_mmr_lambda", 0.7)
+    monkeypatch.setattr(settings, "rag_duplicate_threshold", 0.95)
+    monkeypatch.setattr(settings, "rag_context_tokens", 1000)
+    monkeypatch.setattr(settings, "rag_context_tokens_by_model", {})
+
+def docs(*names, words=1):
+    return [Document(page_content=" ".join([name] + ["word"] * (words - 1))) for name in names]
+
+def test_count_tokens_estimate():
+    assert count_tokens("肝脏", "test") == 2
+    assert count_tokens("liver RNA seq", "test") == 4
+
+def test_mmr_order_drops_near_duplicates_and_prefers_diverse_documents():
+    doc_vectors = np.asarray([VECTORS[name] for name in ("a", "a2", "c", "b")], dtype=np.float32)
+    order, dropped = mmr_order(np.asarray(VECTORS["query"]), doc_vectors, 0.7, 0.95)
+    assert order == [0, 3, 2]
+    assert dropped == 1
+
+def test_mmr_order_with_lambda_one_keeps_relevance_order():
+    doc_vectors = np.asarray([VECTORS[name] for name in ("c", "b", "a")], dtype=np.float32)
+    order, dropped = mmr_order(np.asarray(VECTORS["query"]), doc_vectors, 1.0, 1.01)
+    assert order == [2, 1, 0]
+    assert dropped == 0
+
+def test_pack_context_reorders_by_mmr_and_removes_duplicates():
+    packed = pack_context("query", docs("a", "a2", "c", "b"), "test")
+    assert packed == ["a", "b", "c"]
+
+def test_pack_context_respects_token_budget(monkeypatch):
+    monkeypatch.setattr(settings, "rag_context_tokens_by_model", {"small": 30})
+    candidates = docs("a", "b", "c", words=10)
+    per_doc = count_tokens(candidates[0].page_content, "small")
+    packed = pack_context("query", candidates, "small")
+    assert len(packed) == 30 // per_doc
+    assert count_tokens("\n\n".join(packed), "small") <= 30
+
+def test_pack_context_truncates_first_document_over_budget(monkeypatch):
+    monkeypatch.setattr(settings, "rag_context_tokens", 5)
+    packed = pack_context("query", docs("a", "b", words=20), "test")
+    assert len(packed) == 1
+    assert packed[0].startswith("a word")
+    assert count_tokens(packed[0], "test") <= 5
+
+def test_pack_context_limits_number_of_documents(monkeypatch):
+    monkeypatch.setattr(settings, "rag_top_k", 2)
+    assert len(pack_context("query", docs("a", "b", "c"), "test")) == 2
+
+def test_pack_context_keeps_retrieval_order_when_embeddings_fail(monkeypatch):
+    def unavailable():
+        raise RuntimeError("embeddings unavailable")
+    monkeypatch.setattr(context_packer, "get_embeddings", unavailable)
+    assert pack_context("query", docs("a", "a2", "c"), "test") == ["a", "a2", "c"]
+    assert pack_context("query", [], "test") == []
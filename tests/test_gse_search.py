@@ -0,0 +1,50 @@
+import sqlite3
+
+import pytest
+
+from app.tools.gse_search import (
+    GSEFullTextSearch, ensure_fts_index, extract_like_terms, extract_search_terms, is_keyword_search
+)
+
+ROWS = [
+    (1, "GSE1", "Asthma airway epithelium", "哮喘患者气道上皮的转录组", "Homo sapiens"),
+    (2, "GSE2", "Liver lipid metabolism in mice", "高脂饮食小鼠肝脏", "Mus musculus"),
+    (3, "GSE3", "Airway remodeling", "哮喘小鼠模型的liver and lung", "Mus musculus"),
+]
+
+@pytest.fixture
+def fts():
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.execute(
+        "CREATE TABLE gse (id INTEGER PRIMARY KEY, accession TEXT, title TEXT, description TEXT, "
+        "organism TEXT, platform TEXT, sample_count INTEGER)"
+    )
+    conn.executemany("INSERT INTO gse (id, accession, title, description, organism) VALUES (?, ?, ?, ?, ?)", ROWS)
+    if ensure_fts_index(conn) != "trigram":
+        pytest.skip("SQLite不支持trigram分词器")
+    yield GSEFullTextSearch(lambda: conn, lambda c: None)
+    conn.close()
+
+def test_bare_find_is_not_a_dataset_search():
+    assert not is_keyword_search("找一下肝癌患者的生存率")
+    assert not is_keyword_search("找GSE10000的样本数")
+    assert is_keyword_search("找关于肝脏脂肪代谢的数据集")
+    assert is_keyword_search("搜索哮喘相关的研究")
+    assert is_keyword_search("find liver datasets")
+
+def test_two_character_terms_fall_back_to_like():
+    question = "找哮喘相关的数据集"
+    assert extract_search_terms(question) == []
+    assert extract_like_terms(question) == ["哮喘"]
+    assert extract_like_terms(question, min_length=2) == []
+
+def test_like_only_search(fts):
+    condition, columns, rows = fts.search("找哮喘相关的数据集")
+    assert condition == "LIKE '%哮喘%'"
+    assert [row[columns.index("accession")] for row in rows] == ["GSE1", "GSE3"]
+    assert fts.get_stats()["like_fallbacks"] == 1
+
+def test_rows_matching_both_conditions_rank_first(fts):
+    condition, columns, rows = fts.search("找哮喘和肝脏的数据集")
+    assert "gse_fts MATCH" in condition and "LIKE '%哮喘%'" in condition
+    assert [row[columns.index("accession")] for row in rows] == ["GSE3", "GSE2", "GSE1"]
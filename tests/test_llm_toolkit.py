@@ -0,0 +1,58 @@
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from app.tools import llm_toolkit
+
+@pytest.fixture
+def registry(monkeypatch):
+    created = []
+
+    def fake_create_llm(model_provider, model_name, temperature):
+        is_fallback = not available[model_provider]
+        llm = object()
+        created.append((model_provider, is_fallback))
+        return llm, is_fallback
+
+    available = {"qwen": False}
+    monkeypatch.setattr(llm_toolkit, "_create_llm", fake_create_llm)
+    llm_toolkit.reset_llm_registry()
+    yield available, created
+    llm_toolkit.reset_llm_registry()
+
+def test_fallback_clients_expire_and_the_service_is_probed_again(registry, monkeypatch):
+    available, created = registry
+    now = [1000.0]
+    monkeypatch.setattr(llm_toolkit, "time", SimpleNamespace(monotonic=lambda: now[0]))
+
+    fallback = llm_toolkit.get_llm("qwen", "qwen-max")
+    assert llm_toolkit.get_llm("qwen", "qwen-max") is fallback
+
+    available["qwen"] = True
+    now[0] += llm_toolkit.FALLBACK_RETRY_INTERVAL
+    recovered = llm_toolkit.get_llm("qwen", "qwen-max")
+    assert recovered is not fallback
+    assert created == [("qwen", True), ("qwen", False)]
+
+    # 原服务的客户端不会过期
+    now[0] += 10 * llm_toolkit.FALLBACK_RETRY_INTERVAL
+    assert llm_toolkit.get_llm("qwen", "qwen-max") is recovered
+
+def test_qwen_probe_lists_models_without_generating(monkeypatch):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if request.headers["Authorization"] != "Bearer good":
+            return httpx.Response(401)
+        return httpx.Response(200, json={"data": []})
+
+    client = httpx.Client(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(llm_toolkit, "get_http_clients", lambda: (client, None))
+
+    assert llm_toolkit.is_qwen_available("https://qwen.example/v1/", "good")
+    assert not llm_toolkit.is_qwen_available("https://qwen.example/v1", "bad")
+    assert [(request.method, str(request.url)) for request in requests] == [
+        ("GET", "https://qwen.example/v1/models"), ("GET", "https://qwen.example/v1/models")
+    ]
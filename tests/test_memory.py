@@ -0,0 +1,200 @@
+import time
+
+import pytest
+from langgraph.checkpoint.base import empty_checkpoint
+
+from app.graph.memory import BoundedSqliteSaver
+
+@pytest.fixture
+def make_saver(tmp_path):
+    savers = []
+
+    def make(**kwargs):
+        kwargs.setdefault("compact_interval", None)
+        saver = BoundedSqliteSaver(str(tmp_path / f"checkpoints{len(savers)}.db"), **kwargs)
+        savers.append(saver)
+        return saver
+
+    yield make
+    for saver in savers:
+        saver.close()
+
+def save_steps(saver, thread_id, steps):
+    """模拟图的执行：每一步query不变，answer更新，返回每一步的配置"""
+    config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+    versions, configs = {}, []
+    for step in range(steps):
+        checkpoint = empty_checkpoint()
+        new_versions = {}
+        if step == 0:
+            new_versions["query"] = saver.get_next_version(None)
+        new_versions["answer"] = saver.get_next_version(versions.get("answer"))
+        versions.update(new_versions)
+        checkpoint["channel_versions"] = dict(versions)
+        checkpoint["channel_values"] = {"query": "GSE10000有多少样本", "answer": f"answer {step}"}
+        config = saver.put(config, checkpoint, {"step": step}, new_versions)
+        saver.put_writes(config, [("answer", f"write {step}")], task_id=f"task{step}")
+        configs.append(config)
+    return configs
+
+def table_count(saver, table, thread_id=None):
+    if thread_id is None:
+        return saver._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    return saver._conn.execute(f"SELECT COUNT(*) FROM {table} WHERE thread_id = ?", (thread_id,)).fetchone()[0]
+
+def test_put_keeps_only_last_checkpoints(make_saver):
+    saver = make_saver(keep_last=2)
+    configs = save_steps(saver, "t1", 5)
+
+    listed = list(saver.list({"configurable": {"thread_id": "t1"}}))
+    assert [item.config for item in listed] == [configs[4], configs[3]]
+    assert saver.stats["pruned_checkpoints"] == 3
+    # 被删除的检查点的写入一起删除
+    assert table_count(saver, "writes") == 2
+    assert saver.get_tuple(configs[0]) is None
+
+def test_latest_checkpoint_reads_unchanged_channels_from_earlier_versions(make_saver):
+    saver = make_saver(keep_last=2)
+    save_steps(saver, "t1", 4)
+    latest = saver.get_tuple({"configurable": {"thread_id": "t1"}})
+    assert latest.checkpoint["channel_values"] == {"query": "GSE10000有多少样本", "answer": "answer 3"}
+    assert latest.metadata["step"] == 3
+    assert latest.pending_writes == [("task3", "answer", "write 3")]
+
+def test_compact_deletes_blobs_of_pruned_checkpoints(make_saver):
+    saver = make_saver(keep_last=2)
+    save_steps(saver, "t1", 5)
+    # query一个版本，answer五个版本
+    assert table_count(saver, "blobs") == 6
+
+    result = saver.compact()
+    assert result == {"evicted_threads": 0, "deleted_blobs": 3}
+    assert table_count(saver, "blobs") == 3
+    # 只写入一次的query仍被最新的检查点引用，不会被删除
+    latest = saver.get_tuple({"configurable": {"thread_id": "t1"}})
+    assert latest.checkpoint["channel_values"]["query"] == "GSE10000有多少样本"
+
+def test_compact_evicts_idle_threads(make_saver):
+    saver = make_saver(thread_ttl=60)
+    save_steps(saver, "idle", 1)
+    save_steps(saver, "active", 1)
+    saver._conn.execute("UPDATE threads SET updated_at = ? WHERE thread_id = 'idle'", (time.time() - 120,))
+    saver._conn.commit()
+
+    assert saver.compact()["evicted_threads"] == 1
+    assert [thread["thread_id"] for thread in saver.list_threads()] == ["active"]
+    for table in ("checkpoints", "blobs", "writes"):
+        assert table_count(saver, table, "idle") == 0
+
+def test_compact_evicts_least_recently_active_threads_over_limit(make_saver):
+    saver = make_saver(thread_ttl=None, max_threads=2)
+    for thread_id in ("t1", "t2", "t3"):
+        save_steps(saver, thread_id, 1)
+        time.sleep(0.01)
+
+    assert saver.compact()["evicted_threads"] == 1
+    assert [thread["thread_id"] for thread in saver.list_threads()] == ["t3", "t2"]
+    stats = saver.get_stats()
+    assert stats["threads"] == 2
+    assert stats["checkpoints"] == 2
+
+def test_delete_thread_removes_all_rows(make_saver):
+    saver = make_saver()
+    save_steps(saver, "t1", 2)
+    save_steps(saver, "t2", 1)
+    saver.delete_thread("t1")
+    for table in ("threads", "checkpoints", "blobs", "writes"):
+        assert table_count(saver, table, "t1") == 0
+    assert saver.get_tuple({"configurable": {"thread_id": "t2"}}) is not None
+
+def test_blobs_pruned_by_one_worker_are_collected_by_another(tmp_path):
+    path = str(tmp_path / "shared.db")
+    writer = BoundedSqliteSaver(path, keep_last=2, compact_interval=None)
+    save_steps(writer, "t1", 5)
+    writer.close()
+
+    # 重启后或在其他工作进程中压缩，待清理的线程记录在数据库中
+    compactor = BoundedSqliteSaver(path, keep_last=2, compact_interval=None)
+    try:
+        assert compactor.compact()["deleted_blobs"] == 3
+        assert compactor._conn.execute("SELECT dirty FROM threads WHERE thread_id = 't1'").fetchone()[0] == 0
+        assert compactor.compact()["deleted_blobs"] == 0
+    finally:
+        compactor.close()
+
+def test_existing_store_without_dirty_column_is_migrated(tmp_path):
+    path = str(tmp_path / "old.db")
+    saver = BoundedSqliteSaver(path, keep_last=2, compact_interval=None)
+    save_steps(saver, "t1", 5)
+    saver._conn.execute("DROP INDEX idx_threads_dirty")
+    saver._conn.execute("ALTER TABLE threads DROP COLUMN dirty")
+    saver._conn.commit()
+    saver.close()
+
+    migrated = BoundedSqliteSaver(path, keep_last=2, compact_interval=None)
+    try:
+        assert migrated.compact()["deleted_blobs"] == 3
+    finally:
+        migrated.close()
+
+def run_chat(saver, thread_id, turns, limit):
+    """用带追加归约函数的小图模拟多轮聊天，历史最多保留limit条消息"""
+    from typing import Annotated, List, TypedDict
+    from langgraph.graph import END, StateGraph
+
+    def append(history, new):
+        return ((history or []) + (new or []))[-limit:]
+
+    class State(TypedDict):
+        query: str
+        messages: Annotated[List[dict], append]
+
+    def chat(state):
+        return {"messages": [
+            {"role": "user", "content": state["query"]},
+            {"role": "assistant", "content": f"关于{state['query']}的回答 " + "x" * 200}
+        ]}
+
+    workflow = StateGraph(State)
+    workflow.add_node("chat", chat)
+    workflow.set_entry_point("chat")
+    workflow.add_edge("chat", END)
+    graph = workflow.compile(checkpointer=saver)
+    config = {"configurable": {"thread_id": thread_id}}
+    result = None
+    for turn in range(turns):
+        result = graph.invoke({"query": f"问题{turn}"}, config)
+    return result
+
+def test_messages_are_appended_once_and_rebuilt_on_read(make_saver):
+    saver = make_saver(keep_last=3)
+    result = run_chat(saver, "t1", turns=30, limit=10)
+
+    assert len(result["messages"]) == 10
+    assert result["messages"][-2]["content"] == "问题29"
+    latest = saver.get_tuple({"configurable": {"thread_id": "t1"}})
+    assert latest.checkpoint["channel_values"]["messages"] == result["messages"]
+    # 每轮只追加本轮的两条消息
+    assert saver.stats["appended_messages"] == 60
+
+    saver.compact()
+    # 保留的3个检查点中最早的一个从2条消息之前开始引用
+    assert saver.get_stats()["messages"] == 12
+    assert saver.get_tuple({"configurable": {"thread_id": "t1"}}).checkpoint["channel_values"]["messages"] == result["messages"]
+
+def test_checkpoint_bytes_do_not_grow_with_history(make_saver):
+    full, deltas = make_saver(keep_last=3), make_saver(keep_last=3)
+    full.message_channel = None
+
+    def turn_bytes(saver, thread_id, history_turns):
+        run_chat(saver, thread_id, turns=history_turns, limit=40)
+        before = saver.stats["put_bytes"]
+        run_chat(saver, thread_id, turns=1, limit=40)
+        return saver.stats["put_bytes"] - before
+
+    # 整体序列化时每轮写入的字节数随历史增长，逐条追加时与历史长度无关
+    full_short, full_long = turn_bytes(full, "short", 2), turn_bytes(full, "long", 30)
+    deltas_short, deltas_long = turn_bytes(deltas, "short", 2), turn_bytes(deltas, "long", 30)
+    assert full_long > full_short * 2
+    assert abs(deltas_long - deltas_short) < 64
+    assert deltas_long * 3 < full_long
@@ -0,0 +1,51 @@
+import pytest
+from langchain_core.documents import Document
+
+from app.config import settings
+from app.tools import rag_toolkit
+
+def doc(chunk_id, **metadata):
+    return Document(page_content=f"text {chunk_id}", metadata={"chunk_id": chunk_id, **metadata})
+
+CORPUS = [
+    doc("methods"),
+    doc("mouse", organism="Mus musculus"),
+    doc("gse1", accession="GSE10000", organism="Homo sapiens"),
+    doc("human", organism="Homo sapiens"),
+    doc("background"),
+]
+
+@pytest.fixture
+def searches(monkeypatch):
+    calls = []
+
+    def fake_hybrid_search(query, k, filters):
+        calls.append((k, filters))
+        docs = CORPUS
+        for field, value in (filters or {}).items():
+            docs = [document for document in docs if document.metadata.get(field) == value]
+        return docs[:k]
+
+    monkeypatch.setattr(rag_toolkit, "_hybrid_search", fake_hybrid_search)
+    monkeypatch.setattr(rag_toolkit, "_known_topics", lambda: [])
+    monkeypatch.setattr(settings, "rag_metadata_filters", True)
+    monkeypatch.setattr(settings, "rag_candidate_k", 3)
+    return calls
+
+def ids(docs):
+    return [document.metadata["chunk_id"] for document in docs]
+
+def test_query_without_filters_runs_one_search(searches):
+    assert ids(rag_toolkit.retrieve("RNA-seq的原理")) == ["methods", "mouse", "gse1"]
+    assert searches == [(3, None)]
+
+def test_organism_boost_is_applied_in_memory(searches):
+    docs = rag_toolkit.retrieve("人类肝脏的表达谱")
+    # 一次不过滤的检索，物种匹配的文本块被提前，没有物种元数据的文本块仍然保留
+    assert searches == [(6, None)]
+    assert ids(docs) == ["gse1", "human", "methods"]
+
+def test_accession_filter_tops_up_with_one_unfiltered_search(searches):
+    docs = rag_toolkit.retrieve("GSE10000的人类样本")
+    assert searches == [(3, {"accession": "GSE10000"}), (3, None)]
+    assert ids(docs) == ["gse1", "methods", "mouse"]
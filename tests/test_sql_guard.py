@@ -0,0 +1,84 @@
+import sqlite3
+
+import pytest
+
+from app.tools.sql_guard import FullScanError, GuardedExecutor, SQLGuardError
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / "bioinfo.db"
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE gse (id INTEGER PRIMARY KEY, gse_accession TEXT, title TEXT, organism TEXT);
+        CREATE INDEX idx_gse_accession ON gse(gse_accession);
+        CREATE TABLE gsm (id INTEGER PRIMARY KEY, gsm_accession TEXT, gse_accession TEXT);
+    """)
+    conn.executemany(
+        "INSERT INTO gse (gse_accession, title, organism) VALUES (?, ?, ?)",
+        [(f"GSE{i}", f"study {i} " + "x" * 50, "Homo sapiens") for i in range(1, 501)]
+    )
+    conn.executemany(
+        "INSERT INTO gsm (gsm_accession, gse_accession) VALUES (?, ?)",
+        [(f"GSM{i}", f"GSE{i % 500 + 1}") for i in range(1, 501)]
+    )
+    conn.commit()
+    conn.close()
+    return str(path)
+
+def make_executor(db_path, **kwargs):
+    return GuardedExecutor(lambda: sqlite3.connect(f"file:{db_path}?mode=ro", uri=True), **kwargs)
+
+def test_check_read_only_accepts_single_select(db_path):
+    executor = make_executor(db_path)
+    assert executor.check_read_only("SELECT 1;") == "SELECT 1"
+    assert executor.check_read_only("WITH t AS (SELECT 1) SELECT * FROM t") == "WITH t AS (SELECT 1) SELECT * FROM t"
+    # 字符串和注释中的分号不算多条语句
+    assert executor.check_read_only("SELECT ';' -- ;\n") == "SELECT ';' --"
+
+@pytest.mark.parametrize("sql_query", [
+    "DELETE FROM gse",
+    "SELECT 1; DROP TABLE gse",
+    "PRAGMA writable_schema = 1",
+    "",
+])
+def test_check_read_only_rejects_other_statements(db_path, sql_query):
+    with pytest.raises(SQLGuardError):
+        make_executor(db_path).check_read_only(sql_query)
+
+def test_apply_limit_appends_limit_only_when_missing(db_path):
+    executor = make_executor(db_path, max_rows=10)
+    assert executor.apply_limit("SELECT * FROM gse") == "SELECT * FROM gse\nLIMIT 11"
+    assert executor.apply_limit("SELECT * FROM gse LIMIT 5") == "SELECT * FROM gse LIMIT 5"
+    assert executor.apply_limit("SELECT * FROM gse WHERE title = 'limit 5'") == "SELECT * FROM gse WHERE title = 'limit 5'\nLIMIT 11"
+
+def test_full_scan_of_large_table_is_rejected(db_path):
+    executor = make_executor(db_path, large_table_rows=100)
+    with pytest.raises(FullScanError) as error:
+        executor.execute("SELECT title FROM gse WHERE title LIKE '%liver%'")
+    assert error.value.tables == ["gse"]
+
+def test_full_scans_of_several_large_tables_are_rejected(db_path):
+    executor = make_executor(db_path, large_table_rows=100)
+    with pytest.raises(FullScanError) as error:
+        executor.execute("SELECT * FROM gse, gsm WHERE gse.title LIKE '%a%' AND gsm.gsm_accession LIKE '%1%'")
+    assert sorted(error.value.tables) == ["gse", "gsm"]
+
+def test_indexed_lookup_and_small_tables_are_allowed(db_path):
+    executor = make_executor(db_path, large_table_rows=100)
+    assert "GSE7" in executor.execute("SELECT gse_accession FROM gse WHERE gse_accession = :acc", {"acc": "GSE7"})
+    assert "study 7" in make_executor(db_path).execute("SELECT title FROM gse WHERE title LIKE 'study 7 %'")
+
+def test_rows_are_truncated_to_max_rows(db_path):
+    result = make_executor(db_path, max_rows=3).execute("SELECT id FROM gse ORDER BY id")
+    assert result.startswith("[(1,), (2,), (3,)]")
+    assert "仅返回前3行" in result
+
+def test_rows_are_truncated_to_max_bytes(db_path):
+    result = make_executor(db_path, max_bytes=200).execute("SELECT title FROM gse ORDER BY id")
+    rows = result.split("\n")[0]
+    assert len(rows.encode("utf-8")) <= 200
+    assert "结果超过200字节" in result
+
+def test_result_within_limits_is_not_annotated(db_path):
+    result = make_executor(db_path).execute("SELECT COUNT(*) FROM gse")
+    assert result == "[(500,)]"
@@ -0,0 +1,31 @@
+import asyncio
+import time
+
+import pytest
+
+from app.config import settings
+from app.graph import nodes
+
+CONFIG = {"configurable": {"llm": object(), "model_provider": "test", "model_name": "test"}}
+
+@pytest.fixture
+def slow_search(monkeypatch):
+    def search_gse(query):
+        time.sleep(0.5)
+        return "全文检索结果"
+
+    monkeypatch.setattr(nodes, "search_gse", search_gse)
+    monkeypatch.setattr(settings, "branch_timeout", 0.05)
+
+def test_sql_node_timeout_covers_full_text_search(slow_search):
+    result = nodes.sql_node({"query": "找乳腺癌数据集"}, CONFIG)
+    assert result["sql_answer"].startswith("SQL查询超时")
+
+def test_asql_node_timeout_covers_full_text_search(slow_search):
+    result = asyncio.run(nodes.asql_node({"query": "找乳腺癌数据集"}, CONFIG))
+    assert result["sql_answer"].startswith("SQL查询超时")
+
+def test_sql_node_returns_full_text_result(monkeypatch):
+    monkeypatch.setattr(nodes, "search_gse", lambda query: "全文检索结果")
+    monkeypatch.setattr(settings, "branch_timeout", 1.0)
+    assert nodes.sql_node({"query": "找乳腺癌数据集"}, CONFIG) == {"sql_answer": "全文检索结果"}
@@ -0,0 +1,103 @@
+import json
+import sqlite3
+
+import pytest
+
+from app.tools.sql_template_cache import SQLTemplateCache, build_template, extract_literals
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / "bioinfo.db"
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE gse (id INTEGER PRIMARY KEY, gse_accession TEXT, title TEXT, sample_count INTEGER);
+        INSERT INTO gse (gse_accession, title, sample_count) VALUES ('GSE10000', 'liver', 12), ('GSE20000', 'brain', 30);
+    """)
+    conn.commit()
+    conn.close()
+    return str(path)
+
+def make_cache(tmp_path, db_path, **kwargs):
+    return SQLTemplateCache(
+        str(tmp_path / "templates.json"),
+        lambda: sqlite3.connect(f"file:{db_path}?mode=ro", uri=True),
+        **kwargs
+    )
+
+def test_extract_literals_replaces_accessions_numbers_and_quoted_strings():
+    key, literals = extract_literals("GSE10000有多少样本超过 20 个，标题含'liver'？")
+    # NFKC规范化并转为小写，全角标点变为半角
+    assert key == "<gse0>有多少样本超过 <num0> 个,标题含<str0>"
+    assert literals == [("gse0", "GSE10000"), ("str0", "liver"), ("num0", 20)]
+
+def test_questions_differing_only_in_literals_share_a_key():
+    key_a, _ = extract_literals("GSE10000有多少样本？")
+    key_b, _ = extract_literals("gse20000有多少样本")
+    key_c, _ = extract_literals("GSM10000有多少样本？")
+    assert key_a == key_b
+    assert key_a != key_c
+
+def test_repeated_literal_reuses_one_parameter():
+    _, literals = extract_literals("比较GSE1和GSE1")
+    assert literals == [("gse0", "GSE1")]
+
+def test_build_template_binds_string_and_number_literals():
+    _, literals = extract_literals("GSE10000的样本数是否大于20")
+    template = build_template(
+        "SELECT sample_count FROM gse WHERE gse_accession = 'GSE10000' AND sample_count > 20",
+        literals
+    )
+    assert template == "SELECT sample_count FROM gse WHERE gse_accession = :gse0 AND sample_count > :num0"
+
+def test_build_template_rejects_ambiguous_sql():
+    _, literals = extract_literals("GSE10000的标题")
+    # 字面量出现在LIKE模式中，无法整体替换
+    assert build_template("SELECT title FROM gse WHERE gse_accession LIKE '%GSE10000%'", literals) is None
+    # 字面量没有出现在SQL中
+    assert build_template("SELECT title FROM gse", literals) is None
+    # 同一个数字出现两次，无法确定对应关系
+    _, literals = extract_literals("列出100个数据集")
+    assert build_template("SELECT title FROM gse WHERE sample_count < 100 LIMIT 100", literals) is None
+    assert build_template("SELECT title FROM gse", []) is None
+
+def test_cached_template_binds_new_literals(tmp_path, db_path):
+    cache = make_cache(tmp_path, db_path)
+    assert cache.store("GSE10000有多少样本？", "SELECT sample_count FROM gse WHERE gse_accession = 'GSE10000'")
+
+    sql_query, parameters = cache.lookup("GSE20000有多少样本？")
+    assert parameters == {"gse0": "GSE20000"}
+    conn = sqlite3.connect(db_path)
+    assert conn.execute(sql_query, parameters).fetchall() == [(30,)]
+    conn.close()
+    assert cache.lookup("GSE20000的标题是什么") is None
+    assert cache.stats["hits"] == 1 and cache.stats["misses"] == 1
+
+def test_store_rejects_sql_that_does_not_compile(tmp_path, db_path):
+    cache = make_cache(tmp_path, db_path)
+    assert not cache.store("GSE10000有多少样本", "SELECT missing FROM gse WHERE gse_accession = 'GSE10000'")
+    assert cache.stats["rejected"] == 1
+
+def test_schema_change_invalidates_templates(tmp_path, db_path):
+    cache = make_cache(tmp_path, db_path)
+    cache.store("GSE10000有多少样本", "SELECT sample_count FROM gse WHERE gse_accession = 'GSE10000'")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE extra (id INTEGER)")
+    conn.commit()
+    conn.close()
+    assert cache.lookup("GSE20000有多少样本") is None
+    assert cache.get_stats()["size"] == 0
+
+def test_flush_merges_templates_from_other_workers(tmp_path, db_path):
+    first = make_cache(tmp_path, db_path, save_interval=3600)
+    second = make_cache(tmp_path, db_path, save_interval=3600)
+    first.store("GSE10000有多少样本", "SELECT sample_count FROM gse WHERE gse_accession = 'GSE10000'")
+    second.store("GSE10000的标题", "SELECT title FROM gse WHERE gse_accession = 'GSE10000'")
+    # 保存间隔内不写文件
+    assert not (tmp_path / "templates.json").exists()
+
+    first.flush()
+    second.flush()
+    with open(tmp_path / "templates.json", encoding="utf-8") as f:
+        saved = json.load(f)
+    assert set(saved) == {"<gse0>有多少样本", "<gse0>的标题"}
+    assert make_cache(tmp_path, db_path).lookup("GSE20000的标题") is not None
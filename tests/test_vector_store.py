@@ -0,0 +1,30 @@
+from types import SimpleNamespace
+
+import pytest
+
+chromadb = pytest.importorskip("chromadb")
+
+from app.tools.vector_store import apply_search_ef
+
+def open_collection(path):
+    client = chromadb.PersistentClient(path=path)
+    return client, client.get_or_create_collection("geo_docs", metadata={"hnsw:space": "cosine", "hnsw:search_ef": 10})
+
+def test_configured_search_ef_is_applied_to_existing_collection(tmp_path):
+    client, collection = open_collection(str(tmp_path))
+    collection.add(ids=["a", "b"], embeddings=[[1.0, 0.0], [0.0, 1.0]])
+    vectordb = SimpleNamespace(_client=client, _collection=collection)
+
+    assert apply_search_ef(vectordb, 96)
+    assert not apply_search_ef(vectordb, 96)
+
+    # 新的系统实例加载向量段时使用更新后的值
+    chromadb.api.client.SharedSystemClient.clear_system_cache()
+    client, collection = open_collection(str(tmp_path))
+    assert collection.query(query_embeddings=[[1.0, 0.0]], n_results=1)["ids"] == [["a"]]
+    from chromadb.segment import VectorReader
+    segment = client._server._manager.get_segment(collection.id, VectorReader)
+    assert segment._params.search_ef == 96
+    assert segment._index.ef == 96
+    # 集合的距离度量保持不变
+    assert segment._params.space == "cosine"